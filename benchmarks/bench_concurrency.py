@@ -0,0 +1,152 @@
+"""
+Benchmark of the concurrent-user capacity of the bot: thread pool versus asyncio.
+
+The threaded setup of python-telegram-bot 13 ran every handler on a pool of four worker
+threads, and each OpenAI call blocked its worker for the whole round trip. The asyncio setup
+runs every handler as a coroutine on one event loop.
+
+The benchmark puts SLOW_USERS users on the "Perfect my prompt" step (one OpenAI round trip of
+OPENAI_LATENCY seconds) and, at the same time, FAST_USERS users answering an ordinary step
+(three Telegram round trips of TELEGRAM_LATENCY seconds). It reports how long the fast users
+wait for their answer and how many updates per second each setup handles.
+
+The asyncio side drives the real handlers of peb.telegram_bot with stubbed Telegram and OpenAI
+backends; the threaded side replays the same I/O pattern on a four-worker thread pool.
+
+Usage:
+    poetry run python benchmarks/bench_concurrency.py [slow_users] [fast_users]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from peb import telegram_bot
+
+WORKERS = 4
+OPENAI_LATENCY = 2.0
+TELEGRAM_LATENCY = 0.05
+
+
+class FakeMessage:
+    """A Telegram message whose replies take TELEGRAM_LATENCY seconds."""
+
+    def __init__(self, text):
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):  # pylint: disable=unused-argument
+        """Simulate a sendMessage round trip."""
+        await asyncio.sleep(TELEGRAM_LATENCY)
+
+
+class FakeUpdate:  # pylint: disable=too-few-public-methods
+    """An update carrying a text message."""
+
+    def __init__(self, text, user_id=0):
+        self.message = FakeMessage(text)
+        self.callback_query = None
+        self.effective_user = SimpleNamespace(id=user_id)
+
+
+class FakeContext:  # pylint: disable=too-few-public-methods
+    """A callback context with its own user data."""
+
+    def __init__(self):
+        self.user_data = {"goal": "Learn Python", "persona": "Python expert",
+                          "task": "Teach basics of Python"}
+
+
+class FakeOpenAI:
+    """An OpenAI stub whose calls take OPENAI_LATENCY seconds."""
+
+    prompt_enhancement_instruction = "Refine the prompt"
+
+    async def moderate(self, prompt, user=None):  # pylint: disable=unused-argument
+        """Simulate a moderation round trip."""
+        return True, None, False
+
+    async def create(self, **kwargs):  # pylint: disable=unused-argument
+        """Simulate a completion round trip."""
+        await asyncio.sleep(OPENAI_LATENCY)
+        response = type("Response", (), {})()
+        message = type("Message", (), {"content": "Enhanced prompt"})()
+        response.choices = [type("Choice", (), {"message": message})()]
+        return True, None, response
+
+
+def run_threaded(slow_users, fast_users) -> tuple[list[float], float]:
+    """
+    Replay the workload on a thread pool where every I/O call blocks its worker.
+
+    Returns:
+    tuple: The latencies of the fast users and the total elapsed time.
+    """
+    def slow_job():
+        time.sleep(OPENAI_LATENCY)
+        time.sleep(2 * TELEGRAM_LATENCY)
+
+    def fast_job(submitted):
+        for _ in range(3):
+            time.sleep(TELEGRAM_LATENCY)
+        return time.perf_counter() - submitted
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        for _ in range(slow_users):
+            pool.submit(slow_job)
+        futures = [pool.submit(fast_job, time.perf_counter()) for _ in range(fast_users)]
+        latencies = [future.result() for future in futures]
+    return latencies, time.perf_counter() - begin
+
+
+async def run_asyncio(slow_users, fast_users) -> tuple[list[float], float]:
+    """
+    Run the workload through the coroutine handlers on a single event loop.
+
+    Returns:
+    tuple: The latencies of the fast users and the total elapsed time.
+    """
+    async def fast_job():
+        submitted = time.perf_counter()
+        await telegram_bot.goal(FakeUpdate("Learn Python"), FakeContext())
+        return time.perf_counter() - submitted
+
+    begin = time.perf_counter()
+    slow = [telegram_bot.open_ai(FakeUpdate("Go", user), FakeContext())
+            for user in range(slow_users)]
+    fast = [fast_job() for _ in range(fast_users)]
+    results = await asyncio.gather(*slow, *fast)
+    return list(results[slow_users:]), time.perf_counter() - begin
+
+
+def report(name, latencies, elapsed, updates) -> None:
+    """Print the summary of one run."""
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<9} fast-step p50={statistics.median(latencies) * 1000:8.1f} ms "
+        f"p95={p95 * 1000:8.1f} ms  elapsed={elapsed:6.2f} s  "
+        f"throughput={updates / elapsed:8.1f} updates/s"
+    )
+
+
+def main() -> None:
+    """Run both setups and print the comparison."""
+    slow_users = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    fast_users = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{slow_users} users at 'Perfect my prompt', {fast_users} users answering a step")
+    latencies, elapsed = run_threaded(slow_users, fast_users)
+    report("threaded", latencies, elapsed, slow_users + fast_users)
+    with patch.object(telegram_bot, "OpenAI", FakeOpenAI), \
+            patch.object(telegram_bot, "STREAM", False), \
+            patch.object(telegram_bot.logger, "disabled", True):
+        latencies, elapsed = asyncio.run(run_asyncio(slow_users, fast_users))
+    report("asyncio", latencies, elapsed, slow_users + fast_users)
+
+
+if __name__ == "__main__":
+    main()
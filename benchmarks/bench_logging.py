@@ -0,0 +1,84 @@
+"""
+Benchmark of the handler latency as the log volume grows, with a blocking and a queued writer.
+
+Each step runs the real "goal" handler of peb.telegram_bot (with Telegram stubbed, as in
+bench_state_table.py) and then logs a number of INFO lines. The log output is a stream whose
+every write takes WRITE_LATENCY seconds, like a busy terminal, a full pipe or a remote
+collector. With the former setup (logging.basicConfig, a StreamHandler on the handler's thread)
+every line adds a write to the step; with peb.log.setup_logging the lines are queued and written
+by a background thread, so the step latency stays flat.
+
+Usage:
+    poetry run python benchmarks/bench_logging.py [iterations]
+"""
+
+import io
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+from bench_state_table import drive, reply_text
+
+from peb import log, telegram_bot
+
+WRITE_LATENCY = 0.0002
+VOLUMES = (0, 5, 20)
+logger = logging.getLogger("peb.bench")
+
+
+class SlowStream(io.StringIO):
+    """A stream whose writes take WRITE_LATENCY seconds."""
+
+    def write(self, text) -> int:
+        time.sleep(WRITE_LATENCY)
+        return super().write(text)
+
+
+def configure(mode) -> None:
+    """Install the blocking or the queued writer on the root logger."""
+    log.stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    if mode == "blocking":
+        handler = logging.StreamHandler(SlowStream())
+        handler.setFormatter(logging.Formatter(log.TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        log.setup_logging("INFO", "json", sample_rate=1.0, stream=SlowStream())
+
+
+def measure(volume, iterations) -> float:
+    """Return the average microseconds of a step followed by volume log lines."""
+    update = SimpleNamespace(
+        message=SimpleNamespace(text="Learn Python", reply_text=reply_text),
+        callback_query=None,
+    )
+    context = SimpleNamespace(user_data={})
+    start = time.perf_counter()
+    for number in range(iterations):
+        drive(telegram_bot.process_dict["goal"](update, context))
+        for line in range(volume):
+            logger.info("Step %d line %d of user %s", number, line, "42")
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    """Measure both writers at each log volume."""
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"write latency {WRITE_LATENCY * 1e6:.0f} us")
+    print(f"{'lines/step':>10} {'blocking us':>12} {'queued us':>10}")
+    for volume in VOLUMES:
+        results = {}
+        for mode in ("blocking", "queued"):
+            configure(mode)
+            results[mode] = measure(volume, iterations)
+            # Drain the queue outside of the measurement.
+            log.stop_logging()
+        print(f"{volume:>10} {results['blocking']:12.1f} {results['queued']:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
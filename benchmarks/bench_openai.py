@@ -0,0 +1,129 @@
+"""
+Benchmark of the OpenAI wrapper against the local stub server of peb.openai_stub.
+
+N concurrent users each moderate a prompt and then request its enhancement, plain or streamed,
+through the real peb.open_ai.OpenAI wrapper: the pooled client, the resilience policy, the
+admission scheduler and the caches all run, only the API is local. The stub's latencies and
+injected failures are options, so the same run can be repeated with more 429s, more 5xx or a
+slower model and compared. The report gives the latency percentiles of the moderations, of the
+first streamed token and of the whole completions, the requests seen by the stub, the batches
+of moderations and the counters of the resilience policy. Running it with
+--moderation-batch-size 1 and then 16 shows the moderation requests saved by the batcher and
+the latency its window adds.
+
+Usage:
+    poetry run python benchmarks/bench_openai.py --users 200 --rate-limit-ratio 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ["OPENAI_CACHE_PATH"] = ""
+
+# pylint: disable=wrong-import-position
+from load_test import percentile
+
+from peb import open_ai
+from peb.client_manager import client_manager
+from peb.open_ai import OpenAI
+from peb.openai_stub import DISTRIBUTIONS, OpenAIStub
+
+
+async def user(number, stream, timings) -> None:
+    """Moderate then enhance a prompt, recording the latencies."""
+    openai_obj = OpenAI()
+    prompt = f"Teach the basics of topic {number} to absolute beginners"
+    start = time.perf_counter()
+    success, _, _ = await openai_obj.moderate(prompt, user=number)
+    timings["moderation" if success else "moderation errors"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    if not stream:
+        success, _, _ = await openai_obj.create("Refine", prompt, "", user=number)
+        timings["completion" if success else "completion errors"].append(
+            time.perf_counter() - start
+        )
+        return
+    success, _, deltas = await openai_obj.stream("Refine", prompt, "", user=number)
+    if not success:
+        timings["completion errors"].append(time.perf_counter() - start)
+        return
+    first = None
+    async for _ in deltas:
+        first = first or time.perf_counter() - start
+    timings["first token"].append(first)
+    timings["completion"].append(time.perf_counter() - start)
+
+
+async def bench(args) -> None:
+    """Run the users against the stub and print the report."""
+    stub = OpenAIStub(
+        latency=args.latency, distribution=args.distribution,
+        moderation_latency=args.moderation_latency, chunk_rate=args.chunk_rate,
+        words=args.words, rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after, error_ratio=args.error_ratio,
+        timeout_ratio=args.timeout_ratio, seed=args.seed,
+    )
+    await stub.start()
+    client_manager.base_url = stub.base_url
+    client_manager.prewarm_connections = 0
+    open_ai.moderation_batcher.max_size = args.moderation_batch_size
+    open_ai.moderation_batcher.window = args.moderation_batch_window
+    timings: dict[str, list[float]] = {
+        "moderation": [], "first token": [], "completion": [],
+        "moderation errors": [], "completion errors": [],
+    }
+    start = time.perf_counter()
+    await asyncio.gather(*(user(number, args.stream, timings) for number in range(args.users)))
+    elapsed = time.perf_counter() - start
+    await client_manager.close()
+    await stub.stop()
+
+    print(f"users={args.users} stream={args.stream} elapsed={elapsed:.2f} s")
+    print(f"{'latency':<18} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in timings.items():
+        if values:
+            print(f"{name:<18} {len(values):>6} {percentile(values, 0.50) * 1000:9.1f} "
+                  f"{percentile(values, 0.95) * 1000:9.1f} "
+                  f"{percentile(values, 0.99) * 1000:9.1f}")
+    print("stub:", dict(sorted(stub.stats().items())))
+    print("moderation batches:", open_ai.moderation_batcher.stats())
+    print("resilience:", open_ai.resilience.stats())
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--users", type=int, default=200, help="concurrent users")
+    parser.add_argument("--stream", type=int, choices=(0, 1), default=1,
+                        help="stream the completions (1) or not (0)")
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="mean seconds to the first token")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--moderation-latency", type=float, default=0.1)
+    parser.add_argument("--moderation-batch-size", type=int, default=16,
+                        help="prompts moderated in one request, 1 disables batching")
+    parser.add_argument("--moderation-batch-window", type=float, default=0.02,
+                        help="seconds a moderation waits for others")
+    parser.add_argument("--chunk-rate", type=float, default=50.0, help="chunks per second")
+    parser.add_argument("--words", type=int, default=100, help="words of a completion")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--timeout-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Run the benchmark."""
+    args = parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of the conversation persistence: cost of a change on the update path, and restore time.
+
+SESSIONS users, each with a full canvas of answers and an active conversation, are saved
+through SQLitePersistence the way the application does it: every change is handed to the
+persistence and written behind, in batches. The script reports the time spent on the update
+path per change, the time of the batched writes, and the time needed by a fresh persistence
+to restore every session, as on a restart.
+
+Usage:
+    poetry run python benchmarks/bench_persistence.py [sessions]
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from peb.data import BotState
+from peb.persistence import SQLitePersistence
+
+STATES = list(BotState)[1:BotState.OPENAI.value]
+
+
+def user_data(user_id) -> dict:
+    """Build the answers of a user who reached the end of the canvas."""
+    return {state.name.lower(): f"Answer of user {user_id} for {state.name}" for state in STATES}
+
+
+async def save(path, sessions) -> tuple[float, float, dict]:
+    """Save the sessions and return the update-path time, the total time and the counters."""
+    persistence = SQLitePersistence(path)
+    start = time.perf_counter()
+    for user_id in range(sessions):
+        await persistence.update_user_data(user_id, user_data(user_id))
+        await persistence.update_conversation(
+            "canvas", (user_id, user_id), STATES[user_id % len(STATES)]
+        )
+    update_path = time.perf_counter() - start
+    await persistence.flush()
+    return update_path, time.perf_counter() - start, persistence.stats()
+
+
+async def restore(path) -> tuple[float, int, int]:
+    """Restore the sessions and return the time taken and the numbers of users and chats."""
+    persistence = SQLitePersistence(path)
+    start = time.perf_counter()
+    users = await persistence.get_user_data()
+    conversations = await persistence.get_conversations("canvas")
+    elapsed = time.perf_counter() - start
+    await persistence.flush()
+    return elapsed, len(users), len(conversations)
+
+
+def main() -> None:
+    """Save and restore the sessions and print the timings."""
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.sqlite3")
+        update_path, total, stats = asyncio.run(save(path, sessions))
+        print(f"save     sessions={sessions} update path={update_path / (2 * sessions) * 1e6:.2f} "
+              f"us/change total={total * 1000:.1f} ms batches={stats['batches']}")
+        elapsed, users, conversations = asyncio.run(restore(path))
+        print(f"restore  users={users} conversations={conversations} "
+              f"time={elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
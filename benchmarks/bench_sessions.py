@@ -0,0 +1,73 @@
+"""
+Benchmark of the memory of the sessions: plain dicts of user data versus compact Sessions.
+
+SESSIONS users who reached the end of the canvas are kept in memory the way the application
+keeps them, in a dict by user id: once as the plain dicts of the user data used before, once as
+the Sessions of peb.session. The script reports the bytes per session measured with
+tracemalloc, with the answers and for the container alone, and the time of a sweep of the idle
+sessions.
+
+Usage:
+    poetry run python benchmarks/bench_sessions.py [sessions]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from peb.data import BotState
+from peb.session import MODERATION_KEY, Session, expired_sessions
+
+STATES = [state.name.lower() for state in list(BotState)[1:BotState.OPENAI.value]]
+
+
+def answers(user_id) -> list[tuple[str, object]]:
+    """Build the answers of a user who reached the end of the canvas, with their verdicts."""
+    fields = [(state, f"Answer of user {user_id} for {state}") for state in STATES]
+    verdicts = {state: [f"{user_id:016x}", False] for state in STATES[:3]}
+    return [*fields, ("openai", "OpenAI"), (MODERATION_KEY, verdicts)]
+
+
+def measure(session_type, sessions) -> tuple[float, float]:
+    """Return the bytes per session with the answers, and of the container alone."""
+    data = [answers(user_id) for user_id in range(sessions)]
+    tracemalloc.start()
+    store = {}
+    for user_id, fields in enumerate(data):
+        session = store[user_id] = session_type()
+        for key, value in fields:
+            session[key] = value
+    containers, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    tracemalloc.start()
+    data = [answers(user_id) for user_id in range(sessions)]
+    texts, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The lists holding the pairs are not part of a session.
+    pairs = sys.getsizeof(data[0]) + sum(sys.getsizeof(pair) for pair in data[0])
+    return (containers + texts) / sessions - pairs, containers / sessions
+
+
+def main() -> None:
+    """Measure both representations and the sweep, and print the comparison."""
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    plain, plain_containers = measure(dict, sessions)
+    compact, compact_containers = measure(Session, sessions)
+    print(f"sessions      {sessions:>8}")
+    print(f"dict          {plain:8.0f} bytes/session  (container {plain_containers:.0f})")
+    print(f"Session       {compact:8.0f} bytes/session  (container {compact_containers:.0f}, "
+          f"{plain_containers / compact_containers:.1f}x smaller)")
+
+    store = {user_id: Session(dict(answers(user_id))) for user_id in range(sessions)}
+    for user_id, session in store.items():
+        session.touch(now=float(user_id))
+    start = time.perf_counter()
+    evicted = expired_sessions(store, idle_timeout=sessions / 2, max_sessions=sessions // 4,
+                               now=float(sessions))
+    sweep = (time.perf_counter() - start) * 1000
+    print(f"sweep         {sweep:8.1f} ms  ({len(evicted)} sessions evicted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the near-duplicate prompt index: signature time, lookup time and memory.
+
+CANVASES canvases are indexed in a SimilarityIndex with the labels of the canvas as template,
+each one as if its enhancement had just been requested. Each canvas answers every step with one
+of the examples of peb.data, as most users do, so the canvases share most of their words and
+their signatures crowd a few values of the bands. The script then times the lookups of
+near-duplicates, indexed canvases with one answer edited, and of new canvases, other
+combinations of the examples, and reports the median and 99th percentile of a lookup, the
+SimHash time of a canvas and the memory of the process.
+
+Usage:
+    poetry run python benchmarks/bench_similarity.py [canvases]
+"""
+
+import random
+import resource
+import sys
+import time
+
+from peb.data import BotState, final_message, state_examples
+from peb.similarity import SimilarityIndex, simhash
+
+LOOKUPS = 2000
+EDITS = ["for my team", "in one week", "with examples", "step by step", "for free"]
+
+
+def canvas(rng, edit=None) -> str:
+    """Build a canvas from random examples, with a few words added to one answer if edit."""
+    answers = {name: rng.choice(state_examples[BotState[name.upper()]]) for name in final_message}
+    if edit is not None:
+        name = rng.choice(list(answers))
+        answers[name] = f"{answers[name]} {edit}"
+    return "".join(f"{final_message[name]} {answer}\n" for name, answer in answers.items())
+
+
+def timed(search, signatures) -> tuple[float, float, int]:
+    """Return the median and 99th percentile microseconds of a lookup, and the matches."""
+    times = []
+    hits = 0
+    for signature in signatures:
+        start = time.perf_counter()
+        hits += search(signature) is not None
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    return times[len(times) // 2], times[len(times) * 99 // 100], hits
+
+
+def main() -> None:
+    """Build the index and print the measurements."""
+    canvases = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    index = SimilarityIndex(threshold=0.9, max_entries=canvases, template=final_message.values())
+    start = time.perf_counter()
+    for seed in range(canvases):
+        index.insert(simhash(canvas(random.Random(seed)), index.ignore), str(seed))
+    build = time.perf_counter() - start
+
+    rng = random.Random(-1)
+    near = [simhash(canvas(random.Random(seed), rng.choice(EDITS)), index.ignore)
+            for seed in rng.sample(range(canvases), LOOKUPS)]
+    # random.Random(-n) is random.Random(n): the new canvases take the seeds above the indexed.
+    texts = [canvas(random.Random(canvases + number)) for number in range(LOOKUPS)]
+    start = time.perf_counter()
+    new = [simhash(text, index.ignore) for text in texts]
+    signature_time = (time.perf_counter() - start) / LOOKUPS * 1e6
+    near_p50, near_p99, near_hits = timed(index.search, near)
+    new_p50, new_p99, new_hits = timed(index.search, new)
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"entries          {index.stats()['entries']:>10}  (indexed in {build:.0f} s)")
+    print(f"simhash          {signature_time:10.1f} us/canvas")
+    print(f"near-duplicate   {near_p50:10.1f} us p50 {near_p99:8.1f} us p99  "
+          f"({near_hits}/{LOOKUPS} found)")
+    print(f"new canvas       {new_p50:10.1f} us p50 {new_p99:8.1f} us p99  "
+          f"({new_hits}/{LOOKUPS} found)")
+    print(f"max RSS          {memory:10.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the CPU cost of one conversation step: per-update rendering versus the
+compiled canvas table.
+
+Before the canvas table, every update joined the messages of the next state, rendered its
+examples and built its inline keyboard again. The "per-update" side replays that work; the
+"compiled" side runs the real handler of peb.telegram_bot, which looks the next step up in the
+table. Telegram is stubbed with a reply that returns at once, so only the bot's own work is
+measured.
+
+Usage:
+    poetry run python benchmarks/bench_state_table.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+# The steps are driven without an event loop, so no background moderation can be started.
+os.environ["OPENAI_INCREMENTAL_MODERATION"] = "0"
+
+# pylint: disable=wrong-import-position
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from peb import telegram_bot
+from peb.data import MESSAGE, BotState, state_code, state_examples, state_message
+
+STEPS = ["goal", "persona", "task", "whom", "how", "format", "constraints", "tool"]
+
+
+async def reply_text(text, **kwargs):  # pylint: disable=unused-argument
+    """Stand in for sendMessage without any I/O."""
+
+
+def legacy_keyboard(state) -> InlineKeyboardMarkup:
+    """Build the keyboard of a state as it was built on every update."""
+    if state not in ["start"]:
+        keyboard = [[InlineKeyboardButton("🏠️ Start again", callback_data="start")]]
+    if state not in ["start", "goal", "task", "persona", "openai", "whom"]:
+        keyboard.append([InlineKeyboardButton("⏩️ Skip this step ", callback_data=f"{state}")])
+    if state == "openai":
+        keyboard.append([InlineKeyboardButton("🧙‍♂️️ Perfect my prompt", callback_data="openai")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def legacy_step(update, context, state) -> BotState:
+    """Store the answer and render the next step from the raw data, as before the table."""
+    context.user_data[state] = update.message.text
+    next_state = BotState(state_code[state].value + 1)
+    next_code = next_state.name.lower()
+    examples = "\n- ".join(state_examples[next_state])
+    parts = [f"{'. '.join(state_message[next_state])}", f"Examples: \n- {examples}"]
+    text = "\n\n".join([*parts, MESSAGE])
+    await update.message.reply_text(text, reply_markup=legacy_keyboard(next_code))
+    return next_state
+
+
+def drive(coroutine):
+    """Run a coroutine that never suspends, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("The step suspended")
+
+
+def measure(step, iterations) -> float:
+    """Return the average microseconds of one step."""
+    update = SimpleNamespace(
+        message=SimpleNamespace(text="Learn Python", reply_text=reply_text),
+        callback_query=None,
+    )
+    context = SimpleNamespace(user_data={})
+    start = time.perf_counter()
+    for number in range(iterations):
+        drive(step(update, context, STEPS[number % len(STEPS)]))
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    """Measure both implementations and print the comparison."""
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    logging.disable(logging.INFO)
+
+    async def compiled_step(update, context, state):
+        return await telegram_bot.process_dict[state](update, context)
+
+    legacy = measure(legacy_step, iterations)
+    compiled = measure(compiled_step, iterations)
+    print(f"per-update  {legacy:7.2f} us/step")
+    print(f"compiled    {compiled:7.2f} us/step  ({legacy / compiled:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
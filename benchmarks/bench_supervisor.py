@@ -0,0 +1,109 @@
+"""
+Benchmark of the throughput of the supervisor mode with 1, 2, 4... worker processes.
+
+The fake Bot API server of bench_webhook.py runs in this process, without simulated network
+delay, and posts "/start" updates from new chats to the webhook of a supervisor running in its
+own process. The supervisor shards the chats among the workers, each running the real
+application built by peb.telegram_bot. The throughput is the number of updates answered per
+second with CONCURRENCY updates in flight.
+
+The throughput can only grow with the number of workers while there are idle cores: the script
+prints the number of cores of the machine next to the results.
+
+Usage:
+    poetry run python benchmarks/bench_supervisor.py [updates] [max_workers]
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ["TELEGRAM_PERSISTENCE_PATH"] = ""
+
+# pylint: disable=wrong-import-position
+import bench_webhook
+from bench_webhook import TOKEN, FakeBotApi
+from telegram import Bot
+
+from peb import telegram_bot
+from peb.client_manager import client_manager
+from peb.supervisor import Supervisor
+
+CONCURRENCY = 32
+WEBHOOK_PORT = 18443
+
+
+def run_worker(port, secret_token, base_url) -> None:
+    """Run a worker of the benchmark without logging."""
+    logging.disable(logging.INFO)
+    os.environ["TELEGRAM_TOKEN"] = TOKEN
+    client_manager.prewarm_connections = 0
+    telegram_bot.run_worker(port, secret_token, base_url)
+
+
+def run_supervisor(workers, base_url) -> None:
+    """Run the supervisor of the benchmark until it receives SIGTERM."""
+    logging.disable(logging.INFO)
+    supervisor = Supervisor(run_worker, (base_url,), workers=workers, base_port=18600)
+    asyncio.run(supervisor.run(
+        Bot(TOKEN, base_url=base_url), url=f"http://127.0.0.1:{WEBHOOK_PORT}/telegram",
+        secret_token="benchmark", path="/telegram", host="127.0.0.1", port=WEBHOOK_PORT,
+    ))
+
+
+async def bench(workers, updates) -> float:
+    """Measure the updates answered per second with the given number of workers."""
+    api = FakeBotApi()
+    await api.server.start()
+    supervisor = multiprocessing.get_context("spawn").Process(
+        target=run_supervisor, args=(workers, api.base_url)
+    )
+    supervisor.start()
+    while api.webhook_url is None:
+        if not supervisor.is_alive():
+            raise RuntimeError("The supervisor did not start")
+        await asyncio.sleep(0.05)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    chats = iter(range(1, 10 * updates))
+
+    async def send(client):
+        async with semaphore:
+            await api.send(next(chats), client)
+
+    limits = httpx.Limits(max_connections=CONCURRENCY)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await asyncio.gather(*(send(client) for _ in range(CONCURRENCY)))
+        start = time.perf_counter()
+        await asyncio.gather(*(send(client) for _ in range(updates)))
+        elapsed = time.perf_counter() - start
+    supervisor.terminate()
+    await asyncio.to_thread(supervisor.join)
+    await api.server.stop()
+    return updates / elapsed
+
+
+def main() -> None:
+    """Run the benchmark for an increasing number of workers."""
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    logging.disable(logging.INFO)
+    bench_webhook.RTT = 0.0
+    print(f"cores={os.cpu_count()} updates={updates} concurrency={CONCURRENCY}")
+    baseline = None
+    workers = 1
+    while workers <= max_workers:
+        throughput = asyncio.run(bench(workers, updates))
+        baseline = baseline or throughput
+        print(f"workers={workers} throughput={throughput:8.1f} updates/s "
+              f"speedup={throughput / baseline:.2f}x")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmark of the update-to-reply latency of the bot: long polling versus webhook.
+
+A fake Telegram Bot API server runs locally on the built-in HTTP server. It answers getMe,
+getUpdates (long polling), setWebhook, deleteWebhook and sendMessage, and injects "/start"
+updates from USERS users, either through getUpdates or by posting them to the webhook. The
+latency of an update is the time from its injection until the bot's reply to that chat reaches
+the fake server. Both modes run the real application built by peb.telegram_bot.
+
+Every Bot API call and every webhook delivery pays a simulated network round trip of RTT
+seconds between the bot and Telegram (half on the way in, half on the way out), so the
+long-polling cycle is measured as it behaves over a real network.
+
+Usage:
+    poetry run python benchmarks/bench_webhook.py [users] [rounds]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+# pylint: disable=wrong-import-position
+from peb import telegram_bot
+from peb.client_manager import client_manager
+from peb.http_server import HttpServer, Response
+from peb.webhook import SECRET_HEADER, run_webhook
+
+RTT = 0.05
+TOKEN = "123456:benchmark"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "peb", "username": "peb_bot"}
+
+
+class FakeBotApi:
+    """A local stand-in for the Telegram Bot API that measures reply latencies."""
+
+    def __init__(self):
+        methods = ["getMe", "getUpdates", "setWebhook", "deleteWebhook", "sendMessage"]
+        self.server = HttpServer(
+            {f"/bot{TOKEN}/{method}": self.handle for method in methods}
+        )
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.webhook_url = None
+        self.secret_token = None
+        self.sent_at: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.replied: dict[int, asyncio.Future] = {}
+        self.update_id = 0
+
+    @property
+    def base_url(self) -> str:
+        """Return the base URL the bot uses for this server."""
+        return f"http://127.0.0.1:{self.server.port}/bot"
+
+    async def handle(self, request) -> Response:
+        """Answer a Bot API method."""
+        method = request.path.rsplit("/", 1)[1]
+        await asyncio.sleep(RTT / 2)
+        params = {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+        result: object = True
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self.get_updates(float(params.get("timeout", "0")))
+        elif method == "setWebhook":
+            self.webhook_url = params["url"]
+            self.secret_token = params.get("secret_token")
+        elif method == "deleteWebhook":
+            self.webhook_url = None
+        elif method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self.latencies.append(time.perf_counter() - self.sent_at.pop(chat_id))
+            self.replied.pop(chat_id).set_result(None)
+            result = {"message_id": 1, "date": int(time.time()), "text": params["text"],
+                      "chat": {"id": chat_id, "type": "private"}}
+        await asyncio.sleep(RTT / 2)
+        return Response(200, json.dumps({"ok": True, "result": result}).encode(),
+                        {"Content-Type": "application/json"})
+
+    async def get_updates(self, timeout) -> list:
+        """Long-poll: wait up to timeout seconds for updates."""
+        try:
+            updates = [await asyncio.wait_for(self.updates.get(), timeout or 0.001)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    def make_update(self, chat_id) -> dict:
+        """Build a "/start" update from the given chat."""
+        self.update_id += 1
+        user = {"id": chat_id, "is_bot": False, "first_name": "user"}
+        return {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id, "date": int(time.time()), "from": user,
+                "chat": {"id": chat_id, "type": "private"}, "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }
+
+    async def send(self, chat_id, client) -> None:
+        """Inject an update from the chat and wait for the bot's reply."""
+        replied = self.replied[chat_id] = asyncio.get_running_loop().create_future()
+        update = self.make_update(chat_id)
+        self.sent_at[chat_id] = time.perf_counter()
+        if self.webhook_url:
+            await asyncio.sleep(RTT / 2)
+            await client.post(self.webhook_url, json=update,
+                              headers={SECRET_HEADER: self.secret_token or ""})
+        else:
+            self.updates.put_nowait(update)
+        # Without network delay, the reply can arrive before the webhook request returns.
+        await replied
+
+
+async def drive(api, users, rounds) -> None:
+    """Send rounds of concurrent updates from the users."""
+    async with httpx.AsyncClient() as client:
+        for number in range(rounds):
+            # Every round uses new chats: "/start" only enters a conversation that is not active.
+            chats = range(number * users + 1, (number + 1) * users + 1)
+            await asyncio.gather(*(api.send(chat_id, client) for chat_id in chats))
+
+
+async def bench_polling(users, rounds) -> list[float]:
+    """Measure the latencies with long polling."""
+    api = FakeBotApi()
+    await api.server.start()
+    application = telegram_bot.build_application(TOKEN, api.base_url)
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0.0, timeout=10)
+        await drive(api, users, rounds)
+        await application.updater.stop()
+        await application.stop()
+    await api.server.stop()
+    return api.latencies
+
+
+async def bench_webhook(users, rounds) -> list[float]:
+    """Measure the latencies with the webhook."""
+    api = FakeBotApi()
+    await api.server.start()
+    application = telegram_bot.build_application(TOKEN, api.base_url)
+    stop = asyncio.Event()
+    runner = asyncio.create_task(
+        run_webhook(application, "http://127.0.0.1:18443/telegram", secret_token="benchmark",
+                    path="/telegram", host="127.0.0.1", port=18443, stop_event=stop)
+    )
+    while api.webhook_url is None:
+        await asyncio.sleep(0.01)
+    await drive(api, users, rounds)
+    stop.set()
+    await runner
+    await api.server.stop()
+    return api.latencies
+
+
+def report(name, latencies) -> None:
+    """Print the latency summary of one mode."""
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{name:<8} updates={len(latencies):5d} "
+          f"p50={statistics.median(latencies) * 1000:7.2f} ms p95={p95 * 1000:7.2f} ms")
+
+
+def main() -> None:
+    """Run both modes and print the comparison."""
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    logging.disable(logging.INFO)
+    client_manager.prewarm_connections = 0
+    report("polling", asyncio.run(bench_polling(users, rounds)))
+    report("webhook", asyncio.run(bench_webhook(users, rounds)))
+
+
+if __name__ == "__main__":
+    main()
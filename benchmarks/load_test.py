@@ -0,0 +1,306 @@
+"""
+End-to-end load test: N simulated users walk through the whole canvas at the same time.
+
+Every user sends "/start", answers goal, persona, task and whom, then answers or skips (with
+the inline button) each optional step, answers or skips quality and finally presses
+"Perfect my prompt". The updates are real telegram.Update objects processed by the application
+built by peb.telegram_bot, so the whole stack runs: the ConversationHandler, the handlers, the
+rendering and the Bot API requests.
+
+The Bot API is a local fake server that answers every call after TELEGRAM_LATENCY seconds and
+records what the bot sends to each chat. OpenAI is replaced by a stub whose moderation takes
+the moderation latency and whose completion streams its words over the completion latency.
+
+The latency of a step is the time the application takes to process the user's update, which
+ends once the fake Bot API has accepted the bot's answer: the next step with its keyboard, or
+the whole enhanced prompt for the last step. A user whose answer is missing counts as an error.
+The report gives the throughput and the p50/p95/p99 latency per state; with --output the
+results are also written as JSON so that CI runs can be compared.
+
+Usage:
+    poetry run python benchmarks/load_test.py --users 1000 --output load_test.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+
+# pylint: disable=wrong-import-position
+from telegram import Update
+
+from peb import telegram_bot
+from peb.client_manager import client_manager
+from peb.data import canvas, steps
+from peb.http_server import HttpServer, Response
+
+TOKEN = "123456:load-test"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "peb", "username": "peb_bot"}
+ENHANCED = " ".join(["Act as an expert Python teacher and explain the basics step by step."] * 8)
+ANSWERS = {
+    "goal": "Learn Python", "persona": "Python expert", "task": "Teach basics of Python",
+    "whom": "For absolute beginners", "how": "Use a step-by-step approach",
+    "format": "Bullet points", "constraints": "Maximum 500 words", "tool": "Pareto principle",
+    "quality": "Think step-by-step",
+}
+
+
+class FakeBotApi:
+    """A local stand-in for the Telegram Bot API recording the messages sent to each chat."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        methods = ["getMe", "sendMessage", "editMessageText", "answerCallbackQuery"]
+        self.server = HttpServer({f"/bot{TOKEN}/{method}": self.handle for method in methods})
+        self.inboxes: dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.calls = 0
+        self.message_id = 0
+
+    @property
+    def base_url(self) -> str:
+        """Return the base URL the bot uses for this server."""
+        return f"http://127.0.0.1:{self.server.port}/bot"
+
+    async def handle(self, request) -> Response:
+        """Answer a Bot API method after the simulated latency."""
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        method = request.path.rsplit("/", 1)[1]
+        params = {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+        result: object = True
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            self.message_id += 1
+            message_id = int(params.get("message_id", self.message_id))
+            self.inboxes[chat_id].put_nowait((method, params))
+            result = {"message_id": message_id, "date": int(time.time()), "text": params["text"],
+                      "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+        return Response(200, json.dumps({"ok": True, "result": result}).encode(),
+                        {"Content-Type": "application/json"})
+
+
+class FakeOpenAI:
+    """An OpenAI stub with configurable latencies."""
+
+    prompt_enhancement_instruction = "Refine the prompt"
+    moderation_latency = 0.0
+    completion_latency = 0.0
+
+    async def moderate(self, prompt, user=None):  # pylint: disable=unused-argument
+        """Simulate a moderation round trip."""
+        await asyncio.sleep(self.moderation_latency)
+        return True, None, False
+
+    async def create(self, **kwargs):  # pylint: disable=unused-argument
+        """Simulate a completion round trip."""
+        await asyncio.sleep(self.completion_latency)
+        message = SimpleNamespace(content=ENHANCED)
+        return True, None, SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def stream(self, **kwargs):  # pylint: disable=unused-argument
+        """Simulate a completion streamed word by word over the completion latency."""
+        words = ENHANCED.split(" ")
+
+        async def deltas():
+            for number, word in enumerate(words):
+                await asyncio.sleep(self.completion_latency / len(words))
+                yield word if number == 0 else " " + word
+
+        return True, None, deltas()
+
+
+class User:
+    """A simulated user walking through the canvas in its own chat."""
+
+    def __init__(self, user_id, api, application, skip_ratio, think_time, rng):
+        self.user_id = user_id
+        self.api = api
+        self.application = application
+        self.skip_ratio = skip_ratio
+        self.think_time = think_time
+        self.rng = rng
+        self.update_id = user_id * 100
+        self.last_text = ""
+        self.latencies: list[tuple[str, float]] = []
+
+    def _update(self, payload) -> Update:
+        """Build an update of this user from the given payload."""
+        self.update_id += 1
+        return Update.de_json({"update_id": self.update_id, **payload}, self.application.bot)
+
+    def message(self, text) -> Update:
+        """Build an update with a text message of the user."""
+        user = {"id": self.user_id, "is_bot": False, "first_name": "user"}
+        message = {"message_id": self.update_id, "date": int(time.time()), "from": user,
+                   "chat": {"id": self.user_id, "type": "private"}, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return self._update({"message": message})
+
+    def button(self, data) -> Update:
+        """Build an update with a press on a button of the last step shown."""
+        user = {"id": self.user_id, "is_bot": False, "first_name": "user"}
+        message = {"message_id": self.update_id, "date": int(time.time()), "from": BOT_USER,
+                   "chat": {"id": self.user_id, "type": "private"}, "text": self.last_text}
+        return self._update({"callback_query": {
+            "id": str(self.update_id), "from": user, "chat_instance": str(self.user_id),
+            "data": data, "message": message,
+        }})
+
+    async def step(self, state, update, done) -> None:
+        """Process an update of the user and check that the bot's answer satisfies done."""
+        inbox = self.api.inboxes[self.user_id]
+        start = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies.append((state, time.perf_counter() - start))
+        answered = False
+        while not inbox.empty():
+            method, params = inbox.get_nowait()
+            if done(method, params):
+                answered = True
+                self.last_text = params["text"]
+        if not answered:
+            raise RuntimeError(f"User {self.user_id} got no answer at step {state}")
+        if self.think_time:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+    async def run(self) -> None:
+        """Walk through the canvas, from /start to the enhanced prompt."""
+        def next_step(method, params):
+            return method == "sendMessage" and "reply_markup" in params
+
+        await self.step("start", self.message("/start"), next_step)
+        for name, _, skippable in canvas[1:-1]:
+            if skippable and self.rng.random() < self.skip_ratio:
+                await self.step(name, self.button(name), next_step)
+            else:
+                await self.step(name, self.message(ANSWERS[name]), next_step)
+        await self.step("openai", self.button("openai"),
+                        lambda method, params: params["text"] == ENHANCED)
+
+
+def percentile(values, fraction) -> float:
+    """Return the given percentile of the values, by the nearest-rank method."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+async def load_test(args) -> dict:
+    """Run the users and return the results."""
+    api = FakeBotApi(args.telegram_latency)
+    await api.server.start()
+    FakeOpenAI.moderation_latency = args.moderation_latency
+    FakeOpenAI.completion_latency = args.completion_latency
+    telegram_bot.OpenAI = FakeOpenAI
+    telegram_bot.STREAM = args.stream
+    telegram_bot.STREAM_EDIT_INTERVAL = args.edit_interval
+    client_manager.prewarm_connections = 0
+    application = telegram_bot.build_application(TOKEN, api.base_url)
+    rng = random.Random(args.seed)
+    users = [User(1000 + number, api, application, args.skip_ratio, args.think_time,
+                  random.Random(rng.random())) for number in range(args.users)]
+
+    async def start_user(number, user):
+        await asyncio.sleep(args.ramp_up * number / args.users)
+        await user.run()
+
+    async with application:
+        await application.start()
+        begin = time.perf_counter()
+        results = await asyncio.gather(*(start_user(number, user)
+                                          for number, user in enumerate(users)),
+                                        return_exceptions=True)
+        elapsed = time.perf_counter() - begin
+        await application.stop()
+    await api.server.stop()
+
+    errors = [repr(result) for result in results if isinstance(result, Exception)]
+    by_state = defaultdict(list)
+    for user in users:
+        for state, latency in user.latencies:
+            by_state[state].append(latency)
+    updates = sum(len(latencies) for latencies in by_state.values())
+    return {
+        "config": vars(args),
+        "elapsed": elapsed,
+        "conversations": args.users - len(errors),
+        "updates": updates,
+        "throughput": updates / elapsed,
+        "bot_api_calls": api.calls,
+        "errors": errors[:10],
+        "states": {
+            name: {
+                "count": len(by_state[name]),
+                "mean": statistics.fmean(by_state[name]),
+                "p50": percentile(by_state[name], 0.50),
+                "p95": percentile(by_state[name], 0.95),
+                "p99": percentile(by_state[name], 0.99),
+            }
+            for name in steps if by_state[name]
+        },
+    }
+
+
+def report(results) -> None:
+    """Print the results as a table."""
+    print(f"users={results['config']['users']} conversations={results['conversations']} "
+          f"updates={results['updates']} elapsed={results['elapsed']:.2f} s "
+          f"throughput={results['throughput']:.1f} updates/s "
+          f"bot_api_calls={results['bot_api_calls']} errors={len(results['errors'])}")
+    print(f"{'state':<12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, state in results["states"].items():
+        print(f"{name:<12} {state['count']:>6} {state['p50'] * 1000:9.1f} "
+              f"{state['p95'] * 1000:9.1f} {state['p99'] * 1000:9.1f}")
+    for error in results["errors"]:
+        print("error:", error)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--users", type=int, default=100, help="simulated users")
+    parser.add_argument("--skip-ratio", type=float, default=0.3,
+                        help="probability of skipping an optional step with its button")
+    parser.add_argument("--telegram-latency", type=float, default=0.05,
+                        help="seconds per Bot API call")
+    parser.add_argument("--moderation-latency", type=float, default=0.3,
+                        help="seconds per moderation")
+    parser.add_argument("--completion-latency", type=float, default=3.0,
+                        help="seconds to generate the enhanced prompt")
+    parser.add_argument("--stream", type=int, choices=(0, 1), default=1,
+                        help="stream the enhanced prompt (1) or send it at the end (0)")
+    parser.add_argument("--edit-interval", type=float, default=1.0,
+                        help="seconds between two edits of a streamed message")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="average seconds a user waits between two steps")
+    parser.add_argument("--ramp-up", type=float, default=0.0,
+                        help="seconds over which the users start")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Run the load test, print the report and write the JSON results."""
+    args = parse_args()
+    logging.disable(logging.INFO)
+    results = asyncio.run(load_test(args))
+    report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
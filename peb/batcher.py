@@ -0,0 +1,141 @@
+"""
+This module groups the requests of concurrent users into batched API calls.
+
+Some endpoints, like the OpenAI moderation endpoint, accept a list of inputs and answer with one
+result per input. At peak many users are moderated in the same few milliseconds, each paying a
+full round trip and one request of the quota. The MicroBatcher class holds the items submitted
+during a short window, sends them in one call and hands each caller its own result.
+
+Features:
+- Items are sent when the window after the first pending item has elapsed, or as soon as the
+    batch is full.
+- Identical items of a batch are sent once and their callers share the result.
+- A failed call raises its error in every caller of the batch.
+- The users of the items are handed to send with the batch, for the admission of the call.
+- Metrics: peb_batch_size, peb_batch_wait_seconds (the latency added by the window) and
+    peb_batch_requests_saved_total, labelled by the name of the batcher.
+
+Usage:
+    batcher = MicroBatcher(send_moderations, "moderation", max_size=16, window=0.02)
+    result = await batcher.submit(prompt, user)
+
+Note:
+- A max_size of 1 sends every item at once, without waiting.
+- The items must be hashable. send is called with the unique items and the users of the batch,
+    in the order they were submitted, and must return the results in the order of its items.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from peb.metrics import batch_requests_saved, batch_size, batch_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects the items of concurrent callers and sends them in batches.
+
+    Attributes:
+    send (Callable[[list, list], Awaitable[list]]): Sends a batch of items, given with their
+        users, and returns their results.
+    name (str): The label of the batcher in the metrics.
+    max_size (int): The most items sent in one call.
+    window (float): Seconds a batch waits for more items after its first one.
+    batches (int): Calls made so far.
+    items (int): Items sent so far.
+
+    Methods:
+    submit(item, user): Add an item to the next batch and return its result.
+    stats(): Return the counters of the batcher.
+    """
+
+    def __init__(self, send, name, max_size=16, window=0.02):
+        self.send = send
+        self.name = name
+        self.max_size = max(1, max_size)
+        self.window = window
+        self.batches = 0
+        self.items = 0
+        self._pending: list[tuple[object, object, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item, user=None):
+        """
+        Add an item to the next batch and wait for its result.
+
+        Parameters:
+        item (Hashable): The item, like a prompt to moderate.
+        user (Optional[Hashable]): The user submitting the item.
+
+        Returns:
+        The result of the item.
+
+        Raises:
+        Exception: The error of the call that sent the batch.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # The pending items of a closed loop can never be sent.
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+        future = loop.create_future()
+        self._pending.append((item, user, future, time.monotonic()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Send the pending items in the background."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = self._loop.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch) -> None:
+        """Send one batch and hand each caller its result or the error."""
+        now = time.monotonic()
+        for _, _, _, queued in batch:
+            batch_wait_seconds.observe(now - queued, self.name)
+        batch_size.observe(len(batch), self.name)
+        if len(batch) > 1:
+            batch_requests_saved.inc(self.name, amount=len(batch) - 1)
+        self.batches += 1
+        self.items += len(batch)
+        unique = list(dict.fromkeys(item for item, _, _, _ in batch))
+        users = list(dict.fromkeys(user for _, user, _, _ in batch if user is not None))
+        try:
+            results = dict(zip(unique, await self.send(unique, users)))
+        except Exception as error:  # pylint: disable=broad-except
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for item, _, future, _ in batch:
+            if not future.done():
+                future.set_result(results[item])
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the batcher.
+
+        Returns:
+        dict: The calls made, the items sent and the average batch size.
+        """
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "average_size": self.items / self.batches if self.batches else 0.0,
+        }
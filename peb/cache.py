@@ -0,0 +1,244 @@
+"""
+This module provides a two-tier cache for the results of OpenAI requests.
+
+Many users go through almost the same canvas, so the same enhancement request is sent again and
+again. The TieredCache class keeps the recent results in an in-memory LRU tier and, optionally,
+every result in an SQLite database that survives restarts.
+
+Features:
+- In-memory LRU tier bounded by a number of entries.
+- Optional on-disk SQLite tier (WAL mode) bounded by a number of entries, evicting the least
+    recently used rows.
+- Time-to-live expiry on both tiers.
+- Hit, miss, eviction and expiry counters.
+- make_key(), a normalized hash of the request parameters used as the cache key.
+
+Usage:
+    cache = TieredCache(max_entries=1024, ttl=3600, path="cache.sqlite3")
+    key = make_key(instruction, prompt, enhancement, model, temperature)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.put(key, value)
+
+Note:
+- Values are strings; callers serialize their objects before storing them.
+- The SQLite database is opened on first use, so creating a cache does not touch the disk.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text) -> str:
+    """
+    Normalize a text so that differences in whitespace do not change the cache key.
+
+    Parameters:
+    text (str): The text to normalize.
+
+    Returns:
+    str: The text with its whitespace collapsed and stripped.
+    """
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def make_key(*parts) -> str:
+    """
+    Build a cache key from the parameters of a request.
+
+    Text parameters are normalized with normalize() before hashing.
+
+    Parameters:
+    parts: The parameters of the request (strings, numbers or None).
+
+    Returns:
+    str: The SHA-256 hex digest of the normalized parameters.
+    """
+    normalized = [normalize(part) if isinstance(part, str) else part for part in parts]
+    payload = json.dumps(normalized, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    A cache with an in-memory LRU tier and an optional SQLite tier.
+
+    Attributes:
+    max_entries (int): Maximum number of entries kept in memory.
+    ttl (float): Seconds an entry stays valid after it is stored.
+    path (str | None): Path of the SQLite database, or None for a memory-only cache.
+    max_disk_entries (int): Maximum number of rows kept in the SQLite database.
+    hits (int): Lookups answered by the memory tier.
+    disk_hits (int): Lookups answered by the SQLite tier.
+    misses (int): Lookups that found no valid entry.
+    evictions (int): Entries evicted to respect the size bounds.
+    expirations (int): Entries dropped because their time-to-live elapsed.
+
+    Methods:
+    get(key): Return the value stored for the key, or None.
+    put(key, value): Store a value for the key.
+    stats(): Return the counters and sizes of the cache.
+    close(): Close the SQLite database.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600.0, path=None, max_disk_entries=100_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._disk_entries = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Open the SQLite database on first use.
+
+        Returns:
+        sqlite3.Connection: The connection to the database.
+        """
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return self._db
+
+    def _remember(self, key, created, value) -> None:
+        """
+        Store an entry in the memory tier, evicting the least recently used one if needed.
+
+        Parameters:
+        key (str): The cache key.
+        created (float): The time the entry was created.
+        value (str): The cached value.
+
+        Returns:
+        None
+        """
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key) -> str | None:
+        """
+        Return the value stored for the key.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        str | None: The cached value, or None if there is no valid entry.
+        """
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            created, value = entry
+            if now - created < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._memory[key]
+            self.expirations += 1
+        if self.path:
+            db = self._connection()
+            row = db.execute(
+                "SELECT value, created FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                value, created = row
+                if now - created < self.ttl:
+                    db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+                    self._remember(key, created, value)
+                    self.disk_hits += 1
+                    return value
+                db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._disk_entries -= 1
+                self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, value) -> None:
+        """
+        Store a value for the key in every tier.
+
+        Parameters:
+        key (str): The cache key.
+        value (str): The value to cache.
+
+        Returns:
+        None
+        """
+        now = time.time()
+        self._remember(key, now, value)
+        if not self.path:
+            return
+        db = self._connection()
+        exists = db.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone()
+        db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+            (key, value, now, now),
+        )
+        if exists is None:
+            self._disk_entries += 1
+        overflow = self._disk_entries - self.max_disk_entries
+        if overflow > 0:
+            db.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                (overflow,),
+            )
+            self._disk_entries -= overflow
+            self.evictions += overflow
+
+    def stats(self) -> dict:
+        """
+        Return the counters and the sizes of the cache.
+
+        Returns:
+        dict: The hit, miss, eviction and expiry counters and the number of entries per tier.
+        """
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_entries,
+        }
+
+    def close(self) -> None:
+        """
+        Close the SQLite database.
+
+        Returns:
+        None
+        """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,174 @@
+"""
+This module manages the HTTP connections used to reach the OpenAI API.
+
+A single ClientManager owns one pooled httpx.AsyncClient and the openai.AsyncOpenAI client built
+on top of it. Every request of the process goes through this pool, so TCP and TLS connections
+are reused across conversations instead of being set up on the user-facing path.
+
+Features:
+- Configurable pool limits, keep-alive expiry, HTTP/2 and connect timeout.
+- prewarm(): opens TLS connections to the API at startup so the first users do not pay for the
+    handshakes.
+- pool_stats(): number of open, idle and busy connections in the pool.
+- close(): closes the pool on shutdown.
+
+Environment Variables:
+- OPENAI_ORGANIZATION: Specifies the OpenAI organization ID.
+- OPENAI_API_KEY: Provides the API key for authenticating with the OpenAI service.
+- OPENAI_BASE_URL: Base URL of the API, for example the local stub of peb.openai_stub
+    (default https://api.openai.com/v1).
+- OPENAI_MAX_CONNECTIONS: Maximum number of connections in the pool (default 100).
+- OPENAI_MAX_KEEPALIVE: Maximum number of idle connections kept alive (default 20).
+- OPENAI_KEEPALIVE_EXPIRY: Seconds an idle connection is kept alive (default 60).
+- OPENAI_HTTP2: Set to 1 to negotiate HTTP/2 (requires httpx[http2]; default 0).
+- OPENAI_CONNECT_TIMEOUT: Seconds allowed to open a connection (default 5).
+- OPENAI_PREWARM_CONNECTIONS: Connections opened by prewarm() (default 4).
+
+Usage:
+    await client_manager.prewarm()
+    response = await client_manager.client.moderations.create(input="Example prompt")
+    logger.info("Pool: %s", client_manager.pool_stats())
+    await client_manager.close()
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class ClientManager:
+    """
+    Owner of the pooled HTTP client shared by every OpenAI request of the process.
+
+    The clients are created on first use, so building a manager neither requires the OpenAI
+    credentials nor a running event loop.
+
+    Attributes:
+    base_url (str | None): Base URL of the API; None uses the OpenAI API.
+    limits (httpx.Limits): Pool size and keep-alive limits.
+    http2 (bool): Whether HTTP/2 is negotiated.
+    connect_timeout (float): Seconds allowed to open a connection.
+    prewarm_connections (int): Connections opened by prewarm().
+
+    Methods:
+    client: The shared openai.AsyncOpenAI client.
+    prewarm(): Open connections to the API ahead of the first request.
+    pool_stats(): Return the state of the connection pool.
+    close(): Close the pool.
+    """
+
+    def __init__(self, base_url=None, max_connections=100, max_keepalive=20,
+                 keepalive_expiry=60.0, http2=False, connect_timeout=5.0,
+                 prewarm_connections=4):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.prewarm_connections = prewarm_connections
+        self._http_client: httpx.AsyncClient | None = None
+        self._client: openai.AsyncOpenAI | None = None
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        """
+        Return the openai.AsyncOpenAI client, creating the pool on first use.
+
+        Returns:
+        openai.AsyncOpenAI: The shared asynchronous client.
+        """
+        if self._client is None:
+            self._http_client = httpx.AsyncClient(
+                limits=self.limits,
+                http2=self.http2,
+                timeout=httpx.Timeout(None, connect=self.connect_timeout),
+            )
+            self._client = openai.AsyncOpenAI(
+                organization=os.getenv("OPENAI_ORGANIZATION"),
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=self.base_url,
+                http_client=self._http_client,
+                # Retries are handled by peb.resilience.
+                max_retries=0,
+            )
+        return self._client
+
+    async def prewarm(self) -> None:
+        """
+        Open prewarm_connections connections to the API and leave them idle in the pool.
+
+        Any HTTP response means that the TCP and TLS handshakes are done; failures are only
+        logged because the pool opens connections on demand anyway. Every phase of these
+        requests is bounded by connect_timeout, since the pool itself has no read timeout and
+        a stalled endpoint must not hold up the startup.
+
+        Returns:
+        None
+        """
+        client = self.client
+        url = str(client.base_url)
+        results = await asyncio.gather(
+            *(self._http_client.head(url, timeout=self.connect_timeout)
+              for _ in range(self.prewarm_connections)),
+            return_exceptions=True,
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        if failures:
+            logger.warning("Could not prewarm %d connections: %s", len(failures), failures[0])
+        logger.info("OpenAI connection pool: %s", self.pool_stats())
+
+    def pool_stats(self) -> dict:
+        """
+        Return the state of the connection pool.
+
+        Returns:
+        dict: The number of open, idle and busy connections and the pool limits.
+        """
+        connections = []
+        if self._http_client is not None:
+            # httpx does not expose the pool; its transport keeps an httpcore pool.
+            transport = self._http_client._transport  # pylint: disable=protected-access
+            pool = getattr(transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "busy": len(connections) - idle,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive": self.limits.max_keepalive_connections,
+        }
+
+    async def close(self) -> None:
+        """
+        Close the pool and forget the clients.
+
+        Returns:
+        None
+        """
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._http_client = None
+
+
+client_manager = ClientManager(
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+    max_keepalive=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+    http2=os.getenv("OPENAI_HTTP2", "0") == "1",
+    connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+    prewarm_connections=int(os.getenv("OPENAI_PREWARM_CONNECTIONS", "4")),
+)
@@ -14,6 +14,9 @@ Features:
     and prompt quality.
 - State code mapping: A dictionary linking string representations of states to their corresponding
     enum values, facilitating easy state management and reference.
+- Canvas table: the declarative order of the steps and whether they can be skipped, compiled at
+    import time into Step records holding everything a step renders: the joined text, the
+    examples, the whole reply and its inline keyboard.
 
 The module is structured to provide all necessary data and configurations for managing the
 conversation states in a Telegram bot that interfaces with OpenAI's GPT model.
@@ -42,6 +45,11 @@ Note:
 """
 
 from enum import Enum
+from typing import NamedTuple, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+MESSAGE = "Choose an option or enter your answer:"
 
 
 class BotState(Enum):
@@ -325,3 +333,114 @@ state_message = {
     ],
     BotState.OPENAI: ["Connect with OpenAI"],
 }
+
+
+# The steps of the canvas in the order they are asked, and whether they can be skipped.
+canvas = (
+    ("start", BotState.START, False),
+    ("goal", BotState.GOAL, False),
+    ("persona", BotState.PERSONA, False),
+    ("task", BotState.TASK, False),
+    ("whom", BotState.WHOM, False),
+    ("how", BotState.HOW, True),
+    ("format", BotState.FORMAT, True),
+    ("constraints", BotState.CONSTRAINTS, True),
+    ("tool", BotState.TOOL, True),
+    ("quality", BotState.QUALITY, True),
+    ("openai", BotState.OPENAI, False),
+)
+
+
+class Step(NamedTuple):
+    """
+    A step of the canvas, compiled from the canvas table.
+
+    Attributes:
+    - name: The name of the step, also used as the key of its answer and as callback data.
+    - state: The state of the conversation while the step is asked.
+    - next_state: The state that follows the step, None for the last one.
+    - skippable: Whether the step has a button to skip it.
+    - text: The messages of the step joined into one text.
+    - examples: The rendered examples of the step.
+    - parts: The text and the examples, sent as separate messages in multi-message mode.
+    - reply: The text, the examples and MESSAGE, sent as one message.
+    - keyboard: The inline keyboard shown with the step.
+    """
+
+    name: str
+    state: BotState
+    next_state: Optional[BotState]
+    skippable: bool
+    text: str
+    examples: str
+    parts: tuple
+    reply: str
+    keyboard: InlineKeyboardMarkup
+
+
+def render_examples(state) -> str:
+    """
+    Render the examples of a state as a bulleted list.
+
+    Parameters:
+    state (BotState): The state for which examples are needed.
+
+    Returns:
+    str: Formatted string containing examples.
+    """
+    return_str = "\n- ".join(state_examples[state])
+    return f"Examples: \n- {return_str}"
+
+
+def render_keyboard(name, skippable) -> InlineKeyboardMarkup:
+    """
+    Build the inline keyboard of a step.
+
+    Parameters:
+    name (str): The name of the step.
+    skippable (bool): Whether the step has a button to skip it.
+
+    Returns:
+    InlineKeyboardMarkup: The keyboard with the buttons of the step.
+    """
+    keyboard = []
+    if name != "start":
+        keyboard.append([InlineKeyboardButton("🏠️ Start again", callback_data="start")])
+    if skippable:
+        keyboard.append([InlineKeyboardButton("⏩️ Skip this step ", callback_data=name)])
+    if name == "openai":
+        keyboard.append([InlineKeyboardButton("🧙‍♂️️ Perfect my prompt", callback_data="openai")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def compile_canvas(table) -> dict[str, Step]:
+    """
+    Compile the canvas table into the steps rendered by the bot.
+
+    Parameters:
+    table (tuple): The (name, state, skippable) rows of the canvas, in order.
+
+    Returns:
+    dict[str, Step]: The compiled steps, by name.
+    """
+    steps = {}
+    for index, (name, state, skippable) in enumerate(table):
+        next_state = table[index + 1][1] if index + 1 < len(table) else None
+        text = ". ".join(state_message[state])
+        rendered_examples = render_examples(state)
+        steps[name] = Step(
+            name=name,
+            state=state,
+            next_state=next_state,
+            skippable=skippable,
+            text=text,
+            examples=rendered_examples,
+            parts=(text, rendered_examples),
+            reply="\n\n".join([text, rendered_examples, MESSAGE]),
+            keyboard=render_keyboard(name, skippable),
+        )
+    return steps
+
+
+steps = compile_canvas(canvas)
+steps_by_state = {step.state: step for step in steps.values()}
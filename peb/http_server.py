@@ -0,0 +1,283 @@
+"""
+This module implements a small asynchronous HTTP/1.1 server on top of asyncio streams.
+
+The bot needs to receive HTTP requests in a few places (the Telegram webhook, for example) and
+only needs a tiny subset of HTTP: requests with a Content-Length body, keep-alive connections
+and plain or chunked responses. This server covers that subset with the standard library, on
+the same event loop as the bot, without adding a web framework to the dependencies.
+
+Features:
+- Request and Response classes holding the parsed request and the reply.
+- Routing on the request path, with 404 and 405 answers for unknown routes and methods.
+- Keep-alive connections, and streamed responses sent with chunked transfer encoding.
+- Read timeouts: a request must arrive within read_timeout once started, and an idle keep-alive
+    connection is closed after idle_timeout; at most MAX_HEADERS header lines are read.
+- Optional TLS through an ssl.SSLContext.
+
+Usage:
+    async def hello(request):
+        return Response(200, b"Hello")
+
+    server = HttpServer({"/hello": hello}, host="127.0.0.1", port=8080)
+    await server.start()
+    ...
+    await server.stop()
+
+Note:
+- The server is meant to sit behind a reverse proxy or to serve local clients; it does not
+    implement pipelining, multipart bodies or request streaming.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 10 * 1024 * 1024
+MAX_HEADERS = 100
+READ_TIMEOUT = 10.0
+IDLE_TIMEOUT = 60.0
+
+
+class Request:  # pylint: disable=too-few-public-methods
+    """
+    An HTTP request received by the server.
+
+    Attributes:
+    method (str): The request method, in upper case.
+    path (str): The path of the request target.
+    query (dict[str, list[str]]): The parsed query string.
+    headers (dict[str, str]): The headers, with lower-case names.
+    body (bytes): The request body.
+    """
+
+    def __init__(self, method, target, headers, body=b""):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = parse_qs(parts.query)
+        self.headers = headers
+        self.body = body
+
+
+class Response:  # pylint: disable=too-few-public-methods
+    """
+    An HTTP response sent by the server.
+
+    Attributes:
+    status (int): The status code.
+    body (bytes): The response body, used when stream is None.
+    headers (dict[str, str]): Additional response headers.
+    stream (AsyncIterator[bytes] | None): Chunks sent with chunked transfer encoding.
+    """
+
+    def __init__(self, status=200, body=b"", headers=None, stream=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.stream = stream
+
+
+class HttpServer:
+    """
+    An asyncio HTTP/1.1 server routing requests by path.
+
+    Attributes:
+    routes (dict[str, Callable]): Coroutine handlers by path; each takes a Request and returns
+        a Response.
+    host (str): The address to listen on.
+    port (int): The port to listen on; 0 picks a free port, available after start().
+    ssl (ssl.SSLContext | None): The TLS context, or None for plain HTTP.
+    methods (tuple[str, ...]): The request methods accepted.
+    read_timeout (float): Seconds allowed to read a request once its first line arrived.
+    idle_timeout (float): Seconds a keep-alive connection may wait for its next request.
+
+    Methods:
+    start(): Start listening.
+    stop(): Stop listening and close the connections.
+    """
+
+    def __init__(self, routes, host="127.0.0.1", port=0, ssl=None, methods=("GET", "POST"),
+                 read_timeout=READ_TIMEOUT, idle_timeout=IDLE_TIMEOUT):
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.methods = methods
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """
+        Start listening for connections.
+
+        Returns:
+        None
+        """
+        self._server = await asyncio.start_server(
+            self._serve, self.host, self.port, ssl=self.ssl
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP server listening on %s:%d", self.host, self.port)
+
+    async def stop(self) -> None:
+        """
+        Stop listening and close the open connections.
+
+        Returns:
+        None
+        """
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_request(self, reader) -> Request | None:
+        """
+        Read one request from the connection.
+
+        Parameters:
+        reader (asyncio.StreamReader): The connection's reader.
+
+        Returns:
+        Request | None: The request, or None if the client closed the connection or left it
+            idle for longer than idle_timeout.
+
+        Raises:
+        ValueError: If the request is malformed or too large.
+        asyncio.TimeoutError: If the request is not read within read_timeout.
+        """
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not line.strip():
+            return None
+        return await asyncio.wait_for(self._read_rest(reader, line), self.read_timeout)
+
+    @staticmethod
+    async def _read_rest(reader, line) -> Request:
+        """
+        Read the headers and the body of a request whose first line was read.
+
+        Parameters:
+        reader (asyncio.StreamReader): The connection's reader.
+        line (bytes): The request line.
+
+        Returns:
+        Request: The request.
+        """
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        for _ in range(MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("Too many request headers")
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method.upper(), target, headers, body)
+
+    async def _dispatch(self, request) -> Response:
+        """
+        Route the request to its handler.
+
+        Parameters:
+        request (Request): The request.
+
+        Returns:
+        Response: The response of the handler, or an error response.
+        """
+        handler = self.routes.get(request.path)
+        if handler is None:
+            return Response(HTTPStatus.NOT_FOUND)
+        if request.method not in self.methods:
+            return Response(HTTPStatus.METHOD_NOT_ALLOWED)
+        try:
+            return await handler(request)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error handling %s %s", request.method, request.path)
+            return Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    async def _write_response(writer, response, keep_alive) -> None:
+        """
+        Write the response to the connection.
+
+        Parameters:
+        writer (asyncio.StreamWriter): The connection's writer.
+        response (Response): The response to send.
+        keep_alive (bool): Whether the connection stays open afterwards.
+
+        Returns:
+        None
+        """
+        status = HTTPStatus(response.status)
+        headers = {"Connection": "keep-alive" if keep_alive else "close", **response.headers}
+        if response.stream is None:
+            headers["Content-Length"] = str(len(response.body))
+        else:
+            headers["Transfer-Encoding"] = "chunked"
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        writer.write(head.encode("latin-1") + b"\r\n")
+        if response.stream is None:
+            writer.write(response.body)
+        else:
+            async for chunk in response.stream:
+                if chunk:
+                    writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _serve(self, reader, writer) -> None:
+        """
+        Serve the requests of one connection until it is closed.
+
+        Parameters:
+        reader (asyncio.StreamReader): The connection's reader.
+        writer (asyncio.StreamWriter): The connection's writer.
+
+        Returns:
+        None
+        """
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    await self._write_response(writer, Response(HTTPStatus.BAD_REQUEST), False)
+                    break
+                except asyncio.TimeoutError:
+                    await self._write_response(writer, Response(HTTPStatus.REQUEST_TIMEOUT), False)
+                    break
+                if request is None:
+                    break
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
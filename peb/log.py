@@ -0,0 +1,208 @@
+"""
+This module configures the logging of the bot: a queue-based background writer with structured
+JSON output, sampling of high-frequency events and redaction of the users' text.
+
+The handlers only put their log records on a queue; a listener thread formats them and writes
+them to stderr. Writing to a slow terminal, pipe or log collector therefore never blocks the
+event loop that serves the conversations. Large payloads (the user data, the API responses)
+are only logged at DEBUG, so at the default INFO level they are not even formatted.
+
+Features:
+- setup_logging(): installs the queue handler on the root logger and starts the writer thread.
+- JsonFormatter: one JSON object per line with the time, level, logger, message and extras.
+- SamplingFilter: keeps a share of the records logged with extra=SAMPLED.
+- redact(): wraps user text so that only its length is logged, unless LOG_REDACT is 0.
+
+Environment Variables:
+- LOG_LEVEL: Level of the root logger (default INFO).
+- LOG_FORMAT: json (default) or text.
+- LOG_SAMPLE_RATE: Share of the high-frequency records that are kept (default 0.1).
+- LOG_REDACT: Set to 0 to log the users' text in clear, for debugging (default 1).
+
+Usage:
+    setup_logging()
+    logger.info("@ %s", state, extra=SAMPLED)
+    logger.debug("Prompt: %s", redact(prompt))
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_REDACT = os.getenv("LOG_REDACT", "1") == "1"
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Pass as extra to mark a high-frequency record, kept with probability LOG_SAMPLE_RATE.
+SAMPLED = {"sampled": True}
+# Arguments of these types cannot change after the call, so formatting them can be deferred
+# to the writer thread.
+IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+# The attributes of every LogRecord; the others come from extra and are added to the JSON.
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName", "sampled",
+}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class Redacted:  # pylint: disable=too-few-public-methods
+    """
+    User text that is logged as its length only.
+
+    Attributes:
+    value (object): The text, or the collection of texts.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        if not LOG_REDACT:
+            return str(self.value)
+        if isinstance(self.value, str):
+            return f"<redacted {len(self.value)} chars>"
+        return f"<redacted {type(self.value).__name__} of {len(self.value)} items>"
+
+    __repr__ = __str__
+
+
+def redact(value) -> Redacted:
+    """
+    Wrap user text so that it is redacted when logged.
+
+    Parameters:
+    value (str | Sized): The text, or a collection of texts such as the user data.
+
+    Returns:
+    Redacted: The wrapped value.
+    """
+    return Redacted(value)
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Keep only a share of the records marked as sampled; the others always pass.
+
+    Attributes:
+    rate (float): The share of the sampled records that are kept.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as one JSON object: time, level, logger, message, the extra fields and the
+    exception, if any.
+    """
+
+    def format(self, record) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    A queue handler that leaves the formatting to the writer thread.
+
+    The standard QueueHandler formats every record in the logging thread. This one only merges
+    the message when an argument is mutable, since the object could change before the writer
+    formats it; the exception traceback is rendered at once for the same reason.
+    """
+
+    def prepare(self, record) -> logging.LogRecord:
+        if record.args and not all(isinstance(arg, IMMUTABLE_TYPES) for arg in record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE,
+                  stream=None) -> logging.handlers.QueueListener:
+    """
+    Send the records of the process through a queue to a writer thread.
+
+    Calling it again replaces the previous configuration.
+
+    Parameters:
+    level (str | int): The level of the root logger.
+    log_format (str): json or text.
+    sample_rate (float): The share of the sampled records that are kept.
+    stream (TextIO | None): Where the records are written, stderr by default.
+
+    Returns:
+    logging.handlers.QueueListener: The running writer.
+    """
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(
+        JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Write the queued records and stop the writer thread.
+
+    Returns:
+    None
+    """
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
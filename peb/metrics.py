@@ -0,0 +1,494 @@
+"""
+This module collects the bot's metrics and serves them in the Prometheus text format.
+
+The handlers of the conversation and the OpenAI calls are timed into histograms, their errors
+are counted, the tokens reported by the API are summed and a gauge counts the conversations in
+each state of the canvas. Everything lives in process memory: recording a sample is a dict
+lookup, a bisect and a few additions, with no lock since the bot runs on a single event loop.
+The samples are only formatted when /metrics is scraped.
+
+Features:
+- Counter, Gauge and Histogram metrics with labels, grouped in a Registry.
+- Gauges whose value is computed at scrape time by a function.
+- timed(): decorator recording the latency and the errors of a coroutine function.
+- handle(): HTTP handler answering GET /metrics from the built-in HTTP server.
+- start_server() and stop_server(): a dedicated /metrics server.
+
+Metrics:
+- peb_handler_seconds{handler}: latency of the conversation handlers.
+- peb_handler_errors_total{handler, error}: exceptions raised by the handlers.
+- peb_openai_request_seconds{call, outcome}: latency of OpenAI.create, stream and moderate,
+    with outcome ok, error, cached or similar (a near-duplicate prompt was reused).
+- peb_openai_errors_total{call, error}: failed OpenAI requests by error type.
+- peb_openai_tokens_total{kind, source}: prompt and completion tokens, as reported in the usage
+    of the responses (source usage) and as estimated locally for every completion, streamed or
+    not (source estimate).
+- peb_scheduler_queue_depth{scheduler}, peb_scheduler_wait_seconds{scheduler}: requests
+    waiting for admission under the RPM/TPM quotas, and the time each request waited for it,
+    0 when admitted at once (peb.scheduler).
+- peb_resilience_retries_total{upstream, error}: retried attempts by transient error type.
+- peb_breaker_trips_total{upstream}, peb_breaker_short_circuits_total{upstream}: openings of
+    the circuit breaker and calls it rejected (peb.resilience).
+- peb_conversations{state}: conversations currently in each state.
+- peb_sessions: sessions of users kept in memory.
+- peb_sessions_evicted_total{reason}: sessions evicted because they were idle or beyond the
+    cap of sessions (peb.session).
+- peb_prefilter_verdicts_total{verdict}: prompts blocked, passed or found uncertain by the local
+    pre-moderation filter.
+- peb_field_moderations_total{outcome}: answers checked by the final step, whose verdict was
+    reused from a background moderation, awaited from a running one or requested.
+- peb_collapsed_requests_total{call}: requests answered by a request already in flight: for the
+    same user and prompt, like "Perfect my prompt" pressed twice (call openai), or the same
+    completion requested by any user (calls create and stream, peb.singleflight).
+- peb_speculations_total{outcome}: enhancements requested while the users review their draft,
+    by outcome: hit (handed over to "Perfect my prompt"), miss (the draft changed), failed (the
+    request failed) or cancelled (the user started again or left); the hit rate is hit / total.
+- peb_speculation_wasted_tokens_total: tokens of the cancelled speculations, as reported in the
+    usage, or estimated from the draft if the request was still running.
+- peb_batch_size{batch}, peb_batch_wait_seconds{batch}, peb_batch_requests_saved_total{batch}:
+    items per batched request, time the items waited for their batch and requests saved by
+    batching (peb.batcher).
+
+Usage:
+    @timed(handler_seconds, handler_errors, "goal")
+    async def goal(update, context): ...
+
+    await start_server("127.0.0.1", 9464)
+    # curl http://127.0.0.1:9464/metrics
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import logging
+import time
+from http import HTTPStatus
+
+from peb.http_server import HttpServer, Response
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape(value) -> str:
+    """
+    Escape a label value for the text format.
+
+    Parameters:
+    value (object): The label value.
+
+    Returns:
+    str: The escaped value.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra="") -> str:
+    """
+    Format a set of labels for the text format.
+
+    Parameters:
+    names (tuple[str, ...]): The label names.
+    values (tuple): The label values.
+    extra (str): An already formatted label appended to the others, like le="0.5".
+
+    Returns:
+    str: The labels between braces, or an empty string without labels.
+    """
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """
+    Base class of the metrics: a name, a help text and label names.
+
+    Attributes:
+    name (str): The metric name.
+    documentation (str): The help text.
+    labelnames (tuple[str, ...]): The names of the labels.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> list[str]:
+        """
+        Return the sample lines of the metric.
+
+        Returns:
+        list[str]: The lines, without the HELP and TYPE comments.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        Return the metric in the text format.
+
+        Returns:
+        str: The HELP and TYPE comments followed by the samples.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+
+    Methods:
+    inc(*labelvalues, amount=1): Add amount to the counter of the label values.
+    value(*labelvalues): Return the counter of the label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount=1) -> None:
+        """
+        Add amount to the counter of the label values.
+
+        Parameters:
+        labelvalues: The values of the labels, in the order of labelnames.
+        amount (float): The increment.
+
+        Returns:
+        None
+        """
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        """
+        Return the counter of the label values.
+
+        Parameters:
+        labelvalues: The values of the labels.
+
+        Returns:
+        float: The counter, 0 if it was never incremented.
+        """
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{format_labels(self.labelnames, values)} {value}"
+                for values, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, set directly or computed at scrape time.
+
+    Methods:
+    set(value, *labelvalues): Set the gauge of the label values.
+    set_function(function): Compute the gauge at scrape time.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._function = None
+
+    def set(self, value, *labelvalues) -> None:
+        """
+        Set the gauge of the label values.
+
+        Parameters:
+        value (float): The value.
+        labelvalues: The values of the labels.
+
+        Returns:
+        None
+        """
+        self._values[labelvalues] = value
+
+    def set_function(self, function) -> None:
+        """
+        Compute the gauge at scrape time.
+
+        Parameters:
+        function (Callable[[], dict[tuple, float]]): Returns the values keyed by label values.
+
+        Returns:
+        None
+        """
+        self._function = function
+
+    def samples(self) -> list[str]:
+        values = self._function() if self._function is not None else self._values
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                for labels, value in values.items()]
+
+
+class Histogram(Metric):
+    """
+    Observations counted in cumulative buckets, with their sum and count.
+
+    Attributes:
+    buckets (tuple[float, ...]): The upper bounds of the buckets, without +Inf.
+
+    Methods:
+    observe(value, *labelvalues): Record an observation.
+    count(*labelvalues): Return the number of observations.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: the count of each bucket (not cumulative), then +Inf, and the sum.
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value, *labelvalues) -> None:
+        """
+        Record an observation.
+
+        Parameters:
+        value (float): The observed value.
+        labelvalues: The values of the labels.
+
+        Returns:
+        None
+        """
+        state = self._values.get(labelvalues)
+        if state is None:
+            state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def count(self, *labelvalues) -> int:
+        """
+        Return the number of observations of the label values.
+
+        Parameters:
+        labelvalues: The values of the labels.
+
+        Returns:
+        int: The number of observations.
+        """
+        state = self._values.get(labelvalues)
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> list[str]:
+        lines = []
+        for values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = format_labels(self.labelnames, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics exposed together on /metrics.
+
+    Methods:
+    register(metric): Add a metric and return it.
+    render(): Return every metric in the text format.
+    """
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric) -> Metric:
+        """
+        Add a metric to the registry.
+
+        Parameters:
+        metric (Metric): The metric.
+
+        Returns:
+        Metric: The same metric.
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Return every metric in the text format.
+
+        Returns:
+        str: The exposition.
+        """
+        return "".join(metric.render() for metric in self.metrics)
+
+
+registry = Registry()
+handler_seconds = registry.register(Histogram(
+    "peb_handler_seconds", "Latency of the conversation handlers.", ("handler",)
+))
+handler_errors = registry.register(Counter(
+    "peb_handler_errors_total", "Exceptions raised by the conversation handlers.",
+    ("handler", "error"),
+))
+openai_seconds = registry.register(Histogram(
+    "peb_openai_request_seconds", "Latency of the OpenAI requests.", ("call", "outcome")
+))
+openai_errors = registry.register(Counter(
+    "peb_openai_errors_total", "Failed OpenAI requests.", ("call", "error")
+))
+openai_tokens = registry.register(Counter(
+    "peb_openai_tokens_total", "Tokens of the OpenAI completions.", ("kind", "source")
+))
+prefilter_verdicts = registry.register(Counter(
+    "peb_prefilter_verdicts_total", "Verdicts of the local pre-moderation filter.", ("verdict",)
+))
+batch_size = registry.register(Histogram(
+    "peb_batch_size", "Items sent in one batched request.", ("batch",), SIZE_BUCKETS
+))
+batch_wait_seconds = registry.register(Histogram(
+    "peb_batch_wait_seconds", "Time the items waited for their batch to be sent.", ("batch",),
+    WAIT_BUCKETS,
+))
+batch_requests_saved = registry.register(Counter(
+    "peb_batch_requests_saved_total", "Requests saved by sending the items in batches.",
+    ("batch",),
+))
+field_moderations = registry.register(Counter(
+    "peb_field_moderations_total", "Answers checked by the final step, by outcome.", ("outcome",)
+))
+collapsed_requests = registry.register(Counter(
+    "peb_collapsed_requests_total", "Requests collapsed into an identical one in flight.",
+    ("call",),
+))
+speculations = registry.register(Counter(
+    "peb_speculations_total", "Speculative enhancements of the drafts, by outcome.", ("outcome",)
+))
+speculation_wasted_tokens = registry.register(Counter(
+    "peb_speculation_wasted_tokens_total", "Tokens of the speculative enhancements not used."
+))
+scheduler_queue_depth = registry.register(Gauge(
+    "peb_scheduler_queue_depth", "Requests waiting for admission under the quotas.",
+    ("scheduler",),
+))
+scheduler_wait_seconds = registry.register(Histogram(
+    "peb_scheduler_wait_seconds", "Time the requests waited for admission.", ("scheduler",)
+))
+resilience_retries = registry.register(Counter(
+    "peb_resilience_retries_total", "Attempts retried after a transient error.",
+    ("upstream", "error"),
+))
+breaker_trips = registry.register(Counter(
+    "peb_breaker_trips_total", "Openings of the circuit breaker.", ("upstream",)
+))
+breaker_short_circuits = registry.register(Counter(
+    "peb_breaker_short_circuits_total", "Calls rejected while the circuit breaker was open.",
+    ("upstream",),
+))
+conversations = registry.register(Gauge(
+    "peb_conversations", "Conversations currently in each state.", ("state",)
+))
+sessions = registry.register(Gauge("peb_sessions", "Sessions of users kept in memory."))
+sessions_evicted = registry.register(Counter(
+    "peb_sessions_evicted_total", "Sessions evicted, by reason.", ("reason",)
+))
+
+
+def timed(histogram, errors, name):
+    """
+    Build a decorator recording the latency and the exceptions of a coroutine function.
+
+    Parameters:
+    histogram (Histogram): The latencies, with one label.
+    errors (Counter): The exceptions, labelled by name and exception type.
+    name (str): The label value of the function.
+
+    Returns:
+    Callable: The decorator.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception as error:
+                errors.inc(name, type(error).__name__)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+
+def record_usage(usage, source="usage") -> None:
+    """
+    Add the tokens of a completion to peb_openai_tokens_total.
+
+    Parameters:
+    usage (openai.types.CompletionUsage | None): The usage of the response.
+    source (str): Where the numbers come from: usage or estimate.
+
+    Returns:
+    None
+    """
+    if usage is None:
+        return
+    openai_tokens.inc("prompt", source, amount=usage.prompt_tokens)
+    openai_tokens.inc("completion", source, amount=usage.completion_tokens)
+
+
+async def handle(request) -> Response:  # pylint: disable=unused-argument
+    """
+    Answer a scrape with every metric of the registry.
+
+    Parameters:
+    request (peb.http_server.Request): The request.
+
+    Returns:
+    peb.http_server.Response: The metrics in the text format.
+    """
+    return Response(HTTPStatus.OK, registry.render().encode(), {"Content-Type": CONTENT_TYPE})
+
+
+_server: HttpServer | None = None
+
+
+async def start_server(host, port) -> None:
+    """
+    Start serving /metrics on its own port.
+
+    Parameters:
+    host (str): The address to listen on.
+    port (int): The port to listen on.
+
+    Returns:
+    None
+    """
+    global _server  # pylint: disable=global-statement
+    _server = HttpServer({"/metrics": handle}, host, port, methods=("GET",))
+    await _server.start()
+
+
+async def stop_server() -> None:
+    """
+    Stop the /metrics server, if it was started.
+
+    Returns:
+    None
+    """
+    global _server  # pylint: disable=global-statement
+    if _server is not None:
+        await _server.stop()
+        _server = None
@@ -19,19 +19,75 @@ Features:
 Environment Variables:
 - OPENAI_ORGANIZATION: Specifies the OpenAI organization ID.
 - OPENAI_API_KEY: Provides the API key for authenticating with the OpenAI service.
+- OPENAI_COMPLETION_TIMEOUT: Seconds allowed for a completion request (default 60).
+- OPENAI_MODERATION_TIMEOUT: Seconds allowed for a moderation request (default 10).
+- OPENAI_MAX_RETRIES: Retries of a failed request (default 3).
+- OPENAI_BACKOFF_BASE: Backoff cap of the first retry, in seconds (default 0.5).
+- OPENAI_BACKOFF_MAX: Maximum delay between retries, in seconds (default 20).
+- OPENAI_BREAKER_THRESHOLD: Consecutive failed requests that open the breaker (default 5).
+- OPENAI_BREAKER_RESET: Seconds the breaker stays open (default 30).
+- OPENAI_RPM: Completion requests per minute allowed by the quota (default 0, no limit).
+- OPENAI_TPM: Completion tokens per minute allowed by the quota (default 0, no limit).
+- OPENAI_MODERATION_RPM: Moderation requests per minute allowed (default 0, no limit).
+- OPENAI_CACHE_PATH: SQLite file of the completion cache (default peb_cache.sqlite3);
+    empty keeps the cache in memory only.
+- OPENAI_CACHE_TTL: Seconds a cached completion stays valid (default 604800, one week).
+- OPENAI_CACHE_ENTRIES: Completions kept in memory (default 1024).
+- OPENAI_CACHE_DISK_ENTRIES: Completions kept in the SQLite file (default 100000).
+- OPENAI_MODERATION_CACHE_TTL: Seconds a moderation verdict stays valid (default 86400).
+- OPENAI_MODERATION_CACHE_ENTRIES: Moderation verdicts kept in memory (default 4096).
+- OPENAI_MODERATION_BATCH_SIZE: Most prompts moderated in one request (default 16, 1 disables
+    batching).
+- OPENAI_MODERATION_BATCH_WINDOW: Seconds a moderation waits for others to share its request
+    (default 0.02).
+- OPENAI_SIMILAR_PROMPTS, OPENAI_SIMILARITY_THRESHOLD, OPENAI_SIMILAR_ENTRIES: The reuse of the
+    enhancements of near-duplicate prompts, see peb.similarity.
+- OPENAI_PREFILTER, OPENAI_PREFILTER_SKIP_REMOTE, OPENAI_BLOCKED_TERMS: The local
+    pre-moderation filter, see peb.prefilter.
 
 Usage:
 The module is intended to be used in an environment where an OpenAI API key is available.
 It should be imported and instantiated within an application that requires automated
     content generation and moderation.
 
+All requests go through a single asynchronous client (openai.AsyncOpenAI) shared by the
+whole process, so the calls never block the event loop that serves the Telegram conversations.
+The client and its connection pool are owned by peb.client_manager, and every call has its own
+timeout. Both calls go through one peb.resilience.Resilience policy: transient errors are
+retried with jittered exponential backoff, and while the upstream keeps failing the circuit
+breaker answers at once with a friendly message. Each attempt is first admitted by a
+peb.scheduler.AdmissionScheduler, which keeps the requests and estimated tokens per minute
+under the organization's quotas and serves the waiting users in turn.
+Completions can also be streamed (OpenAI.stream): the text deltas are yielded as they arrive,
+so the first words reach the user after the model's first-token latency.
+Successful completions are kept in a TieredCache (memory LRU plus SQLite) keyed on the
+normalized request, so a canvas that was already enhanced is answered without a new request.
+With OPENAI_SIMILAR_PROMPTS, a canvas that differs from an enhanced one by a few words is
+answered with its enhancement too, found by the peb.similarity.SimilarityIndex of the prompts.
+A completion requested while the same request, from any user, is in flight awaits it instead of
+making its own (peb.singleflight); an identical stream waits for the one in flight to end and
+is answered with its completion.
+Moderation verdicts (flag and category scores) are kept in a process-wide memory cache keyed on
+the prompt with its whitespace and case normalized, so a prompt is only sent to the moderation
+endpoint once. The prompts of concurrent users are moderated together: a peb.batcher.MicroBatcher
+collects them for OPENAI_MODERATION_BATCH_WINDOW seconds and sends them in one request,
+admitted by the moderation scheduler in the queue of the first user of the batch. Before
+that, peb.prefilter screens the prompt locally: personal information and
+blocked terms are flagged without a request, and the prompts that pass can skip the endpoint.
+Before a completion is requested the prompt is compacted and kept within OPENAI_INPUT_TOKENS,
+its tokens are estimated locally (peb.tokens) and max_tokens caps the output; the estimated and
+actual token counts of each request are logged.
+Every call is timed into peb.metrics (latency by call and outcome, errors by type) and the
+tokens of the completions are counted.
+
 Example:
     connection = OpenAI()
-    response = connection.create(instruction="Refine this prompt", prompt="Example prompt")
-    is_flagged = connection.moderate("Example prompt to moderate")
+    response = await connection.create(instruction="Refine this prompt", prompt="Example prompt")
+    is_flagged = await connection.moderate("Example prompt to moderate")
 
 Logging:
-The module configures basic logging to track its operations and interactions with the OpenAI API.
+The module logs its operations and interactions with the OpenAI API; logging itself is set up
+by peb.log. The prompts are redacted and the API responses are only logged at DEBUG.
 
 Dependencies:
 - openai
@@ -43,21 +99,361 @@ as they are crucial for authenticating with the OpenAI API.
 """
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
 import os
+import sqlite3
+import time
 
 import openai
 from dotenv import load_dotenv
 from openai.types.chat import ChatCompletion
 
-load_dotenv()
-openai.organization = os.getenv("OPENAI_ORGANIZATION")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from peb.batcher import MicroBatcher
+from peb.cache import TieredCache, make_key
+from peb.client_manager import client_manager
+from peb.data import final_message
+from peb.log import redact
+from peb.metrics import (
+    collapsed_requests,
+    openai_errors,
+    openai_seconds,
+    openai_tokens,
+    record_usage,
 )
+from peb.prefilter import PREFILTER, Verdict, prefilter
+from peb.resilience import CircuitOpenError, Resilience
+from peb.scheduler import AdmissionScheduler, estimate_tokens
+from peb.similarity import SIMILAR_ENTRIES, SIMILAR_PROMPTS, SIMILARITY_THRESHOLD, SimilarityIndex
+from peb.singleflight import SingleFlight
+from peb.tokens import INPUT_TOKENS, count_message_tokens, count_tokens, fit, max_tokens_for
+
+load_dotenv()
 logger = logging.getLogger(__name__)
 
+COMPLETION_TIMEOUT = float(os.getenv("OPENAI_COMPLETION_TIMEOUT", "60"))
+MODERATION_TIMEOUT = float(os.getenv("OPENAI_MODERATION_TIMEOUT", "10"))
+UNAVAILABLE_MESSAGE = (
+    "OpenAI is not responding right now. Please try again in a minute."
+)
+
+resilience = Resilience(
+    "openai",
+    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "3")),
+    base_delay=float(os.getenv("OPENAI_BACKOFF_BASE", "0.5")),
+    max_delay=float(os.getenv("OPENAI_BACKOFF_MAX", "20")),
+    failure_threshold=int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+)
+
+completion_scheduler = AdmissionScheduler(
+    "completion",
+    requests_per_minute=float(os.getenv("OPENAI_RPM", "0")),
+    tokens_per_minute=float(os.getenv("OPENAI_TPM", "0")),
+)
+moderation_scheduler = AdmissionScheduler(
+    "moderation",
+    requests_per_minute=float(os.getenv("OPENAI_MODERATION_RPM", "0")),
+)
+
+completion_cache = TieredCache(
+    max_entries=int(os.getenv("OPENAI_CACHE_ENTRIES", "1024")),
+    ttl=float(os.getenv("OPENAI_CACHE_TTL", "604800")),
+    path=os.getenv("OPENAI_CACHE_PATH", "peb_cache.sqlite3") or None,
+    max_disk_entries=int(os.getenv("OPENAI_CACHE_DISK_ENTRIES", "100000")),
+)
+
+similar_prompts = SimilarityIndex(
+    threshold=SIMILARITY_THRESHOLD,
+    max_entries=SIMILAR_ENTRIES,
+    ttl=completion_cache.ttl,
+    path=completion_cache.path,
+    template=final_message.values(),
+)
+
+completions_in_flight = SingleFlight("create")
+# Cache key -> the completion of the stream in flight, or None if it did not complete.
+streams_in_flight: dict[str, asyncio.Future] = {}
+
+moderation_cache = TieredCache(
+    max_entries=int(os.getenv("OPENAI_MODERATION_CACHE_ENTRIES", "4096")),
+    ttl=float(os.getenv("OPENAI_MODERATION_CACHE_TTL", "86400")),
+)
+
+
+def find_completion(key, prompt, namespace) -> tuple[str | None, str]:
+    """
+    Return the cached completion of a request, or of a near-duplicate prompt.
+
+    Parameters:
+    key (str): The cache key of the request.
+    prompt (str): The prompt of the request.
+    namespace (str): The key of the other parameters of the request.
+
+    Returns:
+    str | None: The completion as JSON, or None.
+    str: Where it was found: "cached" for the exact request, "similar" for a near-duplicate.
+    """
+    cached = completion_cache.get(key)
+    if cached is not None or not SIMILAR_PROMPTS:
+        return cached, "cached"
+    match = similar_prompts.lookup(prompt, namespace)
+    if match is None:
+        return None, "similar"
+    similar_key, score = match
+    cached = completion_cache.get(similar_key)
+    if cached is not None:
+        logger.info("Similar prompt reused (similarity %.2f)", score)
+    return cached, "similar"
+
+
+def store_completion(key, completion, prompt, namespace) -> None:
+    """
+    Cache a completion and index its prompt for the near-duplicate lookups.
+
+    Parameters:
+    key (str): The cache key of the request.
+    completion (ChatCompletion): The completion.
+    prompt (str): The prompt of the request.
+    namespace (str): The key of the other parameters of the request.
+
+    Returns:
+    None
+    """
+    completion_cache.put(key, completion.model_dump_json())
+    if SIMILAR_PROMPTS:
+        try:
+            similar_prompts.add(prompt, key, namespace)
+        except sqlite3.Error:
+            # The completion is cached and returned all the same.
+            logger.exception("Could not index the prompt of a completion")
+
+
+def finish_stream(key, finished, completion) -> None:
+    """
+    Hand the completion of a stream to the identical streams waiting for it, once.
+
+    Parameters:
+    key (str): The cache key of the request.
+    finished (asyncio.Future | None): The future awaited by the identical streams.
+    completion (ChatCompletion | None): The completion, or None if the stream did not complete.
+
+    Returns:
+    None
+    """
+    if finished is None:
+        return
+    if not finished.done():
+        finished.set_result(completion)
+    if streams_in_flight.get(key) is finished:
+        del streams_in_flight[key]
+
+
+async def send_moderations(prompts, users) -> list:
+    """
+    Moderate a batch of prompts in one request.
+
+    The request is admitted in the queue of the first user of the batch, the one who waited
+    longest, with the estimated tokens of all its prompts.
+
+    Parameters:
+    prompts (list[str]): The prompts.
+    users (list[Hashable]): The users of the batch, in the order they submitted their prompts.
+
+    Returns:
+    list[openai.types.Moderation]: The results, in the order of the prompts.
+    """
+    response = await resilience.call(
+        moderation_scheduler.run,
+        users[0] if users else None,
+        sum(estimate_tokens(prompt) for prompt in prompts),
+        get_client().moderations.create,
+        input=prompts,
+        timeout=MODERATION_TIMEOUT,
+    )
+    logger.debug("Moderation response: %s", response)
+    return response.results
+
+
+moderation_batcher = MicroBatcher(
+    send_moderations,
+    "moderation",
+    max_size=int(os.getenv("OPENAI_MODERATION_BATCH_SIZE", "16")),
+    window=float(os.getenv("OPENAI_MODERATION_BATCH_WINDOW", "0.02")),
+)
+
+
+def get_client() -> openai.AsyncOpenAI:
+    """
+    Return the asynchronous OpenAI client shared by the whole process.
+
+    The client is created by the client manager on first use, so importing this module does
+    not require the OpenAI credentials to be present.
+
+    Returns:
+    openai.AsyncOpenAI: The shared asynchronous client.
+    """
+    return client_manager.client
+
+
+def error_message(error) -> str:
+    """
+    Return the message shown to the user for a failed OpenAI request.
+
+    Parameters:
+    error (Exception): The error raised by the request.
+
+    Returns:
+    str: The message for the user.
+    """
+    if isinstance(error, CircuitOpenError):
+        return UNAVAILABLE_MESSAGE
+    if isinstance(error, openai.APITimeoutError):
+        return f"OpenAI API request timed out: {error}"
+    if isinstance(error, openai.APIConnectionError):
+        return f"OpenAI API request failed to connect: {error}"
+    if isinstance(error, openai.BadRequestError):
+        return f"OpenAI API request was invalid: {error}"
+    if isinstance(error, openai.AuthenticationError):
+        return f"OpenAI API request was not authorized: {error}"
+    if isinstance(error, openai.PermissionDeniedError):
+        return f"OpenAI API request was not permitted: {error}"
+    if isinstance(error, openai.RateLimitError):
+        return f"OpenAI API request exceeded rate limit: {error}"
+    return f"OpenAI API returned an API Error: {error}"
+
+
+def build_messages(instruction, prompt, enhancement) -> list[dict]:
+    """
+    Build the messages of a completion request.
+
+    Parameters:
+    instruction (str): Instruction for the AI model.
+    prompt (str): The user's prompt to be processed.
+    enhancement (Optional[str]): Additional content to enhance the prompt.
+
+    Returns:
+    list[dict]: The messages sent to the chat completions endpoint.
+    """
+    return [
+        {"role": "system", "content": instruction},
+        {"role": "user", "content": "<" + prompt + ">"},
+        {"role": "system", "content": enhancement},
+    ]
+
+
+def budget_request(instruction, prompt, enhancement) -> tuple[str, list[dict], int, int]:
+    """
+    Fit the prompt in the input budget and size the request.
+
+    Parameters:
+    instruction (str): Instruction for the AI model.
+    prompt (str): The user's prompt to be processed.
+    enhancement (Optional[str]): Additional content to enhance the prompt.
+
+    Returns:
+    str: The compacted prompt.
+    list[dict]: The messages of the request.
+    int: The estimated prompt tokens.
+    int: The max_tokens of the request.
+    """
+    prompt = fit(prompt, INPUT_TOKENS)
+    messages = build_messages(instruction, prompt, enhancement)
+    prompt_tokens = count_message_tokens(messages)
+    return prompt, messages, prompt_tokens, max_tokens_for(prompt_tokens)
+
+
+class CompletionStream:
+    """
+    The text deltas of a streamed completion.
+
+    Iterating over the stream yields the new text of each chunk as it arrives. Once the stream
+    is exhausted, the whole completion is stored in the completion cache and handed to the
+    identical streams waiting for this one. A completion served from the cache is yielded as a
+    single delta.
+
+    Attributes:
+    text (str): The text received so far.
+
+    Methods:
+    close(): Close the stream without reading it to the end.
+    """
+
+    def __init__(self, response=None, key=None, cached=None, prompt_tokens=0, prompt=None,
+                 namespace=None, finished=None):
+        self.text = ""
+        self._response = response
+        self._key = key
+        self._prompt = prompt
+        self._namespace = namespace
+        self._cached = cached
+        self._prompt_tokens = prompt_tokens
+        self._finished = finished
+
+    def __aiter__(self):
+        return self._deltas()
+
+    async def _deltas(self):
+        """Yield the text deltas, then cache the completion."""
+        if self._cached is not None:
+            self.text = self._cached.choices[0].message.content
+            yield self.text
+            return
+        last = None
+        finish_reason = "stop"
+        completion = None
+        try:
+            try:
+                async for chunk in self._response:
+                    last = chunk
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    if delta:
+                        self.text += delta
+                        yield delta
+            finally:
+                await self._response.close()
+            if last is None or finish_reason != "stop":
+                return
+            # Streamed chunks carry no usage: the tokens are estimated.
+            openai_tokens.inc("prompt", "estimate", amount=self._prompt_tokens)
+            openai_tokens.inc("completion", "estimate", amount=count_tokens(self.text))
+            logger.info("Tokens: %d prompt and %d completion estimated (streamed, no usage)",
+                        self._prompt_tokens, count_tokens(self.text))
+            completion = ChatCompletion.model_validate({
+                "id": last.id,
+                "created": last.created,
+                "model": last.model,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": finish_reason,
+                    "logprobs": None,
+                    "message": {"role": "assistant", "content": self.text},
+                }],
+            })
+            store_completion(self._key, completion, self._prompt, self._namespace)
+        finally:
+            self._finish(completion)
+
+    def _finish(self, completion) -> None:
+        """Hand the completion, or None, to the identical streams waiting for this one."""
+        finish_stream(self._key, self._finished, completion)
+
+    async def close(self) -> None:
+        """
+        Close the stream without reading it to the end.
+
+        Returns:
+        None
+        """
+        if self._response is not None:
+            await self._response.close()
+        self._finish(None)
+
 
 class OpenAI:
     """
@@ -81,13 +477,15 @@ class OpenAI:
     Methods:
     create(instruction, prompt, enhancement=None): Generates a response from the model based on
     provided instruction and prompt. Optionally enhances the prompt.
+    stream(instruction, prompt, enhancement=None): Like create, but returns the response as a
+        CompletionStream of text deltas.
     moderate(prompt): Moderates a given prompt to ensure it does not contain inappropriate or
         harmful content.
 
     Usage Example:
         openai_obj = OpenAI()
-        response = openai_obj.create("Please refine this prompt", "Example user prompt")
-        is_flagged = openai_obj.moderate("Example user prompt for moderation")
+        response = await openai_obj.create("Please refine this prompt", "Example user prompt")
+        is_flagged = await openai_obj.moderate("Example user prompt for moderation")
 
     Note:
     - The temperature attribute can be adjusted to control the creativity of the
@@ -97,26 +495,23 @@ class OpenAI:
       of the content generated by the model.
     """
 
-    def __init__(self) -> None:
-        self.model = "gpt-3.5-turbo"
-        self.temperature = 0.5
-        self.validation_prompt = (
-            "I am going to give you a prompt enclosed within angle brackets <> for your "
-            "analysis. Do not answer it. Your task is just to make sure that it does not contain"
-            " personal or confidential information, that it does not seek to engage in harmful "
-            " or illegal"
-            " activities, that it does not seek to generate misinformation or disinformation, "
-            " that it does not"
-            " include discrimination, harassment or hate speech, that it does not request "
-            " assistance in"
-            " deceiving or manipulating anyone, and that it does not ask for specific medical or "
-            " legal"
-            ' diagnoses. If the prompt does not violate any rules, just say "Ok". If the prompt '
-            " breaks any"
-            ' rules, just say "No". Do not say anything else'
-        )
+    validation_prompt = (
+        "I am going to give you a prompt enclosed within angle brackets <> for your "
+        "analysis. Do not answer it. Your task is just to make sure that it does not contain"
+        " personal or confidential information, that it does not seek to engage in harmful "
+        " or illegal"
+        " activities, that it does not seek to generate misinformation or disinformation, "
+        " that it does not"
+        " include discrimination, harassment or hate speech, that it does not request "
+        " assistance in"
+        " deceiving or manipulating anyone, and that it does not ask for specific medical or "
+        " legal"
+        ' diagnoses. If the prompt does not violate any rules, just say "Ok". If the prompt '
+        " breaks any"
+        ' rules, just say "No". Do not say anything else'
+    )
 
-        self.prompt_enhancement_instruction = """Your objective is to refine a draft prompt
+    prompt_enhancement_instruction = """Your objective is to refine a draft prompt
          provided by the user. Don't answer the draft prompt directly.
         Your task is to optimize the draft prompt for clarity, completeness, and effectiveness, ensuring that it is
         perfectly understandable by ChatGPT. If the draft prompt lacks essential information, your role is to fill in
@@ -127,91 +522,226 @@ class OpenAI:
         can use to answer the question. Do this step by step. Take a deep breath. 
         The draft prompt will be enclosed within angle brackets <>."""
 
-    def create(self, instruction, prompt, enhancement=None) -> (
+    def __init__(self) -> None:
+        self.model = "gpt-3.5-turbo"
+        self.temperature = 0.5
+
+    async def create(self, instruction, prompt, enhancement=None, user=None) -> (
             tuple)[bool, str, ChatCompletion]:
         """
         Create a response from the OpenAI model based on the provided instruction and prompt.
         Optionally, an enhancement can be added to the prompt.
+        A response cached for the same normalized request is returned without calling the API,
+        and a request identical to one in flight, from any user, shares its response.
+        Transient errors are retried by the shared resilience policy.
 
         Parameters:
         instruction (str): Instruction for the AI model.
         prompt (str): The user's prompt to be processed.
         enhancement (Optional[str]): Additional content to enhance the prompt.
+        user (Optional[Hashable]): The user making the request, for fair admission.
+
+        Returns:
+        success (bool): True if the request was successful, False otherwise.
+        err_msg (str): The error message if the request failed, None otherwise.
+        ChatCompletion: The response from the OpenAI API.
+        """
+        logger.debug("Instruction: %s", instruction)
+        start = time.perf_counter()
+        prompt, messages, prompt_tokens, max_tokens = budget_request(
+            instruction, prompt, enhancement
+        )
+        key = make_key(instruction, prompt, enhancement, self.model, self.temperature)
+        namespace = make_key(instruction, enhancement, self.model, self.temperature)
+        cached, outcome = find_completion(key, prompt, namespace)
+        if cached is not None:
+            logger.info("Completion cache hit")
+            openai_seconds.observe(time.perf_counter() - start, "create", outcome)
+            return True, None, ChatCompletion.model_validate_json(cached)
+        return await completions_in_flight.run(
+            key, self._complete, key, namespace, prompt, messages, prompt_tokens, max_tokens,
+            user, start,
+        )
+
+    async def _complete(self, key, namespace, prompt, messages, prompt_tokens, max_tokens, user,
+                        start) -> tuple[bool, str, ChatCompletion]:
+        """
+        Request a completion that is not cached, and cache it.
+
+        The identical requests made in the meantime, by any user, await this one (see create).
+
+        Parameters:
+        key (str): The cache key of the request.
+        namespace (str): The key of the other parameters of the request.
+        prompt (str): The budgeted prompt.
+        messages (list[dict]): The messages of the request.
+        prompt_tokens (int): The estimated prompt tokens.
+        max_tokens (int): The max_tokens of the request.
+        user (Optional[Hashable]): The user making the request, for fair admission.
+        start (float): The time the request was made, for its latency.
 
         Returns:
         success (bool): True if the request was successful, False otherwise.
         err_msg (str): The error message if the request failed, None otherwise.
         ChatCompletion: The response from the OpenAI API.
         """
-        logger.info("Instruction: %s", instruction)
         success = False
         err_msg = None
         try:
-            response = openai.chat.completions.create(
+            response = await resilience.call(
+                completion_scheduler.run,
+                user,
+                prompt_tokens + max_tokens,
+                get_client().chat.completions.create,
                 model=self.model,
                 temperature=self.temperature,
-                messages=[
-                    {"role": "system", "content": instruction},
-                    {"role": "user", "content": "<" + prompt + ">"},
-                    {"role": "system", "content": enhancement},
-                ],
+                timeout=COMPLETION_TIMEOUT,
+                max_tokens=max_tokens,
+                messages=messages,
             )
-        except openai.APITimeoutError as e:
-            err_msg = f"OpenAI API request timed out: {e}"
-        except openai.APIConnectionError as e:
-            err_msg = f"OpenAI API request failed to connect: {e}"
-        except openai.BadRequestError as e:
-            err_msg = f"OpenAI API request was invalid: {e}"
-        except openai.AuthenticationError as e:
-            err_msg = f"OpenAI API request was not authorized: {e}"
-        except openai.PermissionDeniedError as e:
-            err_msg = f"OpenAI API request was not permitted: {e}"
-        except openai.RateLimitError as e:
-            err_msg = f"OpenAI API request exceeded rate limit: {e}"
-        except openai.APIError as e:
-            err_msg = f"OpenAI API returned an API Error: {e}"
+        except (CircuitOpenError, openai.APIError) as e:
+            err_msg = error_message(e)
+            openai_errors.inc("create", type(e).__name__)
+            openai_seconds.observe(time.perf_counter() - start, "create", "error")
         else:
             success = True
-            logger.info("Moderation response: %s", response)
+            logger.debug("Completion response: %s", response)
+            openai_seconds.observe(time.perf_counter() - start, "create", "ok")
+            completion_tokens = count_tokens(response.choices[0].message.content)
+            openai_tokens.inc("prompt", "estimate", amount=prompt_tokens)
+            openai_tokens.inc("completion", "estimate", amount=completion_tokens)
+            record_usage(response.usage)
+            if response.usage is not None:
+                logger.info("Tokens: %d prompt and %d completion estimated, %d and %d actual",
+                            prompt_tokens, completion_tokens, response.usage.prompt_tokens,
+                            response.usage.completion_tokens)
+            # A completion cut by max_tokens or the content filter is not worth reusing.
+            if response.choices[0].finish_reason == "stop":
+                store_completion(key, response, prompt, namespace)
             return success, err_msg, response   # type: ignore
         return success, err_msg, None   # type: ignore
 
+    async def stream(self, instruction, prompt, enhancement=None, user=None) -> (
+            tuple)[bool, str, CompletionStream]:
+        """
+        Request a response like create(), streamed as text deltas.
+
+        Only opening the stream goes through the resilience policy: an error in the middle of
+        the stream is raised while iterating over it. A request identical to a stream in flight,
+        from any user, waits for it to end and gets its completion as a single delta; if that
+        stream does not complete, the request opens its own.
+
+        Parameters:
+        instruction (str): Instruction for the AI model.
+        prompt (str): The user's prompt to be processed.
+        enhancement (Optional[str]): Additional content to enhance the prompt.
+        user (Optional[Hashable]): The user making the request, for fair admission.
+
+        Returns:
+        success (bool): True if the stream was opened, False otherwise.
+        err_msg (str): The error message if the request failed, None otherwise.
+        CompletionStream: The text deltas of the response.
+        """
+        logger.debug("Instruction: %s", instruction)
+        start = time.perf_counter()
+        prompt, messages, prompt_tokens, max_tokens = budget_request(
+            instruction, prompt, enhancement
+        )
+        key = make_key(instruction, prompt, enhancement, self.model, self.temperature)
+        namespace = make_key(instruction, enhancement, self.model, self.temperature)
+        cached, outcome = find_completion(key, prompt, namespace)
+        if cached is not None:
+            logger.info("Completion cache hit")
+            openai_seconds.observe(time.perf_counter() - start, "stream", outcome)
+            return True, None, CompletionStream(
+                cached=ChatCompletion.model_validate_json(cached)
+            )
+        loop = asyncio.get_running_loop()
+        leader = streams_in_flight.get(key)
+        if leader is not None and leader.get_loop() is loop:
+            collapsed_requests.inc("stream")
+            logger.info("Stream collapsed into the identical one in flight")
+            completion = await asyncio.shield(leader)
+            if completion is not None:
+                return True, None, CompletionStream(cached=completion)
+        finished = streams_in_flight[key] = loop.create_future()
+        try:
+            response = await resilience.call(
+                completion_scheduler.run,
+                user,
+                prompt_tokens + max_tokens,
+                get_client().chat.completions.create,
+                model=self.model,
+                temperature=self.temperature,
+                timeout=COMPLETION_TIMEOUT,
+                max_tokens=max_tokens,
+                messages=messages,
+                stream=True,
+            )
+        except (CircuitOpenError, openai.APIError) as e:
+            finish_stream(key, finished, None)
+            openai_errors.inc("stream", type(e).__name__)
+            openai_seconds.observe(time.perf_counter() - start, "stream", "error")
+            return False, error_message(e), None
+        except BaseException:
+            finish_stream(key, finished, None)
+            raise
+        # The time to open the stream, which is about the time to the first token.
+        openai_seconds.observe(time.perf_counter() - start, "stream", "ok")
+        return True, None, CompletionStream(response, key, prompt_tokens=prompt_tokens,
+                                            prompt=prompt, namespace=namespace,
+                                            finished=finished)
+
     @staticmethod
-    def moderate(prompt) -> tuple[bool, str, bool]:
+    async def moderate(prompt, user=None) -> tuple[bool, str, bool]:
         """
         Moderate the given prompt to check for any content that violates guidelines.
+        The prompt is first screened by the local pre-moderation filter, which flags the clear
+        violations without a request. The verdict of a prompt that was already moderated,
+        ignoring whitespace and case, is taken from the moderation cache; the others are sent
+        in a batch with the prompts of the other users moderated at the same time.
 
         Parameters:
         prompt (str): The prompt to be moderated.
+        user (Optional[Hashable]): The user making the request, for fair admission of the batch
+            holding the prompt.
 
         Returns:
         success (bool): True if the moderation request was successful, False otherwise.
         err_msg (str): The error message if the moderation request failed, None otherwise.
         bool: True if the prompt is flagged, False otherwise.
         """
-        logger.info("Moderating: %s", prompt)
+        logger.info("Moderating: %s", redact(prompt))
+        if PREFILTER:
+            verdict, reason = prefilter.check(prompt)
+            if verdict is Verdict.BLOCK:
+                logger.info("Prompt flagged by the local filter: %s", reason)
+                return True, None, True
+            if not prefilter.needs_remote(verdict):
+                return True, None, False
+        start = time.perf_counter()
+        key = make_key(prompt.casefold())
+        cached = moderation_cache.get(key)
+        if cached is not None:
+            logger.info("Moderation cache hit")
+            openai_seconds.observe(time.perf_counter() - start, "moderate", "cached")
+            return True, None, json.loads(cached)["flagged"]
         success = False
         err_msg = None
         try:
-            response = openai.moderations.create(input=prompt)
-        except openai.APITimeoutError as e:
-            err_msg = f"OpenAI API request timed out: {e}"
-        except openai.APIConnectionError as e:
-            err_msg = f"OpenAI API request failed to connect: {e}"
-        except openai.BadRequestError as e:
-            err_msg = f"OpenAI API request was invalid: {e}"
-        except openai.AuthenticationError as e:
-            err_msg = f"OpenAI API request was not authorized: {e}"
-        except openai.PermissionDeniedError as e:
-            err_msg = f"OpenAI API request was not permitted: {e}"
-        except openai.RateLimitError as e:
-            err_msg = f"OpenAI API request exceeded rate limit: {e}"
-        except openai.APIError as e:
-            err_msg = f"OpenAI API returned an API Error: {e}"
+            result = await moderation_batcher.submit(prompt, user)
+        except (CircuitOpenError, openai.APIError) as e:
+            err_msg = error_message(e)
+            openai_errors.inc("moderate", type(e).__name__)
+            openai_seconds.observe(time.perf_counter() - start, "moderate", "error")
         else:
             success = True
-            logger.info("Moderation response: %s", response)
-            return success, err_msg, response.results[0].flagged   # type: ignore
+            openai_seconds.observe(time.perf_counter() - start, "moderate", "ok")
+            moderation_cache.put(key, json.dumps({
+                "flagged": result.flagged,
+                "category_scores": result.category_scores.model_dump(),
+            }))
+            return success, err_msg, result.flagged   # type: ignore
         return success, err_msg, False
 
 
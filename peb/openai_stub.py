@@ -0,0 +1,361 @@
+"""
+This module implements a local stand-in for the part of the OpenAI API used by the bot.
+
+The stub serves the chat completions (plain and streamed) and moderation endpoints with
+configurable latencies and failures, so the OpenAI wrapper, the retries, the caches, the
+streaming and the concurrency of the bot can be measured reproducibly without network access
+or an API key. It runs on peb.http_server, on the caller's event loop or as its own process.
+
+Features:
+- POST /v1/chat/completions, with "stream": true answered as server-sent events.
+- POST /v1/moderations, flagging a configurable share of the prompts; a list of inputs gets
+    one result per input.
+- Latencies drawn from a constant, uniform, exponential or lognormal distribution.
+- Streamed chunks sent at a configurable rate; a non-streamed completion takes as long as the
+    whole stream.
+- Injection of 429 (with a retry-after-ms header), 5xx and timeout (no answer) failures.
+- stats(): number of requests by endpoint and outcome.
+
+Usage:
+    stub = OpenAIStub(latency=0.5, chunk_rate=50, rate_limit_ratio=0.05)
+    await stub.start()
+    # OPENAI_BASE_URL=stub.base_url, or ClientManager(base_url=stub.base_url)
+    ...
+    await stub.stop()
+
+    From the command line (OPENAI_BASE_URL=http://127.0.0.1:8700/v1 for the bot):
+    poetry run python -m peb.openai_stub --port 8700 --latency 0.5 --error-ratio 0.01
+
+Note:
+- The random draws come from a seeded generator, so a run with the same seed and the same
+    sequence of requests injects the same failures. Whether a prompt is flagged only depends
+    on the prompt, so moderation verdicts stay consistent with the bot's caches.
+- The stub does not check the API key nor the model.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter
+from http import HTTPStatus
+
+from peb.http_server import HttpServer, Response
+from peb.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+COMPLETION_TEXT = (
+    "Act as an experienced teacher and explain the topic step by step to an absolute beginner, "
+    "with one short example per step, in plain language and in less than 500 words."
+)
+CATEGORIES = ["harassment", "harassment/threatening", "hate", "hate/threatening", "self-harm",
+              "self-harm/instructions", "self-harm/intent", "sexual", "sexual/minors",
+              "violence", "violence/graphic"]
+
+
+def sample_latency(distribution, mean, rng, sigma=0.5) -> float:
+    """
+    Draw a latency from the given distribution.
+
+    Parameters:
+    distribution (str): One of DISTRIBUTIONS.
+    mean (float): The mean latency, in seconds.
+    rng (random.Random): The generator to draw from.
+    sigma (float): The shape of the lognormal distribution.
+
+    Returns:
+    float: The latency in seconds.
+    """
+    if mean <= 0:
+        return 0.0
+    if distribution == "constant":
+        return mean
+    if distribution == "uniform":
+        return rng.uniform(0, 2 * mean)
+    if distribution == "exponential":
+        return rng.expovariate(1 / mean)
+    if distribution == "lognormal":
+        # The location is chosen so that the mean of the distribution is `mean`.
+        return rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    raise ValueError(f"Unknown latency distribution: {distribution}")
+
+
+def error_body(message, kind, code=None) -> bytes:
+    """
+    Build the JSON body of an API error.
+
+    Parameters:
+    message (str): The error message.
+    kind (str): The error type.
+    code (Optional[str]): The error code.
+
+    Returns:
+    bytes: The body.
+    """
+    return json.dumps({"error": {"message": message, "type": kind, "param": None,
+                                 "code": code}}).encode()
+
+
+class OpenAIStub:  # pylint: disable=too-many-instance-attributes
+    """
+    A local OpenAI-compatible server with configurable latency and failures.
+
+    Attributes:
+    latency (float): Mean seconds before the first byte of an answer (time to first token).
+    distribution (str): Distribution of the latencies, one of DISTRIBUTIONS.
+    sigma (float): Shape of the lognormal distribution.
+    moderation_latency (float): Mean seconds of a moderation.
+    chunk_rate (float): Streamed chunks per second; 0 sends them all at once.
+    words (int): Words of a completion, one per chunk.
+    rate_limit_ratio (float): Share of the requests answered with 429.
+    retry_after (float): Seconds sent in the retry-after-ms header of a 429.
+    error_ratio (float): Share of the requests answered with a 5xx error.
+    timeout_ratio (float): Share of the requests that are never answered.
+    flagged_ratio (float): Share of the prompts flagged by the moderation.
+    host (str): The address to listen on.
+    port (int): The port to listen on; 0 picks a free port, available after start().
+
+    Methods:
+    start(): Start the server.
+    stop(): Stop the server.
+    base_url: The base URL to give to the OpenAI client.
+    stats(): Return the number of requests by endpoint and outcome.
+    """
+
+    def __init__(self, latency=0.5, distribution="constant", sigma=0.5,
+                 moderation_latency=0.1, chunk_rate=50.0, words=100, rate_limit_ratio=0.0,
+                 retry_after=1.0, error_ratio=0.0, timeout_ratio=0.0, flagged_ratio=0.0,
+                 host="127.0.0.1", port=0, seed=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.latency = latency
+        self.distribution = distribution
+        self.sigma = sigma
+        self.moderation_latency = moderation_latency
+        self.chunk_rate = chunk_rate
+        self.words = words
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.error_ratio = error_ratio
+        self.timeout_ratio = timeout_ratio
+        self.flagged_ratio = flagged_ratio
+        self.requests: Counter = Counter()
+        self._rng = random.Random(seed)
+        self._server = HttpServer(
+            {"/v1/chat/completions": self._completions, "/v1/moderations": self._moderations},
+            host=host, port=port, methods=("POST",),
+        )
+
+    @property
+    def base_url(self) -> str:
+        """
+        Return the base URL to give to the OpenAI client.
+
+        Returns:
+        str: The URL of the /v1 API, available after start().
+        """
+        return f"http://{self._server.host}:{self._server.port}/v1"
+
+    async def start(self) -> None:
+        """
+        Start the server.
+
+        Returns:
+        None
+        """
+        await self._server.start()
+
+    async def stop(self) -> None:
+        """
+        Stop the server, dropping the requests that are still waiting.
+
+        Returns:
+        None
+        """
+        await self._server.stop()
+
+    def stats(self) -> dict:
+        """
+        Return the number of requests by endpoint and outcome.
+
+        Returns:
+        dict: Counts keyed by "endpoint outcome", for example "completions 429".
+        """
+        return dict(self.requests)
+
+    def _sample(self, mean) -> float:
+        """Draw a latency with the configured distribution."""
+        return sample_latency(self.distribution, mean, self._rng, self.sigma)
+
+    async def _inject_failure(self, endpoint) -> Response | None:
+        """
+        Draw the failure of a request, if any.
+
+        Parameters:
+        endpoint (str): The name of the endpoint, for the statistics.
+
+        Returns:
+        Response | None: The error response, or None if the request succeeds.
+        """
+        draw = self._rng.random()
+        if draw < self.timeout_ratio:
+            self.requests[f"{endpoint} timeout"] += 1
+            # Never answer: the client gives up after its own timeout and closes the connection.
+            await asyncio.Event().wait()
+        draw -= self.timeout_ratio
+        if draw < self.rate_limit_ratio:
+            self.requests[f"{endpoint} 429"] += 1
+            return Response(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                error_body("Rate limit reached", "requests", "rate_limit_exceeded"),
+                {"Content-Type": "application/json",
+                 "retry-after-ms": str(int(self.retry_after * 1000))},
+            )
+        draw -= self.rate_limit_ratio
+        if draw < self.error_ratio:
+            status = self._rng.choice(
+                [HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                 HTTPStatus.SERVICE_UNAVAILABLE]
+            )
+            self.requests[f"{endpoint} {status.value}"] += 1
+            return Response(status, error_body("The server had an error", "server_error"),
+                            {"Content-Type": "application/json"})
+        return None
+
+    def _chunks(self) -> list[str]:
+        """Return the text deltas of a completion."""
+        words = (COMPLETION_TEXT.split(" ") * (self.words // 25 + 1))[:self.words]
+        return [word if number == 0 else " " + word for number, word in enumerate(words)]
+
+    async def _completions(self, request) -> Response:
+        """
+        Answer a chat completion request.
+
+        Parameters:
+        request (peb.http_server.Request): The request.
+
+        Returns:
+        peb.http_server.Response: The completion, as JSON or as server-sent events.
+        """
+        failure = await self._inject_failure("completions")
+        if failure is not None:
+            return failure
+        body = json.loads(request.body)
+        prompt_tokens = sum(len(message["content"] or "") for message in body["messages"]) // 4
+        completion_id = f"chatcmpl-stub{self._rng.getrandbits(32):08x}"
+        model = body.get("model", "gpt-3.5-turbo")
+        created = int(time.time())
+        chunks = self._chunks()
+        interval = 1 / self.chunk_rate if self.chunk_rate > 0 else 0.0
+        await asyncio.sleep(self._sample(self.latency))
+        self.requests["completions 200"] += 1
+        if not body.get("stream"):
+            await asyncio.sleep(interval * len(chunks))
+            return Response(200, json.dumps({
+                "id": completion_id, "object": "chat.completion", "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                             "message": {"role": "assistant", "content": "".join(chunks)}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(chunks),
+                          "total_tokens": prompt_tokens + len(chunks)},
+            }).encode(), {"Content-Type": "application/json"})
+
+        def event(delta, finish_reason=None) -> bytes:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [{"index": 0, "delta": delta, "logprobs": None,
+                                                  "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        async def events():
+            yield event({"role": "assistant", "content": ""})
+            for number, chunk in enumerate(chunks):
+                if number and interval:
+                    await asyncio.sleep(interval)
+                yield event({"content": chunk})
+            yield event({}, "stop")
+            yield b"data: [DONE]\n\n"
+
+        return Response(200, headers={"Content-Type": "text/event-stream"}, stream=events())
+
+    async def _moderations(self, request) -> Response:
+        """
+        Answer a moderation request.
+
+        Parameters:
+        request (peb.http_server.Request): The request.
+
+        Returns:
+        peb.http_server.Response: The moderation result.
+        """
+        failure = await self._inject_failure("moderations")
+        if failure is not None:
+            return failure
+        prompts = json.loads(request.body)["input"]
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        await asyncio.sleep(self._sample(self.moderation_latency))
+        self.requests["moderations 200"] += 1
+        results = []
+        for prompt in prompts:
+            digest = hashlib.blake2b(prompt.encode(), digest_size=8).digest()
+            flagged = int.from_bytes(digest, "big") / 2 ** 64 < self.flagged_ratio
+            results.append({
+                "flagged": flagged,
+                "categories": dict.fromkeys(CATEGORIES, flagged),
+                "category_scores": dict.fromkeys(CATEGORIES, 0.9 if flagged else 0.001),
+            })
+        return Response(200, json.dumps({
+            "id": f"modr-stub{self._rng.getrandbits(32):08x}",
+            "model": "text-moderation-latest",
+            "results": results,
+        }).encode(), {"Content-Type": "application/json"})
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="mean seconds to the first token")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="constant")
+    parser.add_argument("--sigma", type=float, default=0.5, help="shape of the lognormal")
+    parser.add_argument("--moderation-latency", type=float, default=0.1)
+    parser.add_argument("--chunk-rate", type=float, default=50.0,
+                        help="streamed chunks per second, 0 for no delay")
+    parser.add_argument("--words", type=int, default=100, help="words of a completion")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                        help="seconds requested by a 429")
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--timeout-ratio", type=float, default=0.0)
+    parser.add_argument("--flagged-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+async def serve(stub) -> None:
+    """Run the stub until the process is interrupted."""
+    await stub.start()
+    logger.info("OpenAI stub serving %s", stub.base_url)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        logger.info("Requests: %s", stub.stats())
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    options = vars(parse_args())
+    try:
+        asyncio.run(serve(OpenAIStub(**options)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,292 @@
+"""
+This module stores the progress of the conversations so that it survives restarts.
+
+The answers of a user live in context.user_data and the step they are on lives in the
+ConversationHandler; both are in memory only, so a deploy or a crash sends every user back to
+the beginning of the canvas. SQLitePersistence is a telegram.ext.BasePersistence that keeps
+both in an SQLite database and loads them back when the application starts.
+
+Writes are taken off the update path: the application hands the changed user data and
+conversation states to the persistence every update_interval seconds, and the persistence
+writes each of these batches in one transaction, in a worker thread. Any other
+BasePersistence (PicklePersistence, a Redis backend...) can be passed to build_application()
+instead.
+
+Features:
+- SQLite database in WAL mode, one row per user and one row per conversation.
+- Write-behind: changes are buffered and written in batches, one transaction per batch.
+- Startup restores all the users and conversations with two queries.
+- Counters of batches and rows written.
+
+Environment Variables:
+- TELEGRAM_PERSISTENCE_PATH: Path of the SQLite database (default peb_state.sqlite3); empty
+    keeps the conversations in memory only.
+- TELEGRAM_PERSISTENCE_INTERVAL: Seconds between two flushes of the changes (default 5).
+
+Usage:
+    persistence = SQLitePersistence("peb_state.sqlite3", update_interval=5)
+    application = build_application(telegram_token, persistence=persistence)
+
+Note:
+- Only user data and conversation states are stored; the bot does not use chat data, bot data
+    or callback data.
+- User data must be serializable to JSON; it is loaded back as session_type, the Session of
+    peb.session by default. Conversation states are members of state_type.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+from telegram.ext import BasePersistence, PersistenceInput
+
+from peb.data import BotState
+from peb.session import Session
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_PATH = os.getenv("TELEGRAM_PERSISTENCE_PATH", "peb_state.sqlite3")
+PERSISTENCE_INTERVAL = float(os.getenv("TELEGRAM_PERSISTENCE_INTERVAL", "5"))
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence of user data and conversation states in an SQLite database.
+
+    Attributes:
+    path (str): Path of the SQLite database.
+    state_type (type[Enum]): The enum of the conversation states.
+    session_type (type[Mapping]): The type of the user data loaded back.
+    batches (int): Transactions written so far.
+    rows (int): Rows written or deleted so far.
+
+    Methods:
+    get_user_data(): Load the data of every user.
+    get_conversations(name): Load the states of the conversations of a handler.
+    update_user_data(user_id, data): Buffer the new data of a user.
+    update_conversation(name, key, new_state): Buffer the new state of a conversation.
+    drop_user_data(user_id): Buffer the deletion of the data of a user.
+    flush(): Write the pending changes and close the database.
+    stats(): Return the counters of the persistence.
+    """
+
+    def __init__(self, path=PERSISTENCE_PATH, update_interval=PERSISTENCE_INTERVAL,
+                 state_type=BotState, session_type=Session):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.state_type = state_type
+        self.session_type = session_type
+        self.batches = 0
+        self.rows = 0
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._users: dict[int, str | None] = {}
+        self._conversations: dict[tuple[str, str], int | None] = {}
+        self._writer: asyncio.Task | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use, creating its tables."""
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations (name TEXT, key TEXT, state INTEGER, "
+                "PRIMARY KEY (name, key)) WITHOUT ROWID"
+            )
+            self._db.commit()
+        return self._db
+
+    def _query(self, sql, *params) -> list[tuple]:
+        """Run a query in the calling thread and return its rows."""
+        with self._db_lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    async def get_user_data(self) -> dict[int, dict]:
+        """
+        Load the data of every user.
+
+        Returns:
+        dict[int, Mapping]: The data of each user, by user id.
+        """
+        rows = await asyncio.to_thread(self._query, "SELECT user_id, data FROM user_data")
+        return {user_id: self.session_type(json.loads(data)) for user_id, data in rows}
+
+    async def get_conversations(self, name) -> dict:
+        """
+        Load the states of the conversations of a ConversationHandler.
+
+        Parameters:
+        name (str): The name of the ConversationHandler.
+
+        Returns:
+        dict[tuple, Enum]: The state of each conversation, by conversation key.
+        """
+        rows = await asyncio.to_thread(
+            self._query, "SELECT key, state FROM conversations WHERE name = ?", name
+        )
+        return {tuple(json.loads(key)): self.state_type(state) for key, state in rows}
+
+    async def update_user_data(self, user_id, data) -> None:
+        """
+        Buffer the new data of a user; it is written with the next batch.
+
+        Parameters:
+        user_id (int): The user.
+        data (Mapping): The data of the user.
+
+        Returns:
+        None
+        """
+        self._users[user_id] = json.dumps(dict(data), ensure_ascii=False)
+        self._schedule()
+
+    async def drop_user_data(self, user_id) -> None:
+        """
+        Buffer the deletion of the data of a user.
+
+        Parameters:
+        user_id (int): The user.
+
+        Returns:
+        None
+        """
+        self._users[user_id] = None
+        self._schedule()
+
+    async def update_conversation(self, name, key, new_state) -> None:
+        """
+        Buffer the new state of a conversation; None ends the conversation.
+
+        Parameters:
+        name (str): The name of the ConversationHandler.
+        key (tuple[int | str, ...]): The key of the conversation.
+        new_state (Enum | None): The new state.
+
+        Returns:
+        None
+        """
+        state = None if new_state is None else self.state_type(new_state).value
+        self._conversations[(name, json.dumps(list(key)))] = state
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """Start the writer task unless it is already running."""
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        """Write the buffered changes, in batches, until the buffers are empty."""
+        while self._users or self._conversations:
+            users, self._users = self._users, {}
+            conversations, self._conversations = self._conversations, {}
+            try:
+                await asyncio.to_thread(self._write, users, conversations)
+            except sqlite3.Error:
+                logger.exception("Could not persist %d users and %d conversations",
+                                 len(users), len(conversations))
+                # Keep the changes for the next batch, unless newer ones arrived meanwhile.
+                self._users = {**users, **self._users}
+                self._conversations = {**conversations, **self._conversations}
+                return
+
+    def _write(self, users, conversations) -> None:
+        """Write one batch of changes in a single transaction."""
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                    [(user_id, data) for user_id, data in users.items() if data is not None],
+                )
+                db.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?",
+                    [(user_id,) for user_id, data in users.items() if data is None],
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    [(name, key, state) for (name, key), state in conversations.items()
+                     if state is not None],
+                )
+                db.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    [key for key, state in conversations.items() if state is None],
+                )
+        self.batches += 1
+        self.rows += len(users) + len(conversations)
+
+    async def flush(self) -> None:
+        """
+        Write the pending changes and close the database; called when the application stops.
+
+        Returns:
+        None
+        """
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        logger.info("Persistence flushed: %s", self.stats())
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the persistence.
+
+        Returns:
+        dict: The batches and rows written and the changes still pending.
+        """
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "pending": len(self._users) + len(self._conversations),
+        }
+
+    # The bot stores neither chat data, bot data nor callback data.
+
+    async def get_chat_data(self) -> dict:
+        """Return no chat data."""
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        """Return no bot data."""
+        return {}
+
+    async def get_callback_data(self) -> None:
+        """Return no callback data."""
+        return None
+
+    async def update_chat_data(self, chat_id, data) -> None:
+        """Ignore chat data."""
+
+    async def update_bot_data(self, data) -> None:
+        """Ignore bot data."""
+
+    async def update_callback_data(self, data) -> None:
+        """Ignore callback data."""
+
+    async def drop_chat_data(self, chat_id) -> None:
+        """Ignore chat data."""
+
+    async def refresh_user_data(self, user_id, user_data) -> None:
+        """Keep the in-memory user data, which is always the most recent."""
+
+    async def refresh_chat_data(self, chat_id, chat_data) -> None:
+        """Ignore chat data."""
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        """Ignore bot data."""
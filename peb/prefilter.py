@@ -0,0 +1,283 @@
+"""
+This module screens the prompts locally before they are sent to the OpenAI moderation endpoint.
+
+The welcome message asks the users not to enter personal information, and some requests are
+clear violations that need no model to recognise. The PreFilter class scans a prompt once with
+a single compiled regular expression that combines the blocked terms, the detectors of email
+addresses, phone numbers and card numbers, and a watch list of sensitive words. The scan takes
+microseconds, against a network round trip for the moderation endpoint.
+
+Features:
+- Verdict.BLOCK: a blocked term or personal information was found; the prompt is rejected
+    without calling the API.
+- Verdict.PASS: nothing suspicious was found. With OPENAI_PREFILTER_SKIP_REMOTE=1 the prompt
+    is accepted without calling the API; otherwise it is still moderated remotely.
+- Verdict.UNCERTAIN: a sensitive word, or a number that may be a phone number, was found; the
+    prompt is moderated remotely.
+- Card numbers must pass the Luhn check. Phone numbers are blocked in international (+34 ...) or
+    area code ((555) ...) form only; numbers written in groups (612 345 678) are left to the
+    remote moderation, and decimals, IP addresses, years, ISBNs and order numbers pass.
+- stats(): the number of prompts by verdict and the remote calls saved.
+
+Environment Variables:
+- OPENAI_PREFILTER: Set to 0 to send every prompt to the moderation endpoint (default 1).
+- OPENAI_PREFILTER_SKIP_REMOTE: Set to 1 to accept the prompts that pass the local filter
+    without remote moderation (default 0).
+- OPENAI_BLOCKED_TERMS: File with additional blocked terms, one per line.
+
+Usage:
+    verdict, reason = prefilter.check("Email me at someone@example.com")
+    if verdict is Verdict.BLOCK:
+        ...
+
+Note:
+- The lists are short on purpose: the local filter only decides the clear cases, everything
+    else is left to the moderation model.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+from collections import Counter
+from enum import Enum
+
+from dotenv import load_dotenv
+
+from peb.metrics import prefilter_verdicts
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+PREFILTER = os.getenv("OPENAI_PREFILTER", "1") == "1"
+SKIP_REMOTE = os.getenv("OPENAI_PREFILTER_SKIP_REMOTE", "0") == "1"
+BLOCKED_TERMS_PATH = os.getenv("OPENAI_BLOCKED_TERMS")
+
+BLOCKED_TERMS = (
+    "build a bomb", "make a bomb", "make explosives", "child pornography", "child porn",
+    "buy stolen credit cards", "carding tutorial", "make meth", "synthesize meth",
+    "hire a hitman", "ransomware builder",
+)
+WATCH_TERMS = (
+    "kill", "murder", "weapon", "gun", "bomb", "explosive", "drug", "cocaine", "heroin",
+    "suicide", "self-harm", "hack", "malware", "exploit", "phishing", "password", "steal",
+    "fraud", "launder", "terror", "nude", "sex", "porn", "racist", "hate", "diagnose",
+    "prescription", "lawsuit", "fake news", "disinformation", "manipulate",
+)
+EMAIL = r"(?<![\w.+-])[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[a-z]{2,}"
+CARD = r"(?<![\d-])\d(?:[ -]?\d){12,18}(?![\d-])"
+PHONE = (
+    r"(?<![\w+#/-])(?<!\d\.)(?:\+\d{1,3}[ -]?|\(\d{1,4}\)[ -]?)?\d{2,4}(?:[ -]\d{2,4}){1,4}"
+    r"|(?<![\w+])\+\d{9,15}"
+)
+PHONE_END = r"(?![\w#/-])(?!\.\d)"
+
+
+class Verdict(Enum):
+    """
+    Verdict of the local filter on a prompt.
+    """
+
+    BLOCK = "block"
+    PASS = "pass"
+    UNCERTAIN = "uncertain"
+
+
+def luhn(digits) -> bool:
+    """
+    Check a card number with the Luhn algorithm.
+
+    Parameters:
+    digits (str): The digits of the number.
+
+    Returns:
+    bool: True if the check digit is valid.
+    """
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if position % 2:
+            value = value * 2 - 9 if value > 4 else value * 2
+        total += value
+    return total % 10 == 0
+
+
+def is_phone(text) -> bool:
+    """
+    Check that a run of digits and separators looks like a phone number.
+
+    Parameters:
+    text (str): The matched text.
+
+    Returns:
+    bool: True for 9 to 15 digits after a + or an area code in parentheses, or in three groups
+        or more that are not all of four digits, so that lists of years are not taken for phone
+        numbers.
+    """
+    groups = re.findall(r"\d+", text)
+    digits = sum(len(group) for group in groups)
+    if not 9 <= digits <= 15:
+        return False
+    return text[0] in "+(" or (len(groups) >= 3 and any(len(group) != 4 for group in groups))
+
+
+def trie_pattern(trie) -> str:
+    """
+    Turn a trie of characters into a regular expression.
+
+    Parameters:
+    trie (dict): The children of a node by character; the key "" marks the end of a term.
+
+    Returns:
+    str: The pattern matching the terms below the node, longest first.
+    """
+    branches = [re.escape(char) + trie_pattern(child) for char, child in sorted(trie.items())
+                if char]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return f"(?:{pattern})?" if "" in trie else pattern
+
+
+def terms_pattern(terms, stems=False) -> str:
+    """
+    Build the pattern matching any of the terms as whole words.
+
+    The terms are merged in a trie, so that the regular expression engine follows one branch
+    per character instead of trying every term at every position of the prompt.
+
+    Parameters:
+    terms (Iterable[str]): The terms.
+    stems (bool): Whether the terms also match the words they start (kill, killing...).
+
+    Returns:
+    str: The pattern.
+    """
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for char in term.strip().lower():
+            node = node.setdefault(char, {})
+        node[""] = {}
+    trie.pop("", None)
+    if not trie:
+        return r"(?!)"
+    return r"\b" + trie_pattern(trie) + (r"\w*" if stems else r"\b")
+
+
+def read_terms(path) -> list[str]:
+    """
+    Read the blocked terms of a file, one per line, ignoring blank lines and comments.
+
+    Parameters:
+    path (str | None): The file, or None.
+
+    Returns:
+    list[str]: The terms.
+    """
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as terms:
+        return [line.strip() for line in terms if line.strip() and not line.startswith("#")]
+
+
+class PreFilter:
+    """
+    Local screening of the prompts with a single compiled regular expression.
+
+    Attributes:
+    skip_remote (bool): Whether the prompts that pass are accepted without remote moderation.
+    verdicts (collections.Counter): The number of prompts by verdict.
+    saved (int): The remote moderation calls that were not needed.
+
+    Methods:
+    check(prompt): Return the verdict on a prompt and its reason.
+    needs_remote(verdict): Whether the prompt must still be moderated by the API.
+    stats(): Return the counters.
+    """
+
+    def __init__(self, blocked_terms=BLOCKED_TERMS, watch_terms=WATCH_TERMS,
+                 skip_remote=SKIP_REMOTE):
+        self.skip_remote = skip_remote
+        self.verdicts: Counter = Counter()
+        self.saved = 0
+        self._pattern = re.compile(
+            f"(?P<blocked>{terms_pattern(blocked_terms)})|(?P<email>{EMAIL})|"
+            f"(?P<card>{CARD})|(?P<phone>(?:{PHONE}){PHONE_END})|"
+            f"(?P<watch>{terms_pattern(watch_terms, True)})",
+            re.IGNORECASE,
+        )
+
+    def check(self, prompt) -> tuple[Verdict, str | None]:
+        """
+        Return the verdict on a prompt.
+
+        Parameters:
+        prompt (str): The prompt.
+
+        Returns:
+        Verdict: BLOCK, PASS or UNCERTAIN.
+        str | None: What was found: "blocked term", "email", "card number", "phone number" or
+            "sensitive word", None for a pass.
+        """
+        uncertain = None
+        for match in self._pattern.finditer(prompt):
+            kind, text = match.lastgroup, match.group()
+            if kind == "watch":
+                uncertain = uncertain or "sensitive word"
+                continue
+            if kind == "card":
+                if luhn(re.sub(r"\D", "", text)):
+                    return self._record(Verdict.BLOCK, "card number")
+                if not re.fullmatch(PHONE, text):
+                    continue
+                kind = "phone"
+            if kind == "phone":
+                if not is_phone(text):
+                    continue
+                if text[0] not in "+(":
+                    # Groups of digits may as well be a list of numbers: the model decides.
+                    uncertain = uncertain or "phone number"
+                    continue
+            reason = {"blocked": "blocked term", "email": "email", "phone": "phone number"}
+            return self._record(Verdict.BLOCK, reason[kind])
+        if uncertain:
+            return self._record(Verdict.UNCERTAIN, uncertain)
+        return self._record(Verdict.PASS, None)
+
+    def _record(self, verdict, reason) -> tuple[Verdict, str | None]:
+        """Count a verdict and the remote call it saves, if any."""
+        self.verdicts[verdict] += 1
+        prefilter_verdicts.inc(verdict.value)
+        if not self.needs_remote(verdict):
+            self.saved += 1
+        return verdict, reason
+
+    def needs_remote(self, verdict) -> bool:
+        """
+        Return whether a prompt with the given verdict must be moderated by the API.
+
+        Parameters:
+        verdict (Verdict): The verdict of the local filter.
+
+        Returns:
+        bool: False for a block, and for a pass when skip_remote is set.
+        """
+        if verdict is Verdict.BLOCK:
+            return False
+        return not (verdict is Verdict.PASS and self.skip_remote)
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the filter.
+
+        Returns:
+        dict: The number of prompts by verdict and the remote calls saved.
+        """
+        return {
+            **{verdict.value: self.verdicts[verdict] for verdict in Verdict},
+            "remote_calls_saved": self.saved,
+        }
+
+
+prefilter = PreFilter(blocked_terms=(*BLOCKED_TERMS, *read_terms(BLOCKED_TERMS_PATH)))
@@ -0,0 +1,236 @@
+"""
+This module makes the calls to the OpenAI API resilient to transient failures.
+
+A short burst of rate-limit errors or timeouts should not turn into a wave of failed
+conversations. The Resilience class retries transient errors with jittered exponential backoff,
+honours the Retry-After header sent with 429 responses, and trips a circuit breaker when the
+upstream keeps failing so that users get a fast, friendly answer instead of waiting for
+requests that are bound to fail.
+
+Features:
+- Retries of rate-limit, timeout, connection and 5xx errors with full-jitter exponential backoff.
+- Retry-After and retry-after-ms headers take precedence over the computed backoff.
+- A circuit breaker that opens after a number of consecutive failed calls, fails fast while
+    open, and lets a single trial call through once the reset timeout has elapsed.
+- Counters of calls, retries, failures, breaker trips and short-circuited calls, also exported
+    as peb_resilience_retries_total, peb_breaker_trips_total and
+    peb_breaker_short_circuits_total, labelled by the name of the upstream.
+
+Usage:
+    resilience = Resilience("openai", max_retries=3)
+    try:
+        response = await resilience.call(client.moderations.create, input=prompt)
+    except CircuitOpenError:
+        ...
+
+Note:
+- Errors that retrying cannot fix (bad request, authentication, permission) are raised at once
+    and do not count against the breaker.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+
+import openai
+
+from peb.metrics import breaker_short_circuits, breaker_trips, resilience_retries
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+def retry_after(error) -> float | None:
+    """
+    Return the delay requested by the server in the Retry-After headers of an error.
+
+    Parameters:
+    error (Exception): The error raised by the OpenAI client.
+
+    Returns:
+    float | None: The delay in seconds, or None if the server did not request one.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class Resilience:
+    """
+    Retry policy and circuit breaker shared by the calls to an upstream service.
+
+    Attributes:
+    name (str): The label of the upstream in the metrics.
+    max_retries (int): Retries of a call after its first attempt.
+    base_delay (float): Backoff cap, in seconds, of the first retry; it doubles on each retry.
+    max_delay (float): Upper bound, in seconds, of any delay between attempts.
+    failure_threshold (int): Consecutive failed calls that open the breaker.
+    reset_timeout (float): Seconds the breaker stays open before a trial call is allowed.
+
+    Methods:
+    call(func, *args, **kwargs): Await func with retries, guarded by the breaker.
+    is_open(): Return True while the breaker rejects calls.
+    stats(): Return the counters and the state of the breaker.
+    """
+
+    def __init__(self, name="openai", max_retries=3, base_delay=0.5, max_delay=20.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.trips = 0
+        self.short_circuits = 0
+        self._consecutive_failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+
+    def is_open(self) -> bool:
+        """
+        Return True while the breaker rejects calls.
+
+        Returns:
+        bool: True if the breaker is open and its reset timeout has not elapsed.
+        """
+        return (
+            self._opened_at is not None
+            and time.monotonic() - self._opened_at < self.reset_timeout
+        )
+
+    def _admit(self) -> None:
+        """
+        Let a call through or raise CircuitOpenError.
+
+        Once the reset timeout has elapsed only one trial call is admitted at a time; its
+        outcome closes or reopens the breaker.
+
+        Returns:
+        None
+        """
+        if self._opened_at is None:
+            return
+        if self.is_open() or self._trial_running:
+            self.short_circuits += 1
+            breaker_short_circuits.inc(self.name)
+            raise CircuitOpenError("The upstream service is unavailable")
+        self._trial_running = True
+
+    def _record_success(self) -> None:
+        """Close the breaker after a successful call."""
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def _record_failure(self) -> None:
+        """Count a failed call and open the breaker if the threshold is reached."""
+        self.failures += 1
+        self._consecutive_failures += 1
+        trial_failed = self._trial_running
+        self._trial_running = False
+        if trial_failed or (
+            self._opened_at is None
+            and self._consecutive_failures >= self.failure_threshold
+        ):
+            self.trips += 1
+            breaker_trips.inc(self.name)
+            self._opened_at = time.monotonic()
+            logger.warning("Circuit breaker opened after %d consecutive failures",
+                           self._consecutive_failures)
+
+    def backoff(self, attempt) -> float:
+        """
+        Return the full-jitter backoff before the given retry.
+
+        Parameters:
+        attempt (int): The number of the attempt that failed, starting at 0.
+
+        Returns:
+        float: The delay in seconds.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs), retrying transient errors.
+
+        Parameters:
+        func (Callable): The coroutine function to call.
+        args: Positional arguments of func.
+        kwargs: Keyword arguments of func.
+
+        Returns:
+        The result of func.
+
+        Raises:
+        CircuitOpenError: If the breaker is open.
+        Exception: The last error of func if every attempt failed, or any error that is not
+            transient.
+        """
+        self._admit()
+        self.calls += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await func(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        self._record_failure()
+                        raise
+                    delay = retry_after(e)
+                    if delay is None:
+                        delay = self.backoff(attempt)
+                    delay = min(delay, self.max_delay)
+                    self.retries += 1
+                    resilience_retries.inc(self.name, type(e).__name__)
+                    logger.info("Retrying in %.2f s after %s", delay, type(e).__name__)
+                else:
+                    self._record_success()
+                    return result
+                await asyncio.sleep(delay)
+        finally:
+            # A trial cancelled or failed with a permanent error, even during its backoff,
+            # must not keep the breaker half-open for good.
+            self._trial_running = False
+
+    def stats(self) -> dict:
+        """
+        Return the counters and the state of the breaker.
+
+        Returns:
+        dict: The number of calls, retries, failures, breaker trips and short-circuited calls,
+            and whether the breaker is open.
+        """
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "breaker_trips": self.trips,
+            "short_circuits": self.short_circuits,
+            "breaker_open": self.is_open(),
+        }
@@ -0,0 +1,282 @@
+"""
+This module keeps the OpenAI requests of the bot within the organization's quotas.
+
+OpenAI limits every organization to a number of requests per minute (RPM) and tokens per minute
+(TPM). Sending requests as fast as users click blows the quota and is paid for in 429 errors
+and retries. The AdmissionScheduler class holds every request until both quotas allow it,
+releasing the queued work at the highest rate the quota permits and serving the users with
+pending requests in turn, so one user cannot starve the others.
+
+Features:
+- TokenBucket: a bucket refilled continuously at a per-minute rate, with a bounded burst.
+- AdmissionScheduler: one bucket for requests and one for estimated tokens, per-user queues
+    served round-robin, and counters of queue depth and waiting time, also exported as the
+    peb_scheduler_queue_depth gauge and the peb_scheduler_wait_seconds histogram, labelled by
+    the name of the scheduler.
+- estimate_tokens(): a cheap local estimate of the number of tokens of a text (see peb.tokens).
+
+Usage:
+    scheduler = AdmissionScheduler("completion", requests_per_minute=3500, tokens_per_minute=90000)
+    response = await scheduler.run(user_id, estimate_tokens(prompt), func, *args, **kwargs)
+
+Note:
+- A rate of 0 disables the corresponding bucket; with both rates at 0 requests are never held.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from peb.metrics import scheduler_queue_depth, scheduler_wait_seconds
+from peb.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text) -> int:
+    """
+    Estimate the number of tokens of a text, with peb.tokens.count_tokens.
+
+    Parameters:
+    text (str): The text to measure.
+
+    Returns:
+    int: The estimated number of tokens.
+    """
+    return count_tokens(text)
+
+
+class TokenBucket:
+    """
+    A token bucket refilled at a constant per-minute rate.
+
+    Attributes:
+    rate (float): Tokens added per second; 0 means the bucket never limits.
+    capacity (float): Maximum number of tokens the bucket holds (the allowed burst).
+    tokens (float): Tokens currently available.
+
+    Methods:
+    delay(amount): Seconds until amount tokens are available.
+    consume(amount): Take amount tokens from the bucket.
+    """
+
+    def __init__(self, rate_per_minute, burst_seconds=10.0):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        """Add the tokens earned since the last refill."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount) -> float:
+        """
+        Return the seconds to wait until amount tokens are available.
+
+        Requests larger than the capacity only wait for a full bucket.
+
+        Parameters:
+        amount (float): The tokens needed.
+
+        Returns:
+        float: The delay in seconds, 0 if the tokens are available now.
+        """
+        if not self.rate:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount) -> None:
+        """
+        Take amount tokens from the bucket.
+
+        Parameters:
+        amount (float): The tokens consumed.
+
+        Returns:
+        None
+        """
+        if self.rate:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+
+class AdmissionScheduler:
+    """
+    Admission control of requests against requests-per-minute and tokens-per-minute quotas.
+
+    Attributes:
+    name (str): The label of the scheduler in the metrics.
+    requests (TokenBucket): The bucket of requests.
+    tokens (TokenBucket): The bucket of estimated tokens.
+    admitted (int): Requests admitted so far.
+    queued (int): Requests that had to wait in the queue.
+    total_wait (float): Seconds waited by all the queued requests.
+    max_wait (float): Longest wait of a queued request, in seconds.
+
+    Methods:
+    enabled: True if at least one of the quotas is set.
+    acquire(user, tokens): Wait until the request of the user is admitted.
+    run(user, tokens, func, *args, **kwargs): Acquire, then await func.
+    queue_depth(): Return the number of requests waiting.
+    stats(): Return the counters of the scheduler.
+    """
+
+    def __init__(self, name="openai", requests_per_minute=0, tokens_per_minute=0,
+                 burst_seconds=10.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.admitted = 0
+        self.queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._queues: OrderedDict[object, deque] = OrderedDict()
+        self._depth = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Return True if at least one of the quotas is set.
+
+        Returns:
+        bool: Whether requests can be held by the scheduler.
+        """
+        return bool(self.requests.rate or self.tokens.rate)
+
+    def _delay(self, tokens) -> float:
+        """Return the seconds until both buckets admit a request of the given tokens."""
+        return max(self.requests.delay(1), self.tokens.delay(tokens))
+
+    def _admit(self, tokens) -> None:
+        """Take a request and its tokens from the buckets."""
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+        self.admitted += 1
+
+    def _set_depth(self, change) -> None:
+        """Update the number of queued requests and its gauge."""
+        self._depth += change
+        scheduler_queue_depth.set(self._depth, self.name)
+
+    def _start(self) -> None:
+        """Start the dispatcher on the running event loop, if it is not running there yet."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._dispatcher is None or self._dispatcher.done():
+            self._loop = loop
+            self._queues.clear()
+            self._set_depth(-self._depth)
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    async def acquire(self, user, tokens=0) -> None:
+        """
+        Wait until a request of the user is admitted by both quotas.
+
+        The request is admitted at once if nothing is queued and the buckets allow it;
+        otherwise it joins the queue of the user.
+
+        Parameters:
+        user (Hashable): The user making the request, used for fair queuing.
+        tokens (int): The estimated tokens of the request.
+
+        Returns:
+        None
+        """
+        if not self.enabled:
+            return
+        self._start()
+        if not self._queues and self._delay(tokens) == 0:
+            self._admit(tokens)
+            scheduler_wait_seconds.observe(0.0, self.name)
+            return
+        future = self._loop.create_future()
+        enqueued = time.monotonic()
+        self._queues.setdefault(user, deque()).append((future, tokens))
+        self._set_depth(1)
+        self._wakeup.set()
+        await future
+        waited = time.monotonic() - enqueued
+        self.queued += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        scheduler_wait_seconds.observe(waited, self.name)
+
+    async def run(self, user, tokens, func, *args, **kwargs):
+        """
+        Wait for admission, then await func(*args, **kwargs).
+
+        Parameters:
+        user (Hashable): The user making the request.
+        tokens (int): The estimated tokens of the request.
+        func (Callable): The coroutine function to call once admitted.
+        args: Positional arguments of func.
+        kwargs: Keyword arguments of func.
+
+        Returns:
+        The result of func.
+        """
+        await self.acquire(user, tokens)
+        return await func(*args, **kwargs)
+
+    async def _dispatch(self) -> None:
+        """Release the queued requests, one user at a time, as fast as the buckets allow."""
+        while True:
+            if not self._queues:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            user, queue = next(iter(self._queues.items()))
+            future, tokens = queue[0]
+            if future.done():
+                # The caller was cancelled while it waited.
+                queue.popleft()
+                self._set_depth(-1)
+                if not queue:
+                    del self._queues[user]
+                continue
+            delay = self._delay(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._admit(tokens)
+            queue.popleft()
+            self._set_depth(-1)
+            future.set_result(None)
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+
+    def queue_depth(self) -> int:
+        """
+        Return the number of requests waiting for admission.
+
+        Returns:
+        int: The number of queued requests.
+        """
+        return self._depth
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the scheduler.
+
+        Returns:
+        dict: The admitted and queued requests, the queue depth and the waiting times.
+        """
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "queue_depth": self.queue_depth(),
+            "average_wait": self.total_wait / self.queued if self.queued else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,155 @@
+"""
+This module keeps the answers of each user in a compact session and bounds their number.
+
+The answers of a user were a plain dict in context.user_data, kept for every user who ever
+typed /start. A dict with ten string keys costs several hundred bytes before its values, and
+nothing removed the users who left. Session stores the same answers in the slots of an object,
+one per step of the canvas, and the sessions idle for too long, or the least recently used ones
+beyond a global cap, are evicted along with their conversation.
+
+Features:
+- Session: a mutable mapping of the answers, with one slot per step of BotState and one for the
+    moderation verdicts; it is used as context.user_data through ContextTypes.
+- last_seen: the monotonic time of the last update of the user, set by touch().
+- expired_sessions(): the users idle for longer than the timeout, and the least recently seen
+    ones beyond the cap.
+
+Environment Variables:
+- TELEGRAM_SESSION_IDLE_TIMEOUT: Seconds without an update after which a session is evicted
+    (default 86400, 0 never expires).
+- TELEGRAM_MAX_SESSIONS: Sessions kept in memory; the least recently seen are evicted beyond it
+    (default 100000, 0 for no cap).
+- TELEGRAM_SESSION_SWEEP_INTERVAL: Seconds between two sweeps of the sessions (default 60).
+
+Usage:
+    application = Application.builder().context_types(ContextTypes(user_data=Session))...
+    context.user_data["goal"] = "Learn Python"
+    for user_id, reason in expired_sessions(application.user_data, 86400, 100000):
+        application.drop_user_data(user_id)
+
+Note:
+- Only the steps of the canvas and the moderation verdicts can be stored; any other key raises
+    KeyError, and the unknown keys of a persisted session are dropped when it is loaded.
+- last_seen is not persisted: the sessions restored after a restart count as seen at startup.
+"""
+from __future__ import annotations
+
+import heapq
+import os
+import time
+from collections.abc import MutableMapping
+
+from dotenv import load_dotenv
+
+from peb.data import BotState
+
+load_dotenv()
+
+SESSION_IDLE_TIMEOUT = float(os.getenv("TELEGRAM_SESSION_IDLE_TIMEOUT", "86400"))
+MAX_SESSIONS = int(os.getenv("TELEGRAM_MAX_SESSIONS", "100000"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("TELEGRAM_SESSION_SWEEP_INTERVAL", "60"))
+
+# The key of the user data holding the moderation verdict of each answer: [digest, flagged].
+MODERATION_KEY = "moderation"
+# One field per step that stores an answer, in the order of the canvas, and the verdicts.
+FIELDS = (
+    *(state.name.lower() for state in BotState if state not in (BotState.START, BotState.SKIP)),
+    MODERATION_KEY,
+)
+FIELD_SET = frozenset(FIELDS)
+
+
+class Session(MutableMapping):
+    """
+    The answers of a user, stored in slots instead of a dict.
+
+    Attributes:
+    last_seen (float): The monotonic time of the last update of the user.
+
+    Methods:
+    touch(now): Record an update of the user.
+    """
+
+    __slots__ = (*FIELDS, "last_seen")
+
+    def __init__(self, data=()):
+        self.last_seen = time.monotonic()
+        for key, value in dict(data).items():
+            if key in FIELD_SET:
+                setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key not in FIELD_SET:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value) -> None:
+        if key not in FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key) -> None:
+        if key not in FIELD_SET:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return (field for field in FIELDS if hasattr(self, field))
+
+    def __len__(self) -> int:
+        return sum(hasattr(self, field) for field in FIELDS)
+
+    def __repr__(self) -> str:
+        return f"Session({dict(self)!r})"
+
+    def clear(self) -> None:
+        for field in FIELDS:
+            if hasattr(self, field):
+                delattr(self, field)
+
+    def touch(self, now=None) -> None:
+        """
+        Record an update of the user.
+
+        Parameters:
+        now (float | None): The monotonic time, None for the current time.
+
+        Returns:
+        None
+        """
+        self.last_seen = time.monotonic() if now is None else now
+
+
+def expired_sessions(sessions, idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=MAX_SESSIONS,
+                     now=None) -> list[tuple[int, str]]:
+    """
+    Return the sessions to evict: the idle ones, then the least recently seen beyond the cap.
+
+    Parameters:
+    sessions (Mapping[int, Session]): The sessions by user id, like application.user_data.
+    idle_timeout (float): Seconds without an update before a session expires, 0 for never.
+    max_sessions (int): The most sessions kept, 0 for no cap.
+    now (float | None): The monotonic time, None for the current time.
+
+    Returns:
+    list[tuple[int, str]]: The user ids with the reason of their eviction, "idle" or
+        "capacity".
+    """
+    now = time.monotonic() if now is None else now
+    seen = {user_id: getattr(session, "last_seen", now) for user_id, session in sessions.items()}
+    expired = []
+    if idle_timeout:
+        expired = [(user_id, "idle") for user_id, last_seen in seen.items()
+                   if now - last_seen > idle_timeout]
+        for user_id, _ in expired:
+            del seen[user_id]
+    if max_sessions and len(seen) > max_sessions:
+        oldest = heapq.nsmallest(len(seen) - max_sessions, seen, key=seen.__getitem__)
+        expired.extend((user_id, "capacity") for user_id in oldest)
+    return expired
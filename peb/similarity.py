@@ -0,0 +1,365 @@
+"""
+This module finds the prompts that were already enhanced and are almost the same as a new one.
+
+The completion cache only answers a canvas that is identical to a previous one once its
+whitespace is normalized. Most users start from the same examples, so many canvases differ by a
+word or two ("Learn Python" and "Learn python basics") and still cost a new completion. The
+SimilarityIndex class keeps a 128-bit SimHash signature of every enhanced prompt and finds the
+closest previous prompt above a similarity threshold, so its enhancement can be reused.
+
+Features:
+- simhash(): a locality-sensitive signature of the words of a text, computed locally. Texts that
+    share most of their words have signatures that differ in few bits. The words of a template,
+    like the labels of the canvas, are left out: they are the same in every prompt and would
+    make all the signatures alike.
+- SimilarityIndex: the signatures split in bands, one table per band. With max_distance // 2 + 1
+    bands, two signatures within the maximum distance differ by at most one bit in one of the
+    bands (pigeonhole principle), so a lookup probes the value of each band and its values one
+    bit away, and only compares the signatures of a few small buckets.
+- Buckets hold at most max_bucket signatures, the newest: prompts built from the same examples
+    crowd a few values of the bands, and the cap bounds the signatures a lookup compares. A
+    signature dropped from a bucket is still found through its other bands, most of the time.
+- A signature equal to the one looked up is found without probing the bands, and replaces the
+    entry of the same signature when it is inserted.
+- Namespaces: only the prompts sent with the same instruction, suggestions and model match.
+- Eviction of the oldest entries beyond max_entries or older than ttl.
+- Optional SQLite persistence; the index is reloaded on first use after a restart.
+
+Environment Variables:
+- OPENAI_SIMILAR_PROMPTS: Set to 1 to answer a prompt with the enhancement of a near-duplicate
+    (default 0).
+- OPENAI_SIMILARITY_THRESHOLD: Minimum similarity, the share of equal signature bits, of a
+    near-duplicate (default 0.9).
+- OPENAI_SIMILAR_ENTRIES: Prompts kept in the index (default 100000).
+
+Usage:
+    index = SimilarityIndex(threshold=0.9, path="cache.sqlite3", template=final_message.values())
+    index.add(prompt, cache_key, namespace)
+    match = index.lookup("Learn python basics", namespace)
+    if match is not None:
+        cache_key, similarity = match
+
+Note:
+- The lower the threshold, the more bands to probe. With the default 0.9 and one million
+    canvases built from the examples, a lookup takes about 0.5 ms at the median and under 1 ms
+    at the 99th percentile, and finds about 85% of the near-duplicates found without the cap of
+    the buckets (see benchmarks/bench_similarity.py).
+- Several processes can share the database: the ids of the entries are random, so their inserts
+    never collide.
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SIMILAR_PROMPTS = os.getenv("OPENAI_SIMILAR_PROMPTS", "0") == "1"
+SIMILARITY_THRESHOLD = float(os.getenv("OPENAI_SIMILARITY_THRESHOLD", "0.9"))
+SIMILAR_ENTRIES = int(os.getenv("OPENAI_SIMILAR_ENTRIES", "100000"))
+
+BITS = 128
+WORDS = re.compile(r"\w+")
+# The bit counts of a signature are summed in lanes of LANE bits of a single integer.
+LANE = 16
+LANE_MASK = (1 << LANE) - 1
+# SPREAD[position][byte]: the bits of a byte of a hash at its position, each in its own lane.
+SPREAD = [
+    [sum(((byte >> bit) & 1) << ((position * 8 + bit) * LANE) for bit in range(8))
+     for byte in range(256)]
+    for position in range(BITS // 8)
+]
+
+
+@functools.lru_cache(maxsize=65536)
+def spread_word(word) -> int:
+    """
+    Return the hash of a word with each of its bits in its own lane.
+
+    Parameters:
+    word (str): The word.
+
+    Returns:
+    int: The spread hash.
+    """
+    digest = hashlib.blake2b(word.encode(), digest_size=BITS // 8).digest()
+    return sum(spread[byte] for spread, byte in zip(SPREAD, digest))
+
+
+def simhash(text, ignore=frozenset()) -> int:
+    """
+    Return the SimHash signature of the words of a text, ignoring case and punctuation.
+
+    Parameters:
+    text (str): The text.
+    ignore (frozenset[str]): Casefolded words left out of the signature.
+
+    Returns:
+    int: The 128-bit signature: a bit is set if it is set in the hashes of most words.
+    """
+    words = [word for word in WORDS.findall(text.casefold()) if word not in ignore]
+    counts = sum(map(spread_word, words))
+    signature = 0
+    for bit in range(BITS):
+        if ((counts >> (bit * LANE)) & LANE_MASK) * 2 > len(words):
+            signature |= 1 << bit
+    return signature
+
+
+def similarity(signature, other) -> float:
+    """
+    Return the similarity of two signatures.
+
+    Parameters:
+    signature (int): A signature.
+    other (int): Another signature.
+
+    Returns:
+    float: The share of equal bits, from 0 to 1.
+    """
+    return 1 - (signature ^ other).bit_count() / BITS
+
+
+class SimilarityIndex:
+    """
+    Index of SimHash signatures answering the closest one above a similarity threshold.
+
+    Attributes:
+    threshold (float): Minimum similarity of a match.
+    max_distance (int): Maximum number of different bits of a match.
+    max_entries (int): Entries kept; the oldest are evicted.
+    ttl (float): Seconds an entry stays valid.
+    path (str | None): Path of the SQLite database, or None for a memory-only index.
+    ignore (frozenset[str]): The words of the template, left out of the signatures of add and
+        lookup.
+    max_bucket (int): Signatures kept in a bucket of a band; the oldest are dropped.
+    lookups (int): Lookups made.
+    hits (int): Lookups that found a match.
+    evictions (int): Entries evicted because of max_entries or ttl, or replaced by an entry with
+        the same signature.
+
+    Methods:
+    add(text, value, namespace): Index a text with its value.
+    lookup(text, namespace): Return the value of the closest text and its similarity.
+    insert(signature, value, namespace): Index a signature.
+    search(signature, namespace): Return the value of the closest signature.
+    stats(): Return the counters and the size of the index.
+    close(): Close the SQLite database.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=100_000, ttl=604_800.0, path=None, template=(),
+                 max_bucket=16):
+        self.threshold = threshold
+        self.max_distance = int((1 - threshold) * BITS)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.ignore = frozenset(WORDS.findall(" ".join(template).casefold()))
+        self.max_bucket = max_bucket
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        bands = self.max_distance // 2 + 1
+        # Per band: its first bit, its mask and the masks of the probes (no bit or one bit).
+        self._bands = []
+        for band in range(bands):
+            start, end = BITS * band // bands, BITS * (band + 1) // bands
+            probes = (0, *(1 << bit for bit in range(end - start)))
+            self._bands.append((start, (1 << (end - start)) - 1, probes))
+        # Per namespace and band: the bits of the band -> the signatures, oldest first.
+        self._tables: dict[str, list[dict[int, list[int]]]] = {}
+        # Per namespace: signature -> entry id.
+        self._ids: dict[str, dict[int, int]] = {}
+        # Entry id -> (signature, namespace, value, created), oldest first.
+        self._entries: OrderedDict[int, tuple[int, str, str, float]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._loaded = not path
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the SQLite database on first use."""
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS similar ("
+                "id INTEGER PRIMARY KEY, signature TEXT NOT NULL, namespace TEXT NOT NULL, "
+                "value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+        return self._db
+
+    def _load(self) -> None:
+        """Load the entries of the SQLite database, once."""
+        if self._loaded:
+            return
+        self._loaded = True
+        rows = self._connection().execute(
+            "SELECT id, signature, namespace, value, created FROM similar ORDER BY created"
+        ).fetchall()
+        for entry_id, signature, namespace, value, created in rows:
+            self._index(entry_id, int(signature, 16), namespace, value, created)
+        self._evict()
+        logger.info("Loaded %d prompts in the similarity index", len(self._entries))
+
+    def _index(self, entry_id, signature, namespace, value, created) -> None:
+        """Add an entry to the memory structures, replacing the one of the same signature."""
+        ids = self._ids.setdefault(namespace, {})
+        if signature in ids:
+            self._remove(ids[signature])
+        self._entries[entry_id] = (signature, namespace, value, created)
+        ids[signature] = entry_id
+        tables = self._tables.setdefault(namespace, [{} for _ in self._bands])
+        for table, (start, mask, _) in zip(tables, self._bands):
+            bucket = table.setdefault((signature >> start) & mask, [])
+            bucket.append(signature)
+            if len(bucket) > self.max_bucket:
+                del bucket[0]
+
+    def _remove(self, entry_id) -> None:
+        """Remove an entry from the memory structures and the database."""
+        signature, namespace, _, _ = self._entries.pop(entry_id)
+        del self._ids[namespace][signature]
+        for table, (start, mask, _) in zip(self._tables[namespace], self._bands):
+            key = (signature >> start) & mask
+            bucket = table.get(key, ())
+            if signature in bucket:
+                bucket.remove(signature)
+                if not bucket:
+                    del table[key]
+        if self.path:
+            self._connection().execute("DELETE FROM similar WHERE id = ?", (entry_id,))
+        self.evictions += 1
+
+    def _evict(self) -> None:
+        """Evict the oldest entries beyond max_entries and the expired ones."""
+        expired = time.time() - self.ttl
+        while self._entries:
+            entry_id, (_, _, _, created) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and created > expired:
+                break
+            self._remove(entry_id)
+
+    def insert(self, signature, value, namespace="") -> None:
+        """
+        Index a signature with its value.
+
+        The entry gets a random 63-bit id: the processes sharing the database never pick the
+        same one, and an id is never reused while another process still holds its entry.
+
+        Parameters:
+        signature (int): The SimHash signature.
+        value (str): The value returned by a match, like a cache key.
+        namespace (str): Only the signatures of the same namespace match each other.
+
+        Returns:
+        None
+
+        Raises:
+        sqlite3.Error: If the entry cannot be written; it is not indexed then.
+        """
+        self._load()
+        created = time.time()
+        entry_id = secrets.randbits(63)
+        if self.path:
+            self._connection().execute(
+                "INSERT INTO similar (id, signature, namespace, value, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (entry_id, f"{signature:x}", namespace, value, created),
+            )
+        self._index(entry_id, signature, namespace, value, created)
+        self._evict()
+
+    def search(self, signature, namespace="") -> tuple[str, float] | None:
+        """
+        Return the value of the closest signature of the namespace within the threshold.
+
+        Parameters:
+        signature (int): The SimHash signature.
+        namespace (str): The namespace.
+
+        Returns:
+        tuple[str, float] | None: The value and the similarity of the match, or None.
+        """
+        self._load()
+        self._evict()
+        self.lookups += 1
+        ids = self._ids.get(namespace, {})
+        if signature in ids:
+            self.hits += 1
+            return self._entries[ids[signature]][2], 1.0
+        candidates: list[int] = []
+        for table, (start, mask, probes) in zip(self._tables.get(namespace, ()), self._bands):
+            keys = map(((signature >> start) & mask).__xor__, probes)
+            for bucket in filter(None, map(table.get, keys)):
+                candidates.extend(bucket)
+        if not candidates:
+            return None
+        distances = list(map(int.bit_count, map(signature.__xor__, candidates)))
+        distance = min(distances)
+        if distance > self.max_distance:
+            return None
+        self.hits += 1
+        closest = candidates[distances.index(distance)]
+        return self._entries[ids[closest]][2], 1 - distance / BITS
+
+    def add(self, text, value, namespace="") -> None:
+        """
+        Index a text with its value.
+
+        Parameters:
+        text (str): The text, like an enhanced prompt.
+        value (str): The value returned by a match.
+        namespace (str): Only the texts of the same namespace match each other.
+
+        Returns:
+        None
+        """
+        self.insert(simhash(text, self.ignore), value, namespace)
+
+    def lookup(self, text, namespace="") -> tuple[str, float] | None:
+        """
+        Return the value of the closest text of the namespace within the threshold.
+
+        Parameters:
+        text (str): The text.
+        namespace (str): The namespace.
+
+        Returns:
+        tuple[str, float] | None: The value and the similarity of the match, or None.
+        """
+        return self.search(simhash(text, self.ignore), namespace)
+
+    def stats(self) -> dict:
+        """
+        Return the counters and the size of the index.
+
+        Returns:
+        dict: The lookups, hits, evictions and entries.
+        """
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+    def close(self) -> None:
+        """
+        Close the SQLite database.
+
+        Returns:
+        None
+        """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,98 @@
+"""
+This module shares one call among the concurrent callers that make the same request.
+
+Users start from the same examples, so identical canvases are often enhanced at the same time by
+different users, each paying for the same completion. The SingleFlight class runs the first
+call of a key and lets the identical calls made while it is in flight await its result instead
+of making their own.
+
+Features:
+- The callers of a key share one task and get its result or its error.
+- A caller that is cancelled leaves the others waiting: the call is only cancelled when all its
+    callers are gone.
+- Metrics: peb_collapsed_requests_total, labelled by the name of the calls.
+
+Usage:
+    completions = SingleFlight("create")
+    response = await completions.run(key, request, prompt)
+
+Note:
+- The key must identify the whole request: the callers get the same result object.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from peb.metrics import collapsed_requests
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Collapses the concurrent calls with the same key into one.
+
+    Attributes:
+    name (str): The label of the calls in the metrics.
+    collapsed (int): Calls that awaited a call already in flight.
+
+    Methods:
+    run(key, func, *args, **kwargs): Await func, or the call of the same key in flight.
+    in_flight(): Return the number of calls in flight.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.collapsed = 0
+        # Key -> the task of the call and the number of its callers.
+        self._calls: dict[object, list] = {}
+
+    async def run(self, key, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs), or the call of the same key already in flight.
+
+        Parameters:
+        key (Hashable): The key of the request.
+        func (Callable): The coroutine function making the request.
+        args: Positional arguments of func.
+        kwargs: Keyword arguments of func.
+
+        Returns:
+        The result of the call.
+
+        Raises:
+        Exception: The error of the call.
+        """
+        call = self._calls.get(key)
+        if call is not None and call[0].get_loop() is asyncio.get_running_loop():
+            self.collapsed += 1
+            collapsed_requests.inc(self.name)
+            logger.info("Request collapsed into the identical one in flight")
+        else:
+            call = self._calls[key] = [asyncio.ensure_future(func(*args, **kwargs)), 0]
+            call[0].add_done_callback(lambda _: self._forget(key, call))
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if not call[1] and not task.done():
+                # The last caller is gone: nobody waits for the result any more.
+                self._forget(key, call)
+                task.cancel()
+
+    def _forget(self, key, call) -> None:
+        """Remove a call, unless another one has taken its key."""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        """
+        Return the number of calls in flight.
+
+        Returns:
+        int: The keys with a running call.
+        """
+        return len(self._calls)
@@ -0,0 +1,558 @@
+"""
+This module runs the bot as several worker processes behind a supervisor.
+
+One process runs every conversation on one event loop, under one GIL. In supervisor mode the
+Supervisor class receives the updates (from the webhook, or by polling) and starts N worker
+processes, each running the whole bot on its own event loop. Every update is forwarded to a
+worker chosen by consistent hashing of its chat id, so all the updates of a conversation reach
+the worker holding that conversation, and adding or removing a worker only moves the chats of
+about 1/N of the ring.
+
+Features:
+- HashRing: a consistent-hash ring with virtual nodes.
+- chat_id(): the chat of a raw update, used as the sharding key.
+- Supervisor: starts, adds and removes workers, and forwards each update to its worker over a
+    local webhook authenticated with a per-supervisor secret token.
+- Hand-over of the chats when the ring changes: forwarding is held, every worker writes its
+    conversations to the shared persistence, then reloads the chats it owns in the new ring
+    and forgets the others (see peb.telegram_bot.handover).
+
+Environment Variables:
+- TELEGRAM_WORKERS: Number of worker processes; above 1 the bot runs in supervisor mode
+    (default 1).
+- TELEGRAM_WORKER_PORT: Port of the first worker; the workers listen on 127.0.0.1, on
+    consecutive ports (default 8600).
+
+Usage:
+    supervisor = Supervisor(run_worker, workers=4)
+    asyncio.run(supervisor.run(bot, url=WEBHOOK_URL))
+
+Note:
+- The workers share the persistence database, which carries the chats from one worker to the
+    next; without a persistence, a chat moved to another worker starts the canvas again.
+- Every worker reloads the chats it owns at each change of the ring, which costs a read of the
+    whole database per worker: workers are meant to be added and removed rarely.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+from collections import Counter
+from http import HTTPStatus
+
+import httpx
+from dotenv import load_dotenv
+from telegram import Update
+
+from peb.http_server import HttpServer, Response
+from peb.webhook import (
+    SECRET_HEADER,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    authorized,
+    check_secret,
+    ssl_context,
+)
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("TELEGRAM_WORKERS", "1"))
+WORKER_PORT = int(os.getenv("TELEGRAM_WORKER_PORT", "8600"))
+WORKER_PATH = "/update"
+HANDOVER_PATH = "/handover"
+
+
+def _hash(key) -> int:
+    """Return a well-spread 64-bit hash of a key, stable across processes."""
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    A consistent-hash ring mapping keys to nodes.
+
+    Each node owns `replicas` points of the ring; a key belongs to the node of the first point
+    after the hash of the key. Adding or removing a node only moves the keys of its points.
+
+    Attributes:
+    replicas (int): Virtual nodes per node.
+    nodes (set[str]): The nodes of the ring.
+
+    Methods:
+    add(node): Add a node to the ring.
+    remove(node): Remove a node from the ring.
+    get(key): Return the node owning a key.
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes: set[str] = set()
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node) -> None:
+        """
+        Add a node to the ring.
+
+        Parameters:
+        node (str): The node.
+
+        Returns:
+        None
+        """
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node) -> None:
+        """
+        Remove a node from the ring.
+
+        Parameters:
+        node (str): The node.
+
+        Returns:
+        None
+        """
+        self.nodes.discard(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: self._owners[point] for point in self._points}
+
+    def get(self, key) -> str:
+        """
+        Return the node owning a key.
+
+        Parameters:
+        key (Hashable): The key.
+
+        Returns:
+        str: The node.
+
+        Raises:
+        LookupError: If the ring is empty.
+        """
+        if not self._points:
+            raise LookupError("The hash ring has no nodes")
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+def chat_id(update) -> int:
+    """
+    Return the chat of a raw update, or the user for updates without a chat.
+
+    Parameters:
+    update (dict): The update, as sent by Telegram.
+
+    Returns:
+    int: The chat id, the user id, or the update id if neither is present.
+    """
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        # Callback queries hold the message with the button.
+        for holder in (value, value.get("message")):
+            if isinstance(holder, dict) and isinstance(holder.get("chat"), dict):
+                return holder["chat"]["id"]
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict):
+            return sender["id"]
+    return update.get("update_id", 0)
+
+
+class Supervisor:
+    """
+    Supervisor of the worker processes, forwarding each update to the worker of its chat.
+
+    Attributes:
+    worker (Callable): Module-level function run in each worker process; it is called with the
+        port and the secret token of the worker, followed by worker_args.
+    worker_args (tuple): Additional arguments of worker.
+    workers (int): Workers started by run().
+    base_port (int): Port of the first worker.
+    ring (HashRing): The ring of the running workers.
+    secret_token (str): Secret token the workers require from the supervisor.
+    public_secret (str | None): Secret token Telegram must send to the supervisor's webhook.
+    forwarded (Counter): Updates forwarded to each worker.
+    failed (int): Updates that could not be forwarded or were refused by their worker.
+
+    Methods:
+    add_worker(): Start a worker and add it to the ring.
+    remove_worker(name): Remove a worker from the ring and stop it.
+    forward(update, body): Forward an update to its worker.
+    handle(request): Receive an update posted by Telegram.
+    run(bot, url): Run the supervisor until SIGINT or SIGTERM.
+    stats(): Return the counters of the supervisor.
+    """
+
+    def __init__(self, worker, worker_args=(), workers=WORKERS, base_port=WORKER_PORT,
+                 replicas=100):
+        self.worker = worker
+        self.worker_args = worker_args
+        self.workers = workers
+        self.base_port = base_port
+        self.ring = HashRing(replicas=replicas)
+        self.secret_token = secrets.token_urlsafe(32)
+        self.forwarded: Counter = Counter()
+        self.failed = 0
+        self.public_secret: str | None = None
+        self._processes: dict[str, multiprocessing.Process] = {}
+        self._urls: dict[str, str] = {}
+        self._next = 0
+        self._client: httpx.AsyncClient | None = None
+        # Forwarding is held while the chats move between workers.
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._resharding = asyncio.Lock()
+        self._in_flight = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Return the HTTP client used to forward the updates, creating it on first use.
+
+        Returns:
+        httpx.AsyncClient: The client.
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={SECRET_HEADER: self.secret_token},
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=None),
+            )
+        return self._client
+
+    async def add_worker(self, timeout=30.0) -> str:
+        """
+        Start a worker process and add it to the ring once it accepts updates.
+
+        Parameters:
+        timeout (float): Seconds allowed for the worker to start.
+
+        Returns:
+        str: The name of the worker.
+
+        Raises:
+        RuntimeError: If the worker exits or does not start in time.
+        """
+        number, self._next = self._next, self._next + 1
+        name, port = f"worker-{number}", self.base_port + number
+        process = multiprocessing.get_context("spawn").Process(
+            target=self.worker, args=(port, self.secret_token, *self.worker_args), name=name
+        )
+        process.start()
+        url = f"http://127.0.0.1:{port}{WORKER_PATH}"
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            if not process.is_alive():
+                raise RuntimeError(f"{name} exited with code {process.exitcode}")
+            try:
+                # The worker only accepts POST: any answer means it is listening.
+                await self.client.get(url)
+                break
+            except httpx.TransportError:
+                if asyncio.get_running_loop().time() > deadline:
+                    process.kill()
+                    raise RuntimeError(f"{name} did not start in {timeout} seconds") from None
+                await asyncio.sleep(0.1)
+        async with self._resharding:
+            await self._hold()
+            try:
+                self._processes[name] = process
+                self._urls[name] = url
+                self.ring.add(name)
+            finally:
+                await self._release()
+        logger.info("%s started on port %d", name, port)
+        return name
+
+    async def remove_worker(self, name, timeout=10.0) -> None:
+        """
+        Remove a worker from the ring and stop it; its chats move to the other workers.
+
+        Parameters:
+        name (str): The name of the worker.
+        timeout (float): Seconds allowed for the worker to stop before it is killed.
+
+        Returns:
+        None
+        """
+        async with self._resharding:
+            await self._hold()
+            try:
+                self.ring.remove(name)
+                self._urls.pop(name)
+                await self._stop(name, self._processes.pop(name), timeout)
+            finally:
+                await self._release()
+
+    @staticmethod
+    async def _stop(name, process, timeout) -> None:
+        """Stop a worker process, killing it if it does not exit within timeout seconds."""
+        process.terminate()
+        await asyncio.to_thread(process.join, timeout)
+        if process.is_alive():
+            process.kill()
+        logger.info("%s stopped", name)
+
+    async def _hold(self) -> None:
+        """
+        Hold the forwarding, wait for the updates being forwarded, and have every worker write
+        its conversations to the persistence once it processed the updates it received.
+
+        Returns:
+        None
+        """
+        self._ready.clear()
+        while self._in_flight:
+            await asyncio.sleep(0.01)
+        await self._hand_over({"step": "flush"})
+
+    async def _release(self) -> None:
+        """
+        Have every worker reload the chats it owns in the ring and forget the others, then
+        resume the forwarding.
+
+        Returns:
+        None
+        """
+        try:
+            await self._hand_over({"step": "load", "nodes": sorted(self.ring.nodes),
+                                   "replicas": self.ring.replicas})
+        finally:
+            self._ready.set()
+
+    async def _hand_over(self, command) -> None:
+        """
+        Post a step of the hand-over to every worker.
+
+        Parameters:
+        command (dict): The step, with the ring for the "load" step.
+
+        Returns:
+        None
+        """
+        async def post(name, url):
+            try:
+                response = await self.client.post(
+                    url.replace(WORKER_PATH, HANDOVER_PATH),
+                    json={**command, "name": name}, timeout=60.0,
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as error:
+                logger.error("%s could not %s its chats: %s", name, command["step"], error)
+
+        await asyncio.gather(*(post(name, url) for name, url in self._urls.items()))
+
+    async def forward(self, update, body=None) -> bool:
+        """
+        Forward an update to the worker of its chat, once the chats are not moving.
+
+        Parameters:
+        update (dict): The update.
+        body (bytes | None): The update serialized as sent by Telegram, if available.
+
+        Returns:
+        bool: True if the worker accepted the update.
+        """
+        await self._ready.wait()
+        self._in_flight += 1
+        try:
+            name = self.ring.get(chat_id(update))
+            try:
+                response = await self.client.post(
+                    self._urls[name], content=body or json.dumps(update).encode(),
+                    headers={"Content-Type": "application/json"},
+                )
+            except httpx.TransportError as error:
+                logger.error("Could not forward update %s to %s: %s",
+                             update.get("update_id"), name, error)
+                self.failed += 1
+                return False
+        finally:
+            self._in_flight -= 1
+        if response.status_code != HTTPStatus.OK:
+            self.failed += 1
+            return False
+        self.forwarded[name] += 1
+        return True
+
+    async def handle(self, request) -> Response:
+        """
+        Receive an update posted by Telegram and forward it to its worker.
+
+        Parameters:
+        request (Request): The request posted by Telegram.
+
+        Returns:
+        Response: 200 once the worker accepted the update, 503 if it did not (Telegram sends
+            the update again), 403 for a wrong secret token and 400 for a body that is not an
+            update.
+        """
+        if not authorized(request, self.public_secret):
+            return Response(HTTPStatus.FORBIDDEN)
+        try:
+            update = json.loads(request.body)
+        except ValueError:
+            return Response(HTTPStatus.BAD_REQUEST)
+        if not isinstance(update, dict):
+            return Response(HTTPStatus.BAD_REQUEST)
+        if not await self.forward(update, request.body):
+            return Response(HTTPStatus.SERVICE_UNAVAILABLE)
+        return Response(HTTPStatus.OK)
+
+    async def _forward_in_order(self, updates) -> list[int]:
+        """
+        Forward the updates of one worker one after the other, keeping their order.
+
+        The first update the worker does not accept stops the forwarding: the updates after it
+        would overtake it.
+
+        Parameters:
+        updates (list[dict]): The updates, in order.
+
+        Returns:
+        list[int]: The ids of the updates forwarded.
+        """
+        forwarded = []
+        for update in updates:
+            if not await self.forward(update):
+                break
+            forwarded.append(update["update_id"])
+        return forwarded
+
+    async def poll(self, bot, stop_event) -> None:
+        """
+        Fetch the updates by long polling and forward them until stop_event is set.
+
+        The updates of a batch are forwarded to the workers concurrently, in order within each
+        worker. Like Telegram does with a webhook answering 503, an update a worker does not
+        accept is fetched again: the offset stays at the first update not forwarded, and the
+        updates after it that were forwarded already are skipped when they come back.
+
+        Parameters:
+        bot (telegram.Bot): The bot, initialized.
+        stop_event (asyncio.Event): The event that stops polling.
+
+        Returns:
+        None
+        """
+        await bot.delete_webhook()
+        offset = None
+        delivered: set[int] = set()
+        while not stop_event.is_set():
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=10, allowed_updates=Update.ALL_TYPES
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Could not get updates: %s", error)
+                await asyncio.sleep(1)
+                continue
+            if not updates:
+                continue
+            by_worker: dict[str, list[dict]] = {}
+            for update in updates:
+                if update.update_id not in delivered:
+                    raw = update.to_dict()
+                    by_worker.setdefault(self.ring.get(chat_id(raw)), []).append(raw)
+            for forwarded in await asyncio.gather(*(self._forward_in_order(batch)
+                                                    for batch in by_worker.values())):
+                delivered.update(forwarded)
+            pending = [update.update_id for update in updates
+                       if update.update_id not in delivered]
+            offset = min(pending) if pending else updates[-1].update_id + 1
+            delivered = {update_id for update_id in delivered if update_id >= offset}
+            if pending:
+                await asyncio.sleep(1)
+
+    async def run(self, bot, url=None, secret_token=WEBHOOK_SECRET, path=WEBHOOK_PATH,
+                  host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, stop_event=None) -> None:
+        """
+        Start the workers and forward the updates to them until SIGINT or SIGTERM (or
+        stop_event) is received.
+
+        The updates are received on the webhook if url is set, by long polling otherwise.
+
+        Parameters:
+        bot (telegram.Bot): The bot, used to register the webhook or to poll.
+        url (str | None): The public URL of the webhook.
+        secret_token (str | None): The secret token Telegram must send to the webhook.
+        path (str): The path the webhook listens on.
+        host (str): The address the webhook listens on.
+        port (int): The port the webhook listens on.
+        stop_event (asyncio.Event | None): An event that stops the supervisor when set.
+
+        Returns:
+        None
+
+        Raises:
+        ValueError: If url is set without a secret token.
+        """
+        check_secret(url, secret_token)
+        stop_event = stop_event or asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        self.public_secret = secret_token
+        server = None
+        poller = None
+        try:
+            await asyncio.gather(*(self.add_worker() for _ in range(self.workers)))
+            async with bot:
+                if url:
+                    server = HttpServer({path: self.handle}, host, port, ssl=ssl_context(),
+                                        methods=("POST",))
+                    await server.start()
+                    await bot.set_webhook(url=url, secret_token=secret_token,
+                                          allowed_updates=Update.ALL_TYPES)
+                    logger.info("Webhook set to %s", url)
+                else:
+                    poller = asyncio.create_task(self.poll(bot, stop_event))
+                logger.info("Supervisor running %d workers", len(self._processes))
+                await stop_event.wait()
+                if poller is not None:
+                    poller.cancel()
+                    await asyncio.gather(poller, return_exceptions=True)
+        finally:
+            if server is not None:
+                await server.stop()
+            # The workers write their conversations when they stop: no hand-over is needed.
+            self.ring = HashRing(replicas=self.ring.replicas)
+            self._urls.clear()
+            await asyncio.gather(*(self._stop(name, process, 10.0)
+                                   for name, process in self._processes.items()))
+            self._processes.clear()
+            if self._client is not None:
+                await self._client.aclose()
+                self._client = None
+        logger.info("Supervisor stopped: %s", self.stats())
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the supervisor.
+
+        Returns:
+        dict: The running workers, the updates forwarded to each and the failures.
+        """
+        return {
+            "workers": sorted(self.ring.nodes),
+            "forwarded": dict(self.forwarded),
+            "failed": self.failed,
+        }
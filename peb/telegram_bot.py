@@ -6,8 +6,35 @@ and responding accordingly.
 
 It uses the Python Telegram Bot API to handle various types of updates and callback queries,
 presenting users with a  range of options through inline keyboard buttons.
-Each state in the conversation corresponds to a specific function,
-which processes the user's input and determines the next state.
+Every handler is a coroutine and the application processes updates concurrently, so all the
+conversations share a single asyncio event loop and a slow OpenAI call only suspends the
+conversation that made it.
+By default each step is rendered as a single message holding the step text, the examples and
+the inline keyboard, so a user input costs one Telegram API call instead of three or four.
+The enhanced prompt is streamed: a placeholder message is edited as the text arrives, at most
+once every TELEGRAM_STREAM_EDIT_INTERVAL seconds to stay within Telegram's edit limits.
+The steps of the conversation are declared once in the canvas table of peb.data, compiled at
+import time with their texts, examples and keyboards; a generic handler per step stores the
+answer and sends the precompiled reply of the next step.
+Logging goes through the queue-based JSON writer of peb.log: the users' text is redacted,
+payloads such as the user data are only logged at DEBUG and the per-step lines are sampled.
+Every handler is timed into peb.metrics, and with TELEGRAM_METRICS_PORT the metrics, including
+the number of conversations in each state, are served in the Prometheus format on /metrics.
+With OPENAI_INCREMENTAL_MODERATION each answer is moderated in the background as soon as it is
+stored, while the user reads the next step; the verdicts are kept per field in the user data,
+so "Perfect my prompt" only waits for the answers that changed or were never checked. It is
+off by default: content split across several answers can pass every per-field check.
+Pressing "Perfect my prompt" again while the same draft is being enhanced for the user only
+sends an acknowledgement: the request already in flight answers both.
+The answers of each user are kept in a compact Session of peb.session, touched by every update
+of the user; a background sweep evicts the sessions idle for TELEGRAM_SESSION_IDLE_TIMEOUT, or
+the least recently seen beyond TELEGRAM_MAX_SESSIONS, along with their conversation state.
+With OPENAI_SPECULATIVE_ENHANCEMENT the enhancement of the draft is requested as soon as the
+draft is shown, while the user reviews it, and handed over when "Perfect my prompt" is pressed;
+it is cancelled if the user starts again or the draft changes.
+In supervisor mode every worker serves /handover next to the updates: when a worker joins or
+leaves, the supervisor has each worker write its conversations, then reload from the shared
+persistence the chats it owns in the new ring, so a moved chat resumes where it stopped.
 
 The bot integrates with OpenAI's GPT-3.5 model to generate and moderate content based on user input,
 enhancing and  validating prompts to ensure they meet specific criteria.
@@ -30,42 +57,99 @@ Dependencies:
 - python-dotenv
 """
 
+import asyncio
+import functools
+import json
 import logging
 import os
+import warnings
+from collections import Counter
+from http import HTTPStatus
 from typing import Tuple
 
+import openai
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, InlineKeyboardMarkup, Update
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter
+from telegram.warnings import PTBUserWarning
 from telegram.ext import (
+    Application,
     CallbackQueryHandler,
     CommandHandler,
+    ContextTypes,
     ConversationHandler,
-    Filters,
     MessageHandler,
-    Updater,
+    TypeHandler,
+    filters,
 )
 
 from peb.data import (
+    MESSAGE,
     BotState,
     final_message,
-    state_code,
-    state_examples,
-    state_message,
+    steps,
+    steps_by_state,
     suggestions,
 )
-from peb.open_ai import OpenAI
+from peb import metrics
+from peb.cache import make_key
+from peb.client_manager import client_manager
+from peb.http_server import Response
+from peb.log import SAMPLED, redact, setup_logging
+from peb.open_ai import CompletionStream, OpenAI, error_message, moderation_batcher
+from peb.persistence import PERSISTENCE_PATH, SQLitePersistence
+from peb.session import MODERATION_KEY, SESSION_SWEEP_INTERVAL, Session, expired_sessions
+from peb.supervisor import HANDOVER_PATH, WORKER_PATH, WORKERS, HashRing, Supervisor
+from peb.tokens import count_tokens, fit_fields
+from peb.webhook import WEBHOOK_URL, authorized, run_webhook
 
 load_dotenv()
 
-MESSAGE = "Choose an option or enter your answer:"
+BANNED_MESSAGE = "Your prompt contains banned content and it cannot be processed."
+CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "4096"))
+BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+SPECULATIVE_MODERATION = os.getenv("OPENAI_SPECULATIVE_MODERATION", "1") == "1"
+INCREMENTAL_MODERATION = os.getenv("OPENAI_INCREMENTAL_MODERATION", "0") == "1"
+SPECULATIVE_ENHANCEMENT = os.getenv("OPENAI_SPECULATIVE_ENHANCEMENT", "0") == "1"
+SINGLE_MESSAGE = os.getenv("TELEGRAM_SINGLE_MESSAGE", "1") == "1"
+EDIT_IN_PLACE = os.getenv("TELEGRAM_EDIT_IN_PLACE", "0") == "1"
+STREAM = os.getenv("OPENAI_STREAM", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1"))
+METRICS_PORT = int(os.getenv("TELEGRAM_METRICS_PORT", "9464") or "0")
+METRICS_LISTEN = os.getenv("TELEGRAM_METRICS_LISTEN", "127.0.0.1")
+PLACEHOLDER = "✍️ ..."
+STILL_WORKING = "⏳ Still working on your prompt, it will appear here in a moment."
+WELCOME = (steps["start"].text, *steps["goal"].parts)
+WELCOME_REPLY = "\n\n".join([steps["start"].text, steps["goal"].reply])
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+# The moderations running in the background, by (user, field): (digest of the answer, task).
+field_moderations: dict[tuple, tuple[str, asyncio.Task]] = {}
+# The enhancements requested while the users review their draft, by user:
+# (digest of the draft, task, draft).
+speculations: dict[object, tuple[str, asyncio.Task, str]] = {}
+# The drafts being enhanced, by (user, digest of the draft): a second request only waits.
+enhancements_in_flight: set[tuple] = set()
+# The task evicting the idle sessions, while the application runs.
+session_sweeper: dict[str, asyncio.Task] = {}
+
+
+def build_keyboard(state) -> InlineKeyboardMarkup:
+    """
+    Return the inline keyboard for the given state, built once when the canvas is compiled.
+
+    Parameters:
+    state (str): The current state of the bot to determine which buttons to show.
+
+    Returns:
+    InlineKeyboardMarkup: The keyboard with the buttons of the state.
+    """
+    return steps[state].keyboard
+
 
-def show_buttons(update, state) -> None:
+async def show_buttons(update, state) -> None:
     """
     Show buttons for the given state in the Telegram bot.
 
@@ -77,45 +161,31 @@ def show_buttons(update, state) -> None:
     Returns:
     None
     """
-    logger.info("@Show buttons")
-    logger.info("State: %s", state)
-    if state not in ["start"]:
-        keyboard = [[InlineKeyboardButton("🏠️ Start again", callback_data="start")]]
-    if state not in ["start", "goal", "task", "persona", "openai", "whom"]:
-        keyboard.append(
-            [InlineKeyboardButton("⏩️ Skip this step ", callback_data=f"{state}")]
-        )
-    if state == "openai":
-        keyboard.append(
-            [InlineKeyboardButton("🧙‍♂️️ Perfect my prompt", callback_data="openai")]
-        )
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    logger.info("@Show buttons %s", state, extra=SAMPLED)
+    reply_markup = build_keyboard(state)
     if update.message:
-        logger.info("Entering update message")
-        update.message.reply_text(MESSAGE, reply_markup=reply_markup)
+        await update.message.reply_text(MESSAGE, reply_markup=reply_markup)
     elif update.callback_query:
-        logger.info("Entering callback query")
-        logger.info("Callback query: %s", update.callback_query)
-        update.callback_query.message.reply_text(MESSAGE, reply_markup=reply_markup)
+        logger.debug("Callback query: %s", update.callback_query)
+        await update.callback_query.message.reply_text(MESSAGE, reply_markup=reply_markup)
     else:
         logger.info("No update message or callback query")
 
 
 def examples(state) -> str:
     """
-    Generate a string of examples for a given state.
+    Return the string of examples for a given state, rendered when the canvas is compiled.
 
     Parameters:
-    state (str): The state for which examples are needed.
+    state (BotState): The state for which examples are needed.
 
     Returns:
     str: Formatted string containing examples.
     """
-    return_str = "\n- ".join(state_examples[state])
-    return f"Examples: \n- {return_str}"
+    return steps_by_state[state].examples
 
 
-def update_message_callback(update, message) -> None:
+async def update_message_callback(update, message) -> None:
     """
     Send a message to the user based on the update type.
 
@@ -128,12 +198,47 @@ def update_message_callback(update, message) -> None:
     None
     """
     if update.message:
-        update.message.reply_text(message)
+        await update.message.reply_text(message)
+    elif update.callback_query:
+        await update.callback_query.message.reply_text(message)
+
+
+async def send_step(update, parts, state, text=None) -> None:
+    """
+    Send the messages of a step followed by the keyboard of the state.
+
+    With SINGLE_MESSAGE the parts, the prompt to choose an option and the keyboard are sent as
+    one message. With EDIT_IN_PLACE, a step reached by pressing a button replaces the message
+    holding that button instead of sending a new one. Otherwise every part is sent as its own
+    message and the keyboard follows in a separate one.
+
+    Parameters:
+    update (telegram.Update): The incoming update.
+    parts (Sequence[str]): The texts of the step.
+    state (str): The state whose buttons are shown.
+    text (str | None): The single message, if it was already joined from the parts.
+
+    Returns:
+    None
+    """
+    if not SINGLE_MESSAGE:
+        for part in parts:
+            await update_message_callback(update, part)
+        await show_buttons(update, state)
+        return
+    if text is None:
+        text = "\n\n".join([*parts, MESSAGE])
+    reply_markup = build_keyboard(state)
+    if update.message:
+        await update.message.reply_text(text, reply_markup=reply_markup)
     elif update.callback_query:
-        update.callback_query.message.reply_text(message)
+        if EDIT_IN_PLACE:
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
 
 
-def start(update, context) -> BotState:
+async def start(update, context) -> BotState:
     """
     Start command for the Telegram bot.
 
@@ -145,14 +250,11 @@ def start(update, context) -> BotState:
     BotState: The next state code.
     """
     logger.info("@Start")
-    logger.info("Context user data 1: %s", context.user_data)
+    logger.debug("User data: %s", redact(context.user_data))
     context.user_data.clear()
-    logger.info("Context user data 2: %s", context.user_data)
-    logger.info("Context: %s", context)
-    update_message_callback(update, f"{'. '.join(state_message[BotState.START])}")
-    update_message_callback(update, f"{'. '.join(state_message[BotState.GOAL])}")
-    update_message_callback(update, examples(BotState.GOAL))
-    show_buttons(update, "goal")
+    if SPECULATIVE_ENHANCEMENT:
+        cancel_speculation(update.effective_user.id)
+    await send_step(update, WELCOME, "goal", WELCOME_REPLY)
     return BotState.GOAL
 
 
@@ -171,126 +273,193 @@ def update_user_data(update, context, key) -> None:
     if update.message:
         context.user_data[key] = update.message.text
     elif update.callback_query:
-        if update.callback_query.message.text == MESSAGE:
+        # A button is attached to the prompt to choose an option, alone or ending a step.
+        if update.callback_query.message.text.endswith(MESSAGE):
             context.user_data[key] = "None"
         else:
             context.user_data[key] = update.callback_query.message.text
+    moderate_in_background(update, context, key)
 
 
-def process_request(state, update, context, next_state, next_state_code) -> None:
+def answer_digest(text) -> str:
     """
-    Process the request for a given state and move to the next state.
+    Return the digest identifying an answer, ignoring its whitespace and case.
 
     Parameters:
-    state (str): The current state.
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
-    next_state (str): The next state to transition to.
-    next_state_code (str): The code of the next state.
+    text (str): The answer.
 
     Returns:
-    None
+    str: The digest, the key of the answer in the moderation cache.
     """
-    logger.info("@ %s", state)
-    update_user_data(update, context, state)
-    update_message_callback(update, f"{'. '.join(state_message[next_state])}")
-    update_message_callback(update, examples(next_state))
-    show_buttons(update, next_state_code)
+    return make_key(text.casefold())
 
 
-def goal(update, context) -> BotState:
+def moderate_in_background(update, context, key) -> None:
     """
-    Handle the 'goal' state of the conversation.
+    Start moderating an answer of the canvas while the user reads the next step.
+
+    Nothing is started if the answer was already moderated or is being moderated. The verdict
+    is stored in the user data, under MODERATION_KEY, when the moderation succeeds.
 
     Parameters:
     update (telegram.Update): The incoming update.
     context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    key (str): The field of the answer.
 
     Returns:
-    BotState: The next state code.
+    None
     """
-    process_request("goal", update, context, BotState.PERSONA, "persona")
-    return BotState.PERSONA
+    text = context.user_data.get(key)
+    if not INCREMENTAL_MODERATION or key not in final_message or text in (None, "None", MESSAGE):
+        return
+    digest = answer_digest(text)
+    verdicts = context.user_data.setdefault(MODERATION_KEY, {})
+    if verdicts.get(key, [None])[0] == digest:
+        return
+    user = update.effective_user.id
+    running = field_moderations.get((user, key))
+    if running is not None and running[0] == digest:
+        return
+    task = asyncio.get_running_loop().create_task(OpenAI().moderate(text, user=user))
+    field_moderations[(user, key)] = (digest, task)
+    task.add_done_callback(functools.partial(store_verdict, verdicts, user, key, digest))
 
 
-def persona(update, context) -> BotState:
+def store_verdict(verdicts, user, key, digest, task) -> None:
     """
-    Handle the 'persona' state of the conversation.
+    Keep the verdict of a background moderation once it is done.
 
     Parameters:
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    verdicts (dict): The verdicts of the user data, by field.
+    user (Hashable): The user.
+    key (str): The field of the answer.
+    digest (str): The digest of the moderated answer.
+    task (asyncio.Task): The finished moderation.
 
     Returns:
-    BotState: The next state code.
+    None
     """
-    process_request("persona", update, context, BotState.TASK, "task")
-    return BotState.TASK
+    if field_moderations.get((user, key), (None, None))[1] is task:
+        del field_moderations[(user, key)]
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logger.warning("Background moderation failed: %s", task.exception())
+        return
+    success, _, flagged = task.result()
+    if success:
+        verdicts[key] = [digest, flagged]
 
 
-def task(update, context) -> BotState:
+async def moderate_answers(openai_obj, context, user=None) -> tuple[bool, str, bool]:
     """
-    Handle the 'task' state of the conversation.
+    Moderate the answers of the canvas, reusing the verdicts of the background moderations.
+
+    The answers with a verdict are not moderated again, the running moderations are awaited and
+    only the answers that changed or were never checked are sent, all at the same time.
 
     Parameters:
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    openai_obj (OpenAI): The OpenAI wrapper.
+    context (telegram.ext.CallbackContext): The callback context containing user data.
+    user (Hashable): The user making the request.
 
     Returns:
-    BotState: The next state code.
+    success (bool): True if every answer was moderated, False otherwise.
+    err_msg (str): The error message of a failed moderation, None otherwise.
+    bool: True if an answer is flagged, False otherwise.
     """
-    process_request("task", update, context, BotState.WHOM, "whom")
-    return BotState.WHOM
+    answers, _ = collect_answers(context)
+    verdicts = context.user_data.get(MODERATION_KEY, {})
+    checks = []
+    for field, text in answers.items():
+        digest = answer_digest(text)
+        verdict = verdicts.get(field)
+        if verdict is not None and verdict[0] == digest:
+            metrics.field_moderations.inc("reused")
+            if verdict[1]:
+                return True, None, True
+            continue
+        running = field_moderations.get((user, field))
+        if running is not None and running[0] == digest:
+            metrics.field_moderations.inc("awaited")
+            checks.append(running[1])
+        else:
+            metrics.field_moderations.inc("requested")
+            checks.append(openai_obj.moderate(text, user=user))
+    results = await asyncio.gather(*checks)
+    for success, err_msg, _ in results:
+        if not success:
+            return False, err_msg, False
+    return True, None, any(flagged for _, _, flagged in results)
 
 
-def whom(update, context) -> BotState:
+async def process_request(state, update, context) -> None:
     """
-    Handle the 'whom' state of the conversation.
+    Process the request for a given state and ask the next step.
 
     Parameters:
+    state (str): The current state.
     update (telegram.Update): The incoming update.
     context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
 
     Returns:
-    BotState: The next state code.
+    None
     """
-    process_request("whom", update, context, BotState.HOW, "how")
-    return BotState.HOW
+    logger.info("@ %s", state, extra=SAMPLED)
+    update_user_data(update, context, state)
+    next_step = steps_by_state[steps[state].next_state]
+    await send_step(update, next_step.parts, next_step.name, next_step.reply)
 
 
-def how(update, context) -> BotState:
+def step_handler(state):
     """
-    Handle the 'how' state of the conversation.
+    Build the handler of a step that stores the answer and asks the next step.
 
     Parameters:
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    state (str): The name of the step in the canvas.
 
     Returns:
-    BotState: The next state code.
+    Callable: The handler, returning the next state of the canvas.
     """
-    process_request("how", update, context, BotState.FORMAT, "format")
-    return BotState.FORMAT
+    next_state = steps[state].next_state
+
+    async def handler(update, context) -> BotState:
+        await process_request(state, update, context)
+        return next_state
+
+    handler.__name__ = handler.__qualname__ = state
+    handler.__doc__ = f"Handle the '{state}' state of the conversation."
+    return handler
 
 
-def formatting(update, context) -> BotState:
+def collect_answers(context) -> Tuple[dict, str]:
     """
-    Handle the 'format' state of the conversation.
+    Collect the answers of the canvas and the suggestions of the skipped steps.
 
     Parameters:
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    context (telegram.ext.CallbackContext): The callback context containing user data.
 
     Returns:
-    BotState: The next state code.
+    dict[str, str]: The answers by field, in the order of the final message.
+    str: The enhancement made of the suggestions of the skipped steps.
     """
-    process_request("format", update, context, BotState.CONSTRAINTS, "constraints")
-    return BotState.CONSTRAINTS
+    enhancement = ""
+    answers = {}
+    for stage in final_message:
+        if stage in context.user_data:
+            user_data_value = context.user_data[stage]
+            if user_data_value not in ["None", MESSAGE]:
+                answers[stage] = user_data_value
+            else:
+                if stage in suggestions:
+                    enhancement += f"{suggestions[stage]}\n"
+    return answers, enhancement
 
 
 def assemble_prompt(context) -> Tuple[str, str]:
     """
     Assemble the prompt based on the user's input collected in various stages.
+    The answers are compacted and kept within the per-field and total token budgets.
 
     Parameters:
     context (telegram.ext.CallbackContext): The callback context containing user data.
@@ -299,24 +468,18 @@ def assemble_prompt(context) -> Tuple[str, str]:
     tuple: A tuple containing the summary and enhancement based on user data.
     """
     summary = ""
-    enhancement = ""
-    logger.info("User data: %s", context.user_data)
-    for stage, message in final_message.items():
-        if stage in context.user_data:
-            user_data_value = context.user_data[stage]
-            if user_data_value not in ["None", MESSAGE]:
-                summary += f"{message} {user_data_value}\n"
-            else:
-                if stage in suggestions:
-                    enhancement += f"{suggestions[stage]}\n"
-    logger.info("Summary: %s", summary)
-    logger.info("Enhancement: %s", enhancement)
+    logger.debug("User data: %s", redact(context.user_data))
+    answers, enhancement = collect_answers(context)
+    for stage, answer in fit_fields(answers).items():
+        summary += f"{final_message[stage]} {answer}\n"
+    logger.debug("Summary: %s", redact(summary))
+    logger.debug("Enhancement: %s", enhancement)
     return summary, enhancement
 
 
-def constraints(update, context) -> BotState:
+async def quality(update, context) -> BotState:
     """
-    Handle the 'constraints' state of the conversation.
+    Handle the 'quality' state of the conversation.
 
     Parameters:
     update (telegram.Update): The incoming update.
@@ -325,53 +488,313 @@ def constraints(update, context) -> BotState:
     Returns:
     BotState: The next state code.
     """
-    process_request("constraints", update, context, BotState.TOOL, "tool")
-    return BotState.TOOL
+    logger.info("@Quality")
+    update_user_data(update, context, "quality")
+    prompt, enhancement = assemble_prompt(context)
+    if not prompt:
+        if update.message:
+            await update.message.reply_text("Something went wrong. Please try again.")
+        return BotState.START
+    await send_step(update, ["This is your request in draft form:\n", prompt], "openai")
+    if SPECULATIVE_ENHANCEMENT:
+        speculate(update.effective_user.id, prompt, enhancement)
+    return BotState.OPENAI
+
+
+def speculate(user, prompt, enhancement) -> None:
+    """
+    Request the enhancement of a draft in the background while the user reviews it.
+
+    A speculation already running for the same draft is kept; one for another draft is
+    cancelled.
+
+    Parameters:
+    user (Hashable): The user.
+    prompt (str): The assembled prompt of the draft.
+    enhancement (str): The suggestions added to the enhancement instruction.
+
+    Returns:
+    None
+    """
+    digest = make_key(prompt, enhancement)
+    running = speculations.get(user)
+    if running is not None:
+        if running[0] == digest:
+            return
+        cancel_speculation(user, "miss")
+    openai_obj = OpenAI()
+    task = asyncio.get_running_loop().create_task(openai_obj.create(
+        instruction=openai_obj.prompt_enhancement_instruction,
+        prompt=prompt,
+        enhancement=enhancement,
+        user=user,
+    ))
+    speculations[user] = (digest, task, prompt)
 
 
-def tool(update, context) -> BotState:
+def wasted_tokens(task, prompt) -> int:
     """
-    Handle the 'tool' state of the conversation.
+    Return the tokens spent on a speculation that will not be used.
 
     Parameters:
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    task (asyncio.Task): The speculative request.
+    prompt (str): Its draft.
 
     Returns:
-    BotState: The next state code.
+    int: The tokens of the response if it arrived, the estimated tokens of the draft if the
+        request is still running, 0 if it failed.
     """
-    process_request("tool", update, context, BotState.QUALITY, "quality")
-    return BotState.QUALITY
+    if not task.done():
+        return count_tokens(prompt)
+    if task.cancelled() or task.exception() is not None:
+        return 0
+    success, _, response = task.result()
+    usage = getattr(response, "usage", None) if success else None
+    return usage.total_tokens if usage is not None else 0
 
 
-def quality(update, context) -> BotState:
+def speculation_failed(task) -> bool:
     """
-    Handle the 'quality' state of the conversation.
+    Return True if a speculative request ended without an enhancement.
 
     Parameters:
-    update (telegram.Update): The incoming update.
-    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    task (asyncio.Task): The speculative request.
 
     Returns:
-    BotState: The next state code.
+    bool: True if the request was cancelled, raised or returned an error.
     """
-    logger.info("@Quality")
-    update_user_data(update, context, "quality")
-    update_message_callback(update, "This is your request in draft form:\n")
-    prompt, _ = assemble_prompt(context)
-    if not prompt:
-        if update.message:
-            update.message.reply_text("Something went wrong. Please try again.")
-        return BotState.START
-    update_message_callback(update, prompt)
-    show_buttons(update, "openai")
-    return BotState.OPENAI
+    if not task.done():
+        return False
+    return task.cancelled() or task.exception() is not None or not task.result()[0]
+
+
+def cancel_speculation(user, outcome="cancelled") -> None:
+    """
+    Drop the speculation of a user, if any, count its outcome and its tokens as wasted.
+
+    Parameters:
+    user (Hashable): The user.
+    outcome (str): "miss" if the draft changed, "cancelled" if the user started again or left;
+        a speculation whose request failed is counted as "failed" either way.
+
+    Returns:
+    None
+    """
+    entry = speculations.pop(user, None)
+    if entry is None:
+        return
+    _, task, prompt = entry
+    metrics.speculations.inc("failed" if speculation_failed(task) else outcome)
+    metrics.speculation_wasted_tokens.inc(amount=wasted_tokens(task, prompt))
+    task.cancel()
+
+
+def take_speculation(user, prompt, enhancement) -> asyncio.Task | None:
+    """
+    Hand over the speculation of a user if it enhances this draft.
+
+    Parameters:
+    user (Hashable): The user.
+    prompt (str): The assembled prompt.
+    enhancement (str): The suggestions added to the enhancement instruction.
+
+    Returns:
+    asyncio.Task | None: The request, done or still running, or None if there is no
+        speculation for this draft or it failed.
+    """
+    entry = speculations.get(user)
+    if entry is None:
+        return None
+    digest, task, _ = entry
+    if digest != make_key(prompt, enhancement) or speculation_failed(task):
+        cancel_speculation(user, "miss")
+        return None
+    del speculations[user]
+    metrics.speculations.inc("hit")
+    return task
+
+
+async def enhance_sequentially(openai_obj, prompt, enhancement, user=None, stream=False,
+                               moderation=None, completion=None) -> tuple[bool, str, object]:
+    """
+    Moderate the prompt and, only if it passes, request the enhanced prompt.
+
+    Parameters:
+    openai_obj (OpenAI): The OpenAI wrapper used for both calls.
+    prompt (str): The assembled prompt.
+    enhancement (str): The suggestions added to the enhancement instruction.
+    user (Hashable): The user making the request, for fair admission.
+    stream (bool): Whether the enhanced prompt is requested as a stream.
+    moderation (Awaitable | None): The verdict to wait for instead of moderating the prompt,
+        like moderate_answers().
+    completion (asyncio.Task | None): An enhancement already requested, like a speculation.
+
+    Returns:
+    success (bool): True if the prompt was moderated and enhanced, False otherwise.
+    err_msg (str): The message for the user if the request failed, None otherwise.
+    ChatCompletion | CompletionStream: The response from the OpenAI API.
+    """
+    success, err_msg, banned_content = await (
+        moderation or openai_obj.moderate(prompt, user=user)
+    )
+    if not success or banned_content:
+        if completion is not None:
+            await discard(completion)
+        if not success:
+            return False, err_msg, None
+        logger.info("Banned content")
+        return False, BANNED_MESSAGE, None
+    if completion is not None:
+        return await completion
+    request = openai_obj.stream if stream else openai_obj.create
+    return await request(
+        instruction=openai_obj.prompt_enhancement_instruction,
+        prompt=prompt,
+        enhancement=enhancement,
+        user=user,
+    )
+
+
+async def discard(completion) -> None:
+    """
+    Cancel a completion request whose result will not be shown, closing its stream if it was
+    already opened.
+
+    Parameters:
+    completion (asyncio.Task): The task of the request.
+
+    Returns:
+    None
+    """
+    if completion.cancel() or completion.cancelled() or completion.exception() is not None:
+        return
+    _, _, response = completion.result()
+    if isinstance(response, CompletionStream):
+        await response.close()
+
+
+async def enhance_speculatively(openai_obj, prompt, enhancement, user=None, stream=False,
+                                moderation=None, completion=None) -> tuple[bool, str, object]:
+    """
+    Moderate the prompt and request the enhanced prompt at the same time.
+
+    The completion is held back until the moderation passes. If the prompt is flagged or the
+    moderation fails, the completion is cancelled and its result is never shown.
+
+    Parameters:
+    openai_obj (OpenAI): The OpenAI wrapper used for both calls.
+    prompt (str): The assembled prompt.
+    enhancement (str): The suggestions added to the enhancement instruction.
+    user (Hashable): The user making the request, for fair admission.
+    stream (bool): Whether the enhanced prompt is requested as a stream.
+    moderation (Awaitable | None): The verdict to wait for instead of moderating the prompt,
+        like moderate_answers().
+    completion (asyncio.Task | None): An enhancement already requested, like a speculation.
+
+    Returns:
+    success (bool): True if the prompt was moderated and enhanced, False otherwise.
+    err_msg (str): The message for the user if the request failed, None otherwise.
+    ChatCompletion | CompletionStream: The response from the OpenAI API.
+    """
+    if completion is None:
+        request = openai_obj.stream if stream else openai_obj.create
+        completion = asyncio.create_task(
+            request(
+                instruction=openai_obj.prompt_enhancement_instruction,
+                prompt=prompt,
+                enhancement=enhancement,
+                user=user,
+            )
+        )
+    try:
+        success, err_msg, banned_content = await (
+            moderation or openai_obj.moderate(prompt, user=user)
+        )
+    except BaseException:
+        completion.cancel()
+        raise
+    if not success or banned_content:
+        await discard(completion)
+        if banned_content:
+            logger.info("Banned content")
+            err_msg = BANNED_MESSAGE
+        return False, err_msg, None
+    return await completion
+
+
+async def edit_text(message, text) -> bool:
+    """
+    Replace the text of a message, ignoring the edits Telegram refuses.
+
+    Parameters:
+    message (telegram.Message): The message to edit.
+    text (str): The new text.
+
+    Returns:
+    bool: True if the message was edited.
+    """
+    try:
+        await message.edit_text(text)
+    except RetryAfter as error:
+        logger.warning("Edit rate limited for %s seconds", error.retry_after)
+        return False
+    except BadRequest as error:
+        logger.warning("Could not edit the message: %s", error)
+        return False
+    return True
+
+
+async def stream_reply(update, deltas) -> str:
+    """
+    Send a placeholder message and edit it with the text of the deltas as it arrives.
 
+    Edits are coalesced: at most one is in flight, and they are at least STREAM_EDIT_INTERVAL
+    seconds apart, the first one excepted. Reading the stream never waits for an edit. A text
+    longer than a Telegram message continues in new messages once the stream ends.
 
-def open_ai(update, context) -> None:
+    Parameters:
+    update (telegram.Update): The incoming update.
+    deltas (AsyncIterable[str]): The text deltas of the response.
+
+    Returns:
+    str: The whole text.
+    """
+    chat_message = update.message or update.callback_query.message
+    message = await chat_message.reply_text(PLACEHOLDER)
+    limit = MessageLimit.MAX_TEXT_LENGTH
+    loop = asyncio.get_running_loop()
+    text = shown = ""
+    edit = None
+    next_edit = loop.time()
+    async for delta in deltas:
+        text += delta
+        if (edit is None or edit.done()) and loop.time() >= next_edit and text[:limit] != shown:
+            shown = text[:limit]
+            next_edit = loop.time() + STREAM_EDIT_INTERVAL
+            edit = asyncio.create_task(edit_text(message, shown))
+    if edit is not None and not await edit:
+        shown = None
+    if text[:limit] != shown:
+        await asyncio.sleep(max(0.0, next_edit - loop.time()))
+        await edit_text(message, text[:limit])
+    for start in range(limit, len(text), limit):
+        await chat_message.reply_text(text[start:start + limit])
+    return text
+
+
+async def open_ai(update, context) -> None:
     """
     Handle the 'openai' state and process the request through OpenAI API.
 
+    With INCREMENTAL_MODERATION the answers are checked field by field, reusing the background
+    moderations; otherwise the assembled prompt is moderated. With SPECULATIVE_MODERATION the
+    moderation and the enhancement run concurrently; otherwise the enhancement is only
+    requested after the moderation passes. With SPECULATIVE_ENHANCEMENT the enhancement
+    requested while the user reviewed the draft is used if the draft did not change. With STREAM the
+    enhanced prompt is shown progressively as it is generated.
+    A request for a draft that is already being enhanced for the user, when "Perfect my prompt"
+    is pressed again, only gets the STILL_WORKING acknowledgement.
+
     Parameters:
     update (telegram.Update): The incoming update.
     context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
@@ -380,56 +803,88 @@ def open_ai(update, context) -> None:
     int: The next state code or ends the conversation.
     """
     logger.info("@OpenAI")
-    logger.info(context.user_data)
     context.user_data["openai"] = "OpenAI"
-    openai_obj = OpenAI()
 
     prompt, enhancement = assemble_prompt(context)
-    logger.info("Prompt: %s", prompt)
-    success, err_msg, banned_content = openai_obj.moderate(prompt)
-    if not success:
-        logger.info("Error: %s", err_msg)
-        update_message_callback(update, err_msg)
+    logger.debug("Prompt: %s", redact(prompt))
+    user = update.effective_user.id
+    key = (user, make_key(prompt, enhancement))
+    if key in enhancements_in_flight:
+        logger.info("Enhancement already in flight")
+        metrics.collapsed_requests.inc("openai")
+        await update_message_callback(update, STILL_WORKING)
         return
-    if banned_content:
-        logger.info("Banned content")
-        update_message_callback(
-            update,
-            "Your prompt contains banned content and it cannot be processed.",
-        )
-        return
-    success, err_msg, response = openai_obj.create(
-        instruction=openai_obj.prompt_enhancement_instruction,
-        prompt=prompt,
-        enhancement=enhancement,
+    enhancements_in_flight.add(key)
+    try:
+        await send_enhancement(update, context, prompt, enhancement)
+    finally:
+        enhancements_in_flight.discard(key)
+
+
+async def send_enhancement(update, context, prompt, enhancement) -> None:
+    """
+    Moderate and enhance the draft of a user, and send the enhanced prompt.
+
+    Parameters:
+    update (telegram.Update): The incoming update.
+    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+    prompt (str): The assembled prompt.
+    enhancement (str): The suggestions added to the enhancement instruction.
+
+    Returns:
+    None
+    """
+    openai_obj = OpenAI()
+    user = update.effective_user.id
+    moderation = None
+    if INCREMENTAL_MODERATION:
+        moderation = moderate_answers(openai_obj, context, user)
+    completion = None
+    if SPECULATIVE_ENHANCEMENT:
+        completion = take_speculation(user, prompt, enhancement)
+    if SPECULATIVE_MODERATION:
+        enhance = enhance_speculatively
+    else:
+        enhance = enhance_sequentially
+    success, err_msg, response = await enhance(
+        openai_obj, prompt, enhancement, user=user, stream=STREAM, moderation=moderation,
+        completion=completion,
     )
     if not success:
         logger.info("Error: %s", err_msg)
-        update_message_callback(update, err_msg)
+        await update_message_callback(update, err_msg)
         return
-    logger.info("Response: %s", response)
-    response_text = response.choices[0].message.content
-    logger.info("Response text: %s", response_text)
     explaining_text = (
         "This is your prompt enhanced. You can copy it and paste it in ChatGPT."
     )
-    update_message_callback(update, explaining_text)
-    update_message_callback(update, response_text)
+    # A speculative enhancement was requested whole, even when the others are streamed.
+    if STREAM and completion is None:
+        try:
+            await update_message_callback(update, explaining_text)
+            response_text = await stream_reply(update, response)
+        except openai.APIError as error:
+            logger.info("Error: %s", error)
+            await update_message_callback(update, error_message(error))
+            return
+        finally:
+            # A failed send to Telegram must not leave the upstream stream holding a connection.
+            await response.close()
+    else:
+        await update_message_callback(update, explaining_text)
+        logger.debug("Response: %s", response)
+        response_text = response.choices[0].message.content
+        await update_message_callback(update, response_text)
+    logger.debug("Response text: %s", redact(response_text))
 
 
 process_dict = {
-    "start": start,
-    "goal": goal,
-    "persona": persona,
-    "task": task,
-    "whom": whom,
-    "how": how,
-    "format": formatting,
-    "constraints": constraints,
-    "tool": tool,
-    "quality": quality,
-    "openai": open_ai,
+    name: metrics.timed(metrics.handler_seconds, metrics.handler_errors, name)(
+        {"start": start, "quality": quality, "openai": open_ai}.get(name) or step_handler(name)
+    )
+    for name in steps
 }
+# The steps whose keyboard has a button handled by the step itself.
+BUTTON_STATES = frozenset(name for name, step in steps.items() if step.skippable) | {"openai"}
 
 
 def get_curr_state(update) -> str:
@@ -451,7 +906,8 @@ def get_curr_state(update) -> str:
     return current_state
 
 
-def button(update, context) -> BotState:
+@metrics.timed(metrics.handler_seconds, metrics.handler_errors, "button")
+async def button(update, context) -> BotState:
     """
     Handle button press in the Telegram bot.
 
@@ -460,79 +916,362 @@ def button(update, context) -> BotState:
     context (CallbackContext): The callback context provided by the Telegram bot.
 
     Returns:
-    BotState: The code of the next state in the conversation.
+    BotState: The code of the next state in the conversation, None to stay in the current one.
     """
-    logger.info("@Button")
     query = update.callback_query
-    query.answer()
+    await query.answer()
     callback_data = query.data.split("_")
     current_state = callback_data[0]
-    logger.info("Call back data: %s", str(callback_data))
-    logger.info("Current state: %s", current_state)
-    processes_with_buttons = [
-        "how",
-        "format",
-        "constraints",
-        "tool",
-        "quality",
-        "openai",
-    ]
-    if current_state in processes_with_buttons:
-        logger.info("Entering %s", current_state)
-        process_dict[current_state](update, context)
-        return state_code[current_state]
+    logger.info("@Button %s", current_state, extra=SAMPLED)
+    if current_state in BUTTON_STATES:
+        return await process_dict[current_state](update, context)
     if current_state == "start":
         logger.info("Entering start again")
-        callback_data[0] = "goal"
-        start(update, context)
-        return BotState.START
-    return state_code[current_state + 1]
+        return await start(update, context)
+    return None
+
+
+async def on_startup(application, metrics_port=METRICS_PORT) -> None:
+    """
+    Open the connections to the OpenAI API before the first update is processed, start
+    serving the metrics and start sweeping the idle sessions.
+
+    Parameters:
+    application (Application): The Telegram application being started.
+    metrics_port (int): The port of the /metrics server, 0 not to start it.
+
+    Returns:
+    None
+    """
+    if metrics_port:
+        await metrics.start_server(METRICS_LISTEN, metrics_port)
+    if SESSION_SWEEP_INTERVAL:
+        session_sweeper["task"] = asyncio.get_running_loop().create_task(
+            sweep_periodically(application, SESSION_SWEEP_INTERVAL)
+        )
+    await client_manager.prewarm()
+
+
+async def on_shutdown(application) -> None:  # pylint: disable=unused-argument
+    """
+    Stop sweeping the sessions, log the counters of the moderation batches, close the
+    connections to the OpenAI API and stop serving the metrics.
+
+    Parameters:
+    application (Application): The Telegram application being stopped.
+
+    Returns:
+    None
+    """
+    sweeper = session_sweeper.pop("task", None)
+    if sweeper is not None:
+        sweeper.cancel()
+    logger.info("Moderation batches: %s", moderation_batcher.stats())
+    await client_manager.close()
+    await metrics.stop_server()
+
+
+def count_conversations(conv_handler) -> dict[tuple, int]:
+    """
+    Count the conversations in each state, for the peb_conversations gauge.
+
+    Parameters:
+    conv_handler (ConversationHandler): The handler of the canvas.
+
+    Returns:
+    dict[tuple, int]: The number of conversations keyed by the name of their state.
+    """
+    counts = Counter(
+        # The handlers return BotState members; states restored by a persistence may be plain
+        # values. ConversationHandler does not expose its conversations.
+        (BotState(state) if isinstance(state, int) else state).name
+        for state in conv_handler._conversations.values()  # pylint: disable=protected-access
+        if isinstance(state, (int, BotState))
+    )
+    return {(state.name,): counts.get(state.name, 0) for state in BotState}
+
+
+async def touch_session(update, context) -> None:  # pylint: disable=unused-argument
+    """
+    Record that the user of an update was seen, before the conversation handles the update.
+
+    Parameters:
+    update (telegram.Update): The incoming update.
+    context (telegram.ext.CallbackContext): The callback context provided by the Telegram bot.
+
+    Returns:
+    None
+    """
+    if isinstance(context.user_data, Session):
+        context.user_data.touch()
+
+
+def drop_sessions(application, evicted) -> None:
+    """
+    Drop the sessions of users with their conversation states and their background tasks.
+
+    Parameters:
+    application (Application): The Telegram application.
+    evicted (list[tuple[int, str]]): The user ids with the reason of their eviction.
+
+    Returns:
+    None
+    """
+    users = {user_id for user_id, _ in evicted}
+    for user_id, reason in evicted:
+        application.drop_user_data(user_id)
+        cancel_speculation(user_id)
+        metrics.sessions_evicted.inc(reason)
+    for key in [key for key in field_moderations if key[0] in users]:
+        field_moderations.pop(key)[1].cancel()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                # ConversationHandler does not expose its conversations; deleting one also
+                # deletes it from the persistence.
+                conversations = handler._conversations  # pylint: disable=protected-access
+                for key in [key for key in conversations if key[-1] in users]:
+                    del conversations[key]
+
+
+def sweep_sessions(application, now=None) -> int:
+    """
+    Evict the idle sessions and the least recently seen beyond the cap.
+
+    Parameters:
+    application (Application): The Telegram application.
+    now (float | None): The monotonic time, None for the current time.
+
+    Returns:
+    int: The number of sessions evicted.
+    """
+    evicted = expired_sessions(application.user_data, now=now)
+    if evicted:
+        drop_sessions(application, evicted)
+        logger.info("Evicted %d sessions, %d left", len(evicted), len(application.user_data))
+    return len(evicted)
+
+
+async def sweep_periodically(application, interval) -> None:
+    """
+    Sweep the sessions every interval seconds, until cancelled.
+
+    Parameters:
+    application (Application): The Telegram application.
+    interval (float): Seconds between two sweeps.
+
+    Returns:
+    None
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sweep_sessions(application)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not sweep the sessions")
+
+
+async def flush_chats(application, timeout=10.0) -> None:
+    """
+    Process the updates received so far, then write the conversations to the persistence.
+
+    Parameters:
+    application (Application): The Telegram application.
+    timeout (float): Seconds allowed for the pending updates to be processed.
+
+    Returns:
+    None
+    """
+    try:
+        await asyncio.wait_for(application.update_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Updates still pending after %s seconds, flushing anyway", timeout)
+    if application.persistence is not None:
+        await application.update_persistence()
+        await application.persistence.flush()
+
+
+async def load_chats(application, owns) -> int:
+    """
+    Reload from the persistence the chats the worker owns, and forget the others.
+
+    Only the memory is changed: the chats forgotten stay in the persistence for their new
+    worker, and the chats reloaded are not written back. The bot talks in private chats, where
+    the chat of a user is the user.
+
+    Parameters:
+    application (Application): The Telegram application.
+    owns (Callable[[int], bool]): Whether the worker owns the chat of a user.
+
+    Returns:
+    int: The number of users whose data the worker keeps.
+    """
+    persistence = application.persistence
+    if persistence is None:
+        return len(application.user_data)
+    stored = await persistence.get_user_data()
+    # Application.drop_user_data would also delete the data from the persistence.
+    user_data = application._user_data  # pylint: disable=protected-access
+    released = {user_id for user_id in user_data if not owns(user_id)}
+    user_data.clear()
+    user_data.update((user_id, data) for user_id, data in stored.items() if owns(user_id))
+    for user_id in released:
+        cancel_speculation(user_id)
+    for key in [key for key in field_moderations if key[0] in released]:
+        field_moderations.pop(key)[1].cancel()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler) and handler.persistent:
+                states = await persistence.get_conversations(handler.name)
+                conversations = handler._conversations  # pylint: disable=protected-access
+                # The states come from the persistence: they are not tracked as changes.
+                conversations.data.clear()
+                conversations.update_no_track(
+                    {key: state for key, state in states.items() if owns(key[-1])}
+                )
+    return len(user_data)
+
+
+async def handover(application, secret_token, request) -> Response:
+    """
+    Run a step of the hand-over of the chats, posted by the supervisor when the ring changes.
+
+    The "flush" step writes the conversations of the worker to the persistence; the "load" step
+    keeps the chats the worker owns in the new ring, reloaded from the persistence.
+
+    Parameters:
+    application (Application): The Telegram application.
+    secret_token (str): The secret token the supervisor sends.
+    request (Request): The request of the supervisor, with the step, the name of the worker
+        and, for "load", the nodes and replicas of the ring.
+
+    Returns:
+    Response: 200 once the step is done, 403 for a wrong secret token and 400 for an unknown
+        step.
+    """
+    if request.method != "POST" or not authorized(request, secret_token):
+        return Response(HTTPStatus.FORBIDDEN)
+    command = json.loads(request.body)
+    if command.get("step") == "flush":
+        await flush_chats(application)
+    elif command.get("step") == "load":
+        ring = HashRing(command["nodes"], command["replicas"])
+        kept = await load_chats(application, lambda user_id: ring.get(user_id) == command["name"])
+        logger.info("%s keeps the data of %d users", command["name"], kept)
+    else:
+        return Response(HTTPStatus.BAD_REQUEST)
+    return Response(HTTPStatus.OK)
+
+
+def build_application(telegram_token, base_url=BASE_URL, persistence=None,
+                      metrics_port=METRICS_PORT) -> Application:
+    """
+    Build the Telegram application with the conversation handler and the button handler.
+
+    Updates are processed concurrently (up to TELEGRAM_CONCURRENT_UPDATES at a time), so every
+    conversation runs as a coroutine on the same event loop. The user data of each user is a
+    Session, touched by every update before the conversation handles it. With a persistence,
+    the user data and the conversation states are restored when the application starts.
+
+    Parameters:
+    telegram_token (str): The token of the Telegram bot.
+    base_url (str): The base URL of the Bot API, for a local Bot API server.
+    persistence (BasePersistence | None): Where the conversations are stored, or None to keep
+        them in memory only.
+    metrics_port (int): The port of the /metrics server started with the application, 0 for
+        none.
+
+    Returns:
+    Application: The configured Telegram application.
+    """
+    text_filter = filters.TEXT & ~filters.COMMAND
+    builder = (
+        Application.builder()
+        .token(telegram_token)
+        .base_url(base_url)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .context_types(ContextTypes(user_data=Session))
+        .post_init(functools.partial(on_startup, metrics_port=metrics_port))
+        .post_shutdown(on_shutdown)
+    )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
+
+    with warnings.catch_warnings():
+        # The buttons are tracked per chat, like the messages, on purpose.
+        warnings.filterwarnings("ignore", "If 'per_message=False'", PTBUserWarning)
+        conv_handler = ConversationHandler(
+            entry_points=[
+                CommandHandler("start", start),
+                CommandHandler("cancel", start),
+                CallbackQueryHandler(button),
+            ],
+            states={
+                step.state: [MessageHandler(text_filter, process_dict[name])]
+                for name, step in steps.items()
+            },
+            # The buttons move the conversation to the state returned by their step.
+            fallbacks=[CommandHandler("cancel", start), CallbackQueryHandler(button)],
+            name="canvas",
+            persistent=persistence is not None,
+        )
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
+    application.add_handler(conv_handler)
+    metrics.conversations.set_function(functools.partial(count_conversations, conv_handler))
+    metrics.sessions.set_function(lambda: {(): len(application.user_data)})
+    return application
+
+
+def run_worker(port, secret_token, base_url=BASE_URL) -> None:
+    """
+    Run the bot in a worker process of the supervisor, receiving the updates it forwards.
+    The worker serves its metrics on its own port, under /metrics, and the hand-over of the
+    chats under /handover.
+
+    Parameters:
+    port (int): The local port the worker listens on.
+    secret_token (str): The secret token the supervisor sends with every update.
+    base_url (str): The base URL of the Bot API.
+
+    Returns:
+    None
+    """
+    setup_logging()
+    persistence = SQLitePersistence(PERSISTENCE_PATH) if PERSISTENCE_PATH else None
+    application = build_application(os.getenv("TELEGRAM_TOKEN"), base_url, persistence,
+                                    metrics_port=0)
+    routes = {"/metrics": metrics.handle,
+              HANDOVER_PATH: functools.partial(handover, application, secret_token)}
+    asyncio.run(run_webhook(application, None, secret_token, WORKER_PATH, "127.0.0.1", port,
+                            routes=routes))
 
 
 def main():
     """
     Main function to start the Telegram bot.
 
-    Initializes the bot, sets up the conversation handler, and starts polling for updates.
+    Initializes the bot, sets up the conversation handler, and starts receiving updates:
+    through the webhook if TELEGRAM_WEBHOOK_URL is set, by polling otherwise. The
+    conversations are stored in TELEGRAM_PERSISTENCE_PATH unless it is empty. With
+    TELEGRAM_WORKERS above 1, a supervisor receives the updates and shares the chats among
+    that many worker processes.
 
     Returns:
     None
     """
+    setup_logging()
     telegram_token = os.getenv("TELEGRAM_TOKEN")
-    # Initialize the Updater
-    updater = Updater(telegram_token, use_context=True)
-    dp = updater.dispatcher
-
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start), CommandHandler("cancel", start)],
-        states={
-            BotState.START: [MessageHandler(Filters.text & ~Filters.command, start)],
-            BotState.GOAL: [MessageHandler(Filters.text & ~Filters.command, goal)],
-            BotState.PERSONA: [
-                MessageHandler(Filters.text & ~Filters.command, persona)
-            ],
-            BotState.TASK: [MessageHandler(Filters.text & ~Filters.command, task)],
-            BotState.WHOM: [MessageHandler(Filters.text & ~Filters.command, whom)],
-            BotState.HOW: [MessageHandler(Filters.text & ~Filters.command, how)],
-            BotState.FORMAT: [
-                MessageHandler(Filters.text & ~Filters.command, formatting)
-            ],
-            BotState.CONSTRAINTS: [
-                MessageHandler(Filters.text & ~Filters.command, constraints)
-            ],
-            BotState.TOOL: [MessageHandler(Filters.text & ~Filters.command, tool)],
-            BotState.QUALITY: [
-                MessageHandler(Filters.text & ~Filters.command, quality)
-            ],
-            BotState.OPENAI: [MessageHandler(Filters.text & ~Filters.command, open_ai)],
-        },
-        fallbacks=[CommandHandler("cancel", start)],
-    )
-    dp.add_handler(conv_handler)
-    dp.add_handler(CallbackQueryHandler(button))
-
-    updater.start_polling()
-    updater.idle()
+    if WORKERS > 1:
+        supervisor = Supervisor(run_worker, workers=WORKERS)
+        asyncio.run(supervisor.run(Bot(telegram_token, base_url=BASE_URL), WEBHOOK_URL))
+        return
+    persistence = SQLitePersistence(PERSISTENCE_PATH) if PERSISTENCE_PATH else None
+    application = build_application(telegram_token, persistence=persistence)
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application, WEBHOOK_URL))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
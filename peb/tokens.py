@@ -0,0 +1,245 @@
+"""
+This module estimates token counts locally and keeps the prompts sent to OpenAI within budgets.
+
+The canvas answers are free text: a user can paste a whole inbox into the task. Every token of
+the prompt is paid for, adds latency and counts against the model's context window, so the
+answers are compacted and truncated before they are assembled, and the output is capped with
+max_tokens. The counts are estimated without any network call or tokenizer download.
+
+Features:
+- count_tokens(): estimate of the number of tokens of a text, splitting it like the GPT
+    tokenizers do (words with their leading space, groups of up to three digits, punctuation)
+    and charging long and non-ASCII words several tokens.
+- compact(): collapses whitespace and removes repeated lines and sentences.
+- truncate(): shortens a text to a budget, keeping its beginning and its end and cutting at
+    sentence or word boundaries.
+- fit_fields(): applies a per-field budget, then shares the total budget among the fields,
+    shortening the longest ones first.
+- max_tokens_for(): the output budget left by a prompt in the context window.
+
+Environment Variables:
+- OPENAI_FIELD_TOKENS: Tokens allowed for one answer of the canvas (default 500).
+- OPENAI_INPUT_TOKENS: Tokens allowed for the whole assembled prompt (default 1500).
+- OPENAI_MAX_TOKENS: Maximum tokens of the enhanced prompt (default 700, a paragraph of at
+    most 500 words).
+- OPENAI_CONTEXT_TOKENS: Context window of the model (default 4096).
+
+Usage:
+    fields = fit_fields({"goal": goal, "task": pasted_inbox})
+    max_tokens = max_tokens_for(count_tokens(instruction + prompt))
+
+Note:
+- The estimate approximates the GPT tokenizers closely enough for budgets and admission; the
+    actual counts are taken from the usage of the responses and logged next to it.
+"""
+from __future__ import annotations
+
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FIELD_TOKENS = int(os.getenv("OPENAI_FIELD_TOKENS", "500"))
+INPUT_TOKENS = int(os.getenv("OPENAI_INPUT_TOKENS", "1500"))
+MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "700"))
+CONTEXT_TOKENS = int(os.getenv("OPENAI_CONTEXT_TOKENS", "4096"))
+# Tokens added by the chat format around each message, and reserved for the reply's priming.
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+# The smallest output worth requesting when the prompt fills the context window.
+MIN_OUTPUT_TOKENS = 100
+ELLIPSIS = " [...] "
+
+PIECES = re.compile(r" ?[^\W\d_]+| ?\d{1,3}| ?[^\w\s]+|_+|\s+")
+SENTENCES = re.compile(r"(?<=[.!?])\s+|\n+")
+SPACES = re.compile(r"[ \t\f\v]+")
+BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def piece_tokens(piece) -> int:
+    """
+    Estimate the tokens of one piece of a text.
+
+    Parameters:
+    piece (str): A word, a number, a run of punctuation or a run of whitespace.
+
+    Returns:
+    int: The estimated number of tokens.
+    """
+    core = piece.strip()
+    if core.isalpha() and core.isascii():
+        # Common English words are one token; longer ones are split every six letters.
+        return 1 + (len(core) - 1) // 6
+    if core.isalpha():
+        return 1 + (len(core) - 1) // 2
+    if core.isdigit() or not core:
+        return 1
+    return 1 + (len(core) - 1) // 2
+
+
+def count_tokens(text) -> int:
+    """
+    Estimate the number of tokens of a text.
+
+    Parameters:
+    text (str | None): The text to measure.
+
+    Returns:
+    int: The estimated number of tokens.
+    """
+    if not text:
+        return 0
+    return sum(piece_tokens(piece) for piece in PIECES.findall(text))
+
+
+def count_message_tokens(messages) -> int:
+    """
+    Estimate the prompt tokens of a chat completion request.
+
+    Parameters:
+    messages (list[dict]): The messages of the request.
+
+    Returns:
+    int: The estimated number of prompt tokens.
+    """
+    return sum(
+        MESSAGE_OVERHEAD + count_tokens(message["content"]) for message in messages
+    ) + REPLY_OVERHEAD
+
+
+def compact(text) -> str:
+    """
+    Collapse the whitespace of a text and remove its repeated lines and sentences.
+
+    Parameters:
+    text (str): The text to compact.
+
+    Returns:
+    str: The compacted text.
+    """
+    text = BLANK_LINES.sub("\n", SPACES.sub(" ", text)).strip()
+    seen = set()
+    lines = []
+    for line in text.split("\n"):
+        sentences = []
+        for sentence in SENTENCES.split(line.strip()):
+            key = sentence.casefold()
+            if sentence and key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+        if sentences:
+            lines.append(" ".join(sentences))
+    return "\n".join(lines)
+
+
+def cut(text, budget, from_end=False) -> str:
+    """
+    Return the longest beginning (or end) of a text that fits in the budget, ending on a
+    sentence boundary if one is close enough, on a word boundary otherwise.
+
+    Parameters:
+    text (str): The text to cut.
+    budget (int): The tokens allowed.
+    from_end (bool): Keep the end of the text instead of its beginning.
+
+    Returns:
+    str: The kept part.
+    """
+    pieces = PIECES.findall(text)
+    if from_end:
+        pieces.reverse()
+    kept = []
+    used = 0
+    for piece in pieces:
+        used += piece_tokens(piece)
+        if used > budget:
+            break
+        kept.append(piece)
+    if from_end:
+        kept.reverse()
+    part = "".join(kept).strip()
+    # Drop the partial sentence at the cut if that keeps at least two thirds of the part.
+    if from_end:
+        starts = [match.end() for match in SENTENCES.finditer(part)]
+        return part[starts[0]:] if starts and starts[0] <= len(part) / 3 else part
+    ends = [match.start() for match in SENTENCES.finditer(part)]
+    return part[:ends[-1]] if ends and ends[-1] >= len(part) * 2 / 3 else part
+
+
+def truncate(text, budget) -> str:
+    """
+    Shorten a text to a token budget, keeping its first two thirds and its last third.
+
+    Parameters:
+    text (str): The text to shorten.
+    budget (int): The tokens allowed.
+
+    Returns:
+    str: The text itself if it fits, its beginning and end joined by an ellipsis otherwise.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    budget -= count_tokens(ELLIPSIS)
+    if budget <= 0:
+        return ""
+    head = cut(text, budget * 2 // 3)
+    tail = cut(text, budget - count_tokens(head), from_end=True)
+    return head + ELLIPSIS + tail if tail else head
+
+
+def fit(text, budget) -> str:
+    """
+    Compact a text, then truncate it to the budget.
+
+    Parameters:
+    text (str): The text.
+    budget (int): The tokens allowed.
+
+    Returns:
+    str: The text within the budget.
+    """
+    return truncate(compact(text), budget)
+
+
+def fit_fields(fields, total=INPUT_TOKENS, per_field=FIELD_TOKENS) -> dict[str, str]:
+    """
+    Compact the fields and keep each one and all of them together within the budgets.
+
+    The total budget is shared like water: the fields shorter than an equal share keep all
+    their tokens, and what they leave is shared among the longer ones, which are truncated.
+
+    Parameters:
+    fields (dict[str, str]): The texts by field name.
+    total (int): The tokens allowed for all the fields.
+    per_field (int): The tokens allowed for one field.
+
+    Returns:
+    dict[str, str]: The fitted texts, in the order of fields.
+    """
+    fitted = {name: fit(text, per_field) for name, text in fields.items()}
+    sizes = {name: count_tokens(text) for name, text in fitted.items()}
+    if sum(sizes.values()) <= total:
+        return fitted
+    remaining = total
+    allowed = {}
+    for number, name in enumerate(sorted(sizes, key=sizes.get)):
+        allowed[name] = min(sizes[name], remaining // (len(sizes) - number))
+        remaining -= allowed[name]
+    return {name: truncate(text, allowed[name]) for name, text in fitted.items()}
+
+
+def max_tokens_for(prompt_tokens, max_tokens=MAX_TOKENS, context=CONTEXT_TOKENS) -> int:
+    """
+    Return the output budget of a request.
+
+    Parameters:
+    prompt_tokens (int): The estimated prompt tokens.
+    max_tokens (int): The output budget wanted.
+    context (int): The context window of the model.
+
+    Returns:
+    int: max_tokens, or what is left of the context window if that is smaller.
+    """
+    return max(MIN_OUTPUT_TOKENS, min(max_tokens, context - prompt_tokens))
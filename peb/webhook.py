@@ -0,0 +1,226 @@
+"""
+This module receives the Telegram updates through a webhook instead of long polling.
+
+With a webhook, Telegram pushes every update to the bot over HTTPS as soon as it happens: there
+is no polling interval, no long-poll connection held open per bot, and several instances can
+sit behind a load balancer. The WebhookServer class accepts the updates on the built-in
+HTTP server (peb.http_server), checks Telegram's secret token, acknowledges each update at once
+and hands it to the application's update queue, where the usual handlers process it.
+
+Environment Variables:
+- TELEGRAM_WEBHOOK_URL: Public HTTPS URL that Telegram posts the updates to. Setting it switches
+    the bot to webhook mode.
+- TELEGRAM_WEBHOOK_LISTEN: Address the server listens on (default 0.0.0.0).
+- TELEGRAM_WEBHOOK_PORT: Port the server listens on (default 8443).
+- TELEGRAM_WEBHOOK_PATH: Path of the webhook (default /telegram).
+- TELEGRAM_WEBHOOK_SECRET: Secret token Telegram must send in the
+    X-Telegram-Bot-Api-Secret-Token header. Required with TELEGRAM_WEBHOOK_URL: the webhook
+    refuses to start without it, since anyone could post forged updates to it.
+- TELEGRAM_WEBHOOK_CERT, TELEGRAM_WEBHOOK_KEY: Certificate and key files to terminate TLS in
+    the bot. Leave them unset when a reverse proxy terminates TLS.
+
+Usage:
+    application = build_application(telegram_token)
+    asyncio.run(run_webhook(application, WEBHOOK_URL))
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import ssl
+from http import HTTPStatus
+
+from dotenv import load_dotenv
+from telegram import Update
+
+from peb.http_server import HttpServer, Response
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+WEBHOOK_CERT = os.getenv("TELEGRAM_WEBHOOK_CERT")
+WEBHOOK_KEY = os.getenv("TELEGRAM_WEBHOOK_KEY")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookServer:
+    """
+    HTTP endpoint receiving the updates that Telegram posts to the webhook.
+
+    Attributes:
+    application (telegram.ext.Application): The application whose update queue is fed.
+    secret_token (str | None): The secret token Telegram must send, or None to accept any.
+    server (HttpServer): The HTTP server serving the webhook path and the extra routes.
+
+    Methods:
+    handle(request): Acknowledge an update and queue it for the handlers.
+    start(): Start listening.
+    stop(): Stop listening.
+    """
+
+    def __init__(self, application, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                 host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, ssl_context=None, routes=None):
+        self.application = application
+        self.secret_token = secret_token
+        # Extra routes, like /metrics, are read with GET; updates are only accepted by POST.
+        self.server = HttpServer({**(routes or {}), path: self.handle}, host, port,
+                                 ssl=ssl_context, methods=("GET", "POST") if routes else ("POST",))
+
+    async def handle(self, request) -> Response:
+        """
+        Acknowledge an update and put it on the application's update queue.
+
+        Parameters:
+        request (Request): The request posted by Telegram.
+
+        Returns:
+        Response: 200 once the update is queued, 403 for a wrong secret token and 400 for a
+            body that is not an update.
+        """
+        if request.method != "POST":
+            return Response(HTTPStatus.METHOD_NOT_ALLOWED)
+        if not authorized(request, self.secret_token):
+            return Response(HTTPStatus.FORBIDDEN)
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return Response(HTTPStatus.BAD_REQUEST)
+        self.application.update_queue.put_nowait(update)
+        return Response(HTTPStatus.OK)
+
+    async def start(self) -> None:
+        """
+        Start listening for updates.
+
+        Returns:
+        None
+        """
+        await self.server.start()
+
+    async def stop(self) -> None:
+        """
+        Stop listening for updates.
+
+        Returns:
+        None
+        """
+        await self.server.stop()
+
+
+def authorized(request, secret_token) -> bool:
+    """
+    Check the secret token sent with a webhook request.
+
+    Parameters:
+    request (Request): The request posted to the webhook.
+    secret_token (str | None): The expected secret token, or None to accept any request.
+
+    Returns:
+    bool: True if the request carries the secret token.
+    """
+    if secret_token and not hmac.compare_digest(
+        request.headers.get(SECRET_HEADER, ""), secret_token
+    ):
+        logger.warning("Webhook request with a wrong secret token")
+        return False
+    return True
+
+
+def check_secret(url, secret_token) -> None:
+    """
+    Refuse to register a public webhook that would accept updates from anyone.
+
+    Parameters:
+    url (str | None): The public URL of the webhook, None if it is not registered.
+    secret_token (str | None): The secret token Telegram must send.
+
+    Returns:
+    None
+
+    Raises:
+    ValueError: If url is set without a secret token.
+    """
+    if url and not secret_token:
+        raise ValueError("TELEGRAM_WEBHOOK_SECRET must be set to receive updates on a webhook")
+
+
+def ssl_context(cert=WEBHOOK_CERT, key=WEBHOOK_KEY) -> ssl.SSLContext | None:
+    """
+    Build the TLS context of the webhook server.
+
+    Parameters:
+    cert (str | None): The certificate file.
+    key (str | None): The private key file.
+
+    Returns:
+    ssl.SSLContext | None: The context, or None when TLS is terminated by a proxy.
+    """
+    if not cert:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def run_webhook(application, url, secret_token=WEBHOOK_SECRET, path=WEBHOOK_PATH,
+                      host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, stop_event=None,
+                      routes=None) -> None:
+    """
+    Run the application in webhook mode until SIGINT or SIGTERM (or stop_event) is received.
+
+    The webhook is registered with Telegram, which posts to url; the server listens on path,
+    which is the path of url unless a proxy rewrites it. Without url the webhook is not
+    registered: the updates are posted by a supervisor (see peb.supervisor).
+
+    Parameters:
+    application (telegram.ext.Application): The application to run.
+    url (str | None): The public URL of the webhook.
+    secret_token (str | None): The secret token Telegram must send.
+    path (str): The path the server listens on.
+    host (str): The address to listen on.
+    port (int): The port to listen on.
+    stop_event (asyncio.Event | None): An event that stops the bot when set.
+    routes (dict[str, Callable] | None): Extra routes served with GET next to the webhook.
+
+    Returns:
+    None
+
+    Raises:
+    ValueError: If url is set without a secret token.
+    """
+    check_secret(url, secret_token)
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    server = WebhookServer(application, path, secret_token, host, port, ssl_context(), routes)
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if url:
+            await application.bot.set_webhook(
+                url=url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES
+            )
+            logger.info("Webhook set to %s", url)
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
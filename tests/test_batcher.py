@@ -0,0 +1,76 @@
+"""
+Unit Testing Module for the micro-batcher
+
+This module contains unit tests for peb.batcher.MicroBatcher: concurrent items share one call
+with the users who submitted them, a full batch is sent without waiting for the window,
+identical items are sent once and the error of a call reaches every caller of its batch.
+
+Usage:
+Run these tests using a pytest runner to validate the batcher.
+
+Dependencies:
+- pytest
+"""
+
+import asyncio
+
+from peb.batcher import MicroBatcher
+
+
+class Sender:
+    """Record the batches and answer each item with its upper case."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.users = []
+        self.error = error
+
+    async def __call__(self, items, users):
+        self.batches.append(items)
+        self.users.append(users)
+        if self.error:
+            raise self.error
+        return [item.upper() for item in items]
+
+
+def test_concurrent_items_share_one_call():
+    """Items submitted within the window are sent together; each caller gets its result."""
+    sender = Sender()
+    batcher = MicroBatcher(sender, "test", max_size=10, window=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(item, user) for item, user in
+                                      (("a", 2), ("b", 1), ("a", 3), ("c", 2))))
+
+    assert asyncio.run(scenario()) == ["A", "B", "A", "C"]
+    assert sender.batches == [["a", "b", "c"]]
+    assert sender.users == [[2, 1, 3]]
+    assert batcher.stats() == {"batches": 1, "items": 4, "average_size": 4.0}
+
+
+def test_full_batch_is_sent_at_once():
+    """A batch reaching max_size is sent without waiting for the window."""
+    sender = Sender()
+    batcher = MicroBatcher(sender, "test", max_size=2, window=60)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(item) for item in "abcd")), timeout=1
+        )
+
+    assert asyncio.run(scenario()) == ["A", "B", "C", "D"]
+    assert sender.batches == [["a", "b"], ["c", "d"]]
+
+
+def test_error_reaches_every_caller():
+    """A failed call raises its error in all the callers of the batch."""
+    batcher = MicroBatcher(Sender(error=ValueError("down")), "test", window=0.01)
+
+    async def scenario():
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"),
+                                    return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert [str(result) for result in results] == ["down", "down"]
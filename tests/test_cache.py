@@ -0,0 +1,57 @@
+"""
+Unit Testing Module for the result cache
+
+This module contains unit tests for the TieredCache class: LRU eviction of the memory tier,
+persistence and eviction of the SQLite tier, and time-to-live expiry.
+
+Usage:
+Run these tests using a pytest runner to validate the cache's behaviour.
+
+Dependencies:
+- pytest
+"""
+
+from peb.cache import TieredCache, make_key
+
+
+def test_make_key_normalizes_whitespace():
+    """Keys ignore differences in whitespace but not in content."""
+    assert make_key("Learn  Python\n", 0.5) == make_key("Learn Python", 0.5)
+    assert make_key("Learn Python", 0.5) != make_key("Learn Python", 0.7)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    """The memory tier keeps the most recently used entries."""
+    cache = TieredCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """Entries stored in SQLite are found by a new cache on the same file."""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = TieredCache(path=path, max_disk_entries=2)
+    for key in "abc":
+        cache.put(key, key.upper())
+    cache.close()
+
+    restarted = TieredCache(path=path, max_disk_entries=2)
+
+    assert restarted.get("a") is None
+    assert restarted.get("c") == "C"
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    """Entries older than the time-to-live are misses on both tiers."""
+    cache = TieredCache(ttl=0, path=str(tmp_path / "cache.sqlite3"))
+    cache.put("a", "1")
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 2
@@ -0,0 +1,41 @@
+"""
+Unit Testing Module for the OpenAI connection pool
+
+This module contains unit tests for the ClientManager class: prewarming the pool does not wait
+for an endpoint that accepts the connections but never answers.
+
+Usage:
+Run these tests using a pytest runner to validate the connection pool.
+
+Dependencies:
+- pytest
+- httpx
+- openai
+"""
+
+import asyncio
+import time
+
+from peb.client_manager import ClientManager
+
+
+def test_prewarm_gives_up_on_a_stalled_endpoint(monkeypatch):
+    """The HEAD requests of prewarm() time out instead of hanging the startup."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+    async def stall(reader, writer):  # pylint: disable=unused-argument
+        await asyncio.sleep(10)
+
+    async def prewarm():
+        server = await asyncio.start_server(stall, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        manager = ClientManager(base_url=f"http://127.0.0.1:{port}/v1", connect_timeout=0.2,
+                                prewarm_connections=2)
+        start = time.perf_counter()
+        await manager.prewarm()
+        elapsed = time.perf_counter() - start
+        await manager.close()
+        server.close()
+        return elapsed
+
+    assert asyncio.run(prewarm()) < 2
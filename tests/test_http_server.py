@@ -0,0 +1,62 @@
+"""
+Unit Testing Module for the HTTP server
+
+This module contains unit tests for the HttpServer class: requests that stall are answered
+with 408, idle keep-alive connections are closed, and requests with too many headers are
+rejected.
+
+Usage:
+Run these tests using a pytest runner to validate the server's behaviour.
+
+Dependencies:
+- pytest
+"""
+
+import asyncio
+
+from peb.http_server import MAX_HEADERS, HttpServer, Response
+
+
+async def hello(_request):
+    """Answer every request with Hello."""
+    return Response(200, b"Hello")
+
+
+async def exchange(data, pause=0.0, **kwargs) -> bytes:
+    """Send data to a fresh server, wait pause seconds, and return everything it answers."""
+    server = HttpServer({"/hello": hello}, **kwargs)
+    await server.start()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(data)
+        await writer.drain()
+        await asyncio.sleep(pause)
+        answer = await asyncio.wait_for(reader.read(), 2)
+        writer.close()
+        return answer
+    finally:
+        await server.stop()
+
+
+def test_stalled_request_times_out():
+    """A request whose headers never end is answered with 408 and the connection closed."""
+    answer = asyncio.run(exchange(b"GET /hello HTTP/1.1\r\nHost: x\r\n", read_timeout=0.1))
+
+    assert answer.startswith(b"HTTP/1.1 408 ")
+
+
+def test_idle_connection_is_closed():
+    """A keep-alive connection without a next request is closed after the idle timeout."""
+    answer = asyncio.run(exchange(b"GET /hello HTTP/1.1\r\n\r\n", idle_timeout=0.1))
+
+    assert answer.startswith(b"HTTP/1.1 200 ")
+    assert answer.endswith(b"Hello")
+
+
+def test_too_many_headers_are_rejected():
+    """A request with more than MAX_HEADERS header lines is answered with 400."""
+    headers = b"".join(b"X-%d: 1\r\n" % index for index in range(MAX_HEADERS + 1))
+
+    answer = asyncio.run(exchange(b"GET /hello HTTP/1.1\r\n" + headers + b"\r\n"))
+
+    assert answer.startswith(b"HTTP/1.1 400 ")
@@ -0,0 +1,75 @@
+"""
+Unit Testing Module for the logging setup
+
+This module contains unit tests for peb.log: the records are written as JSON lines by the
+writer thread, the users' text is redacted, the sampled records are thinned out and the
+arguments that could change after the call are formatted at once.
+
+Usage:
+Run these tests using a pytest runner to validate the logging setup.
+
+Dependencies:
+- pytest
+"""
+
+import io
+import json
+import logging
+
+import pytest
+
+from peb import log
+
+
+@pytest.fixture(name="output")
+def fixture_output():
+    """Send the records of the test to a buffer, then restore the previous handlers."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    stream = io.StringIO()
+    log.setup_logging("INFO", "json", sample_rate=0.0, stream=stream)
+    yield stream
+    log.stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def lines(stream) -> list[dict]:
+    """Flush the writer and return the JSON records written so far."""
+    log.stop_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_written_as_json(output):
+    """A record becomes a JSON object with its level, logger, message and extra fields."""
+    logger = logging.getLogger("peb.test")
+    logger.info("Moderating: %s", log.redact("my email is me@example.com"), extra={"user": 42})
+    logger.debug("User data: %s", {"goal": "Learn Python"})
+
+    records = lines(output)
+
+    assert len(records) == 1
+    assert records[0]["level"] == "INFO"
+    assert records[0]["logger"] == "peb.test"
+    assert records[0]["message"] == "Moderating: <redacted 26 chars>"
+    assert records[0]["user"] == 42
+
+
+def test_sampled_records_are_dropped(output):
+    """With a sample rate of 0 only the records that are not sampled are written."""
+    logger = logging.getLogger("peb.test")
+    for _ in range(10):
+        logger.info("@ goal", extra=log.SAMPLED)
+    logger.warning("Circuit breaker opened")
+
+    assert [record["message"] for record in lines(output)] == ["Circuit breaker opened"]
+
+
+def test_mutable_arguments_are_formatted_when_logged(output):
+    """A dict changed after the call is written as it was when it was logged."""
+    logger = logging.getLogger("peb.test")
+    user_data = {"goal": "Learn Python"}
+    logger.info("Keys: %s", list(user_data))
+    user_data["task"] = "Teach basics"
+
+    assert lines(output)[0]["message"] == "Keys: ['goal']"
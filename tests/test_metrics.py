@@ -0,0 +1,105 @@
+"""
+Unit Testing Module for the metrics
+
+This module contains unit tests for the Prometheus metrics: the histograms and counters are
+rendered in the text format, the conversation handlers and the OpenAI calls are recorded, the
+conversations are counted by state, and /metrics serves the whole registry.
+
+Usage:
+Run these tests using a pytest runner to validate the metrics.
+
+Dependencies:
+- pytest
+- httpx
+- openai
+"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock
+
+import httpx
+import pytest
+from openai.types.chat import ChatCompletion
+
+from peb import metrics
+from peb.cache import TieredCache
+from peb.data import BotState
+from peb.open_ai import OpenAI
+from peb.telegram_bot import count_conversations, process_dict
+
+
+def test_histogram_buckets_are_cumulative():
+    """Each bucket counts the observations up to its bound; +Inf equals the count."""
+    histogram = metrics.Histogram("test_seconds", "Test.", ("handler",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, "goal")
+
+    lines = histogram.render().splitlines()
+
+    assert lines[:2] == ["# HELP test_seconds Test.", "# TYPE test_seconds histogram"]
+    assert lines[2:] == [
+        'test_seconds_bucket{handler="goal",le="0.1"} 1',
+        'test_seconds_bucket{handler="goal",le="1.0"} 3',
+        'test_seconds_bucket{handler="goal",le="+Inf"} 4',
+        'test_seconds_sum{handler="goal"} 4.05',
+        'test_seconds_count{handler="goal"} 4',
+    ]
+
+
+def test_handlers_are_timed_and_their_errors_counted():
+    """A handler that raises is timed and its exception counted by type."""
+    update = Mock(message=Mock(text="Learn Python", reply_text=AsyncMock(side_effect=OSError)))
+    context = SimpleNamespace(user_data={})
+    before = metrics.handler_seconds.count("goal")
+
+    with pytest.raises(OSError):
+        asyncio.run(process_dict["goal"](update, context))
+
+    assert metrics.handler_seconds.count("goal") == before + 1
+    assert metrics.handler_errors.value("goal", "OSError") >= 1
+
+
+def test_completion_tokens_are_counted(mocker):
+    """The usage of a completion is added to the token counter."""
+    client = Mock()
+    client.chat.completions.create = AsyncMock(return_value=ChatCompletion.model_validate({
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-3.5-turbo",
+        "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                     "message": {"role": "assistant", "content": "Enhanced prompt"}}],
+        "usage": {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150},
+    }))
+    mocker.patch("peb.open_ai.get_client", return_value=client)
+    mocker.patch("peb.open_ai.completion_cache", TieredCache())
+    prompt_tokens = metrics.openai_tokens.value("prompt", "usage")
+    requests = metrics.openai_seconds.count("create", "ok")
+
+    asyncio.run(OpenAI().create("Refine", "Learn Python", ""))
+
+    assert metrics.openai_tokens.value("prompt", "usage") == prompt_tokens + 120
+    assert metrics.openai_seconds.count("create", "ok") == requests + 1
+
+
+def test_metrics_endpoint_counts_conversations_by_state():
+    """/metrics serves the registry, with the conversations counted by state."""
+    conv_handler = SimpleNamespace(_conversations={
+        (1, 1): BotState.GOAL, (2, 2): BotState.OPENAI, (3, 3): BotState.GOAL,
+    })
+    metrics.conversations.set_function(lambda: count_conversations(conv_handler))
+
+    async def scrape():
+        await metrics.start_server("127.0.0.1", 0)
+        port = metrics._server.port  # pylint: disable=protected-access
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{port}/metrics")
+        await metrics.stop_server()
+        return response
+
+    response = asyncio.run(scrape())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    assert 'peb_conversations{state="GOAL"} 2' in response.text
+    assert 'peb_conversations{state="OPENAI"} 1' in response.text
+    assert 'peb_conversations{state="TASK"} 0' in response.text
+    assert "# TYPE peb_handler_seconds histogram" in response.text
@@ -0,0 +1,264 @@
+"""
+Unit Testing Module for the OpenAI wrapper
+
+This module contains unit tests for the OpenAI class used by the Telegram bot. The asynchronous
+OpenAI client is mocked, so the tests exercise the request handling of the wrapper without any
+network calls.
+
+Usage:
+Run these tests using a pytest runner to validate the wrapper's behaviour.
+
+Dependencies:
+- pytest
+- unittest.mock
+- openai
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from openai.types import ModerationCreateResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from peb import metrics
+from peb.cache import TieredCache
+from peb.open_ai import OpenAI
+from peb.similarity import SimilarityIndex
+from peb.tokens import INPUT_TOKENS, count_tokens
+
+COMPLETION = ChatCompletion.model_validate({
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "finish_reason": "stop",
+        "logprobs": None,
+        "message": {"role": "assistant", "content": "Enhanced prompt"},
+    }],
+})
+
+CATEGORIES = ["harassment", "harassment/threatening", "hate", "hate/threatening", "self-harm",
+              "self-harm/instructions", "self-harm/intent", "sexual", "sexual/minors",
+              "violence", "violence/graphic"]
+
+
+def moderation(flagged) -> ModerationCreateResponse:
+    """Build a moderation response with the given verdict."""
+    return ModerationCreateResponse.model_validate({
+        "id": "modr-1",
+        "model": "text-moderation-latest",
+        "results": [{
+            "flagged": flagged,
+            "categories": dict.fromkeys(CATEGORIES, flagged),
+            "category_scores": dict.fromkeys(CATEGORIES, 0.9 if flagged else 0.0),
+        }],
+    })
+
+
+class FakeStream:
+    """A streamed completion made of the given text deltas."""
+
+    def __init__(self, deltas):
+        self.chunks = [ChatCompletionChunk.model_validate({
+            "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0,
+            "model": "gpt-3.5-turbo",
+            "choices": [{"index": 0, "delta": {"content": delta},
+                         "finish_reason": "stop" if number == len(deltas) - 1 else None}],
+        }) for number, delta in enumerate(deltas)]
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        """Record that the stream was closed."""
+        self.closed = True
+
+
+@pytest.fixture(name="client")
+def fixture_client(mocker):
+    """Replace the shared asynchronous OpenAI client with a mock."""
+    client = Mock()
+    client.chat.completions.create = AsyncMock()
+    client.moderations.create = AsyncMock()
+    mocker.patch("peb.open_ai.get_client", return_value=client)
+    mocker.patch("peb.open_ai.completion_cache", TieredCache())
+    mocker.patch("peb.open_ai.moderation_cache", TieredCache())
+    return client
+
+
+def test_create_awaits_async_client(client):
+    """The completion is requested through the asynchronous client."""
+    client.chat.completions.create.return_value = COMPLETION
+
+    success, err_msg, response = asyncio.run(OpenAI().create("Refine", "Learn Python", ""))
+
+    assert (success, err_msg, response) == (True, None, COMPLETION)
+    client.chat.completions.create.assert_awaited_once()
+
+
+def test_create_uses_cache(client):
+    """A request that differs only in whitespace is answered from the cache."""
+    client.chat.completions.create.return_value = COMPLETION
+
+    asyncio.run(OpenAI().create("Refine", "Learn Python", ""))
+    success, _, response = asyncio.run(OpenAI().create("Refine", " Learn   Python\n", ""))
+
+    assert success
+    assert response.choices[0].message.content == "Enhanced prompt"
+    client.chat.completions.create.assert_awaited_once()
+
+
+def test_create_does_not_cache_truncated_completions(client):
+    """A completion cut by max_tokens is requested again instead of being reused."""
+    truncated = COMPLETION.model_copy(deep=True)
+    truncated.choices[0].finish_reason = "length"
+    client.chat.completions.create.return_value = truncated
+
+    asyncio.run(OpenAI().create("Refine", "Learn Python", ""))
+    asyncio.run(OpenAI().create("Refine", "Learn Python", ""))
+
+    assert client.chat.completions.create.await_count == 2
+
+
+def test_moderate_returns_flag(client):
+    """The moderation verdict is taken from the first result."""
+    client.moderations.create.return_value = moderation(True)
+
+    success, err_msg, flagged = asyncio.run(OpenAI.moderate("Learn Python"))
+
+    assert (success, err_msg, flagged) == (True, None, True)
+
+
+def test_moderate_uses_cache(client):
+    """A prompt differing only in whitespace and case reuses the cached verdict."""
+    client.moderations.create.return_value = moderation(False)
+
+    asyncio.run(OpenAI.moderate("Learn Python"))
+    success, _, flagged = asyncio.run(OpenAI.moderate("  learn  PYTHON "))
+
+    assert (success, flagged) == (True, False)
+    client.moderations.create.assert_awaited_once()
+
+
+def test_create_reuses_near_duplicate(client, mocker):
+    """With the similarity index, a canvas differing by a word reuses the enhancement."""
+    mocker.patch("peb.open_ai.SIMILAR_PROMPTS", True)
+    mocker.patch("peb.open_ai.similar_prompts", SimilarityIndex(threshold=0.9))
+    client.chat.completions.create.return_value = COMPLETION
+    canvas = (
+        "My goal is: Learn Python\nAssume you are: Python expert\n"
+        "Your task is to: Teach the basics of Python\nThe audience is: beginners\n"
+    )
+
+    asyncio.run(OpenAI().create("Refine", canvas, ""))
+    success, _, response = asyncio.run(
+        OpenAI().create("Refine", canvas.replace("Learn Python", "Learn python basics"), "")
+    )
+    asyncio.run(OpenAI().create("Refine", canvas.replace("Python", "Rust"), ""))
+
+    assert success
+    assert response.choices[0].message.content == "Enhanced prompt"
+    assert client.chat.completions.create.await_count == 2
+
+
+def test_concurrent_moderations_share_a_request(client, mocker):
+    """The prompts moderated at the same time are sent in one request, admitted for a user."""
+    async def create(input, **kwargs):  # pylint: disable=redefined-builtin,unused-argument
+        response = moderation(False)
+        response.results = [moderation("flag" in prompt).results[0] for prompt in input]
+        return response
+
+    async def run(user, tokens, func, *args, **kwargs):  # pylint: disable=unused-argument
+        return await func(*args, **kwargs)
+
+    client.moderations.create.side_effect = create
+    admitted = mocker.patch("peb.open_ai.moderation_scheduler.run", side_effect=run)
+
+    async def scenario():
+        return await asyncio.gather(OpenAI.moderate("Learn Python", user=1),
+                                    OpenAI.moderate("flag me", user=2))
+
+    assert asyncio.run(scenario()) == [(True, None, False), (True, None, True)]
+    client.moderations.create.assert_awaited_once()
+    user, tokens = admitted.call_args.args[:2]
+    assert user == 1
+    assert tokens == count_tokens("Learn Python") + count_tokens("flag me")
+
+
+def test_moderate_flags_personal_information_locally(client):
+    """A prompt with an email address is flagged by the local filter without a request."""
+    success, err_msg, flagged = asyncio.run(OpenAI.moderate("Write to me at me@example.com"))
+
+    assert (success, err_msg, flagged) == (True, None, True)
+    client.moderations.create.assert_not_awaited()
+
+
+def test_stream_yields_deltas_and_caches_completion(client):
+    """The deltas are yielded as they arrive; the whole completion is then served by create."""
+    stream = FakeStream(["Enhanced", " prompt"])
+    client.chat.completions.create.return_value = stream
+    openai_obj = OpenAI()
+
+    async def run():
+        _, _, deltas = await openai_obj.stream("Refine", "Learn Python", "")
+        received = [delta async for delta in deltas]
+        return received, await openai_obj.create("Refine", "Learn Python", "")
+
+    received, (success, _, response) = asyncio.run(run())
+
+    assert received == ["Enhanced", " prompt"]
+    assert stream.closed
+    assert success and response.choices[0].message.content == "Enhanced prompt"
+    client.chat.completions.create.assert_awaited_once()
+    assert client.chat.completions.create.await_args.kwargs["stream"] is True
+
+
+def test_identical_requests_of_two_users_share_a_completion(client):
+    """Two users enhancing the same prompt at the same time make one request."""
+    async def create(**kwargs):  # pylint: disable=unused-argument
+        await asyncio.sleep(0.01)
+        return COMPLETION
+
+    client.chat.completions.create.side_effect = create
+    collapsed = metrics.collapsed_requests.value("create")
+
+    async def scenario():
+        return await asyncio.gather(OpenAI().create("Refine", "Learn Python", "", user=1),
+                                    OpenAI().create("Refine", "Learn Python", "", user=2))
+
+    assert asyncio.run(scenario()) == [(True, None, COMPLETION)] * 2
+    client.chat.completions.create.assert_awaited_once()
+    assert metrics.collapsed_requests.value("create") == collapsed + 1
+
+
+def test_identical_streams_share_a_completion(client):
+    """A stream identical to one in flight waits for it and gets its completion."""
+    client.chat.completions.create.return_value = FakeStream(["Enhanced", " prompt"])
+
+    async def read(user):
+        _, _, deltas = await OpenAI().stream("Refine", "Learn Python", "", user=user)
+        return "".join([delta async for delta in deltas])
+
+    async def scenario():
+        return await asyncio.gather(read(1), read(2))
+
+    assert asyncio.run(scenario()) == ["Enhanced prompt"] * 2
+    client.chat.completions.create.assert_awaited_once()
+
+
+def test_create_budgets_the_request(client):
+    """A long pasted prompt is compacted and truncated, and the output is capped."""
+    client.chat.completions.create.return_value = COMPLETION
+    inbox = "\n\n".join(f"Email {number}: please confirm the meeting." for number in range(2000))
+
+    asyncio.run(OpenAI().create("Refine", inbox, ""))
+
+    kwargs = client.chat.completions.create.await_args.kwargs
+    assert kwargs["max_tokens"] == 700
+    assert count_tokens(kwargs["messages"][1]["content"]) <= INPUT_TOKENS + 2
+    assert "\n\n" not in kwargs["messages"][1]["content"]
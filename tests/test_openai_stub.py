@@ -0,0 +1,94 @@
+"""
+Unit Testing Module for the OpenAI stub server
+
+This module contains unit tests for the local OpenAI-compatible stub: the OpenAI wrapper of the
+bot, pointed at the stub through the client manager's base URL, receives completions, streamed
+completions and moderation verdicts, and retries the injected rate-limit errors.
+
+Usage:
+Run these tests using a pytest runner to validate the stub's behaviour.
+
+Dependencies:
+- pytest
+- openai
+"""
+
+import asyncio
+import random
+
+import pytest
+
+from peb.cache import TieredCache
+from peb.client_manager import ClientManager
+from peb.open_ai import OpenAI
+from peb.openai_stub import OpenAIStub, sample_latency
+from peb.resilience import Resilience
+
+
+@pytest.fixture(name="wrapper")
+def fixture_wrapper(mocker):
+    """Fresh caches and a resilience policy that retries without waiting."""
+    mocker.patch("peb.open_ai.completion_cache", TieredCache())
+    mocker.patch("peb.open_ai.moderation_cache", TieredCache())
+    mocker.patch("peb.open_ai.resilience", Resilience(max_retries=3))
+    return mocker
+
+
+async def run_against(stub, mocker, calls):
+    """Start the stub, point the wrapper at it and return the results of calls(OpenAI())."""
+    await stub.start()
+    manager = ClientManager(base_url=stub.base_url)
+    mocker.patch("peb.open_ai.get_client", return_value=manager.client)
+    try:
+        return await calls(OpenAI())
+    finally:
+        await manager.close()
+        await stub.stop()
+
+
+def test_wrapper_talks_to_the_stub(wrapper, monkeypatch):
+    """Plain and streamed completions carry the same text; moderation follows flagged_ratio."""
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    stub = OpenAIStub(latency=0, moderation_latency=0, chunk_rate=0, words=30)
+
+    async def calls(openai_obj):
+        plain = await openai_obj.create("Refine", "Learn Python", "")
+        _, _, stream = await openai_obj.stream("Refine", "Learn Rust", "")
+        deltas = [delta async for delta in stream]
+        moderation = await openai_obj.moderate("Learn Python")
+        return plain, deltas, moderation
+
+    (success, _, completion), deltas, moderation = asyncio.run(
+        run_against(stub, wrapper, calls)
+    )
+
+    assert success
+    assert len(deltas) == 30
+    assert "".join(deltas) == completion.choices[0].message.content
+    assert moderation == (True, None, False)
+    assert stub.stats() == {"completions 200": 2, "moderations 200": 1}
+
+
+def test_injected_rate_limits_are_retried(wrapper, monkeypatch):
+    """Every request answered with 429 is retried after the stub's retry-after-ms delay."""
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    stub = OpenAIStub(moderation_latency=0, rate_limit_ratio=0.5, retry_after=0.001,
+                      flagged_ratio=1.0, seed=3)
+
+    async def calls(openai_obj):
+        return [await openai_obj.moderate(f"prompt {number}") for number in range(20)]
+
+    results = asyncio.run(run_against(stub, wrapper, calls))
+    stats = stub.stats()
+
+    assert stats["moderations 429"] > 0
+    assert stats["moderations 200"] == 20
+    assert all(result == (True, None, True) for result in results)
+
+
+def test_latency_distributions_keep_their_mean():
+    """Every distribution draws latencies around the configured mean."""
+    rng = random.Random(0)
+    for distribution in ("constant", "uniform", "exponential", "lognormal"):
+        draws = [sample_latency(distribution, 0.2, rng) for _ in range(20000)]
+        assert sum(draws) / len(draws) == pytest.approx(0.2, rel=0.05)
@@ -0,0 +1,76 @@
+"""
+Unit Testing Module for the conversation persistence
+
+This module contains unit tests for the SQLitePersistence class: user data and conversation
+states survive a restart, ended conversations and dropped users are deleted, and buffered
+changes are written in batches.
+
+Usage:
+Run these tests using a pytest runner to validate the persistence's behaviour.
+
+Dependencies:
+- pytest
+"""
+
+import asyncio
+
+from peb.data import BotState
+from peb.persistence import SQLitePersistence
+from peb.session import Session
+
+
+def test_state_survives_restart(tmp_path):
+    """A new persistence on the same file restores the users and the conversations."""
+    path = str(tmp_path / "state.sqlite3")
+
+    async def save():
+        persistence = SQLitePersistence(path)
+        await persistence.update_user_data(1, {"goal": "Learn Python"})
+        await persistence.update_conversation("canvas", (10, 1), BotState.PERSONA)
+        await persistence.flush()
+
+    async def load():
+        persistence = SQLitePersistence(path)
+        return await persistence.get_user_data(), await persistence.get_conversations("canvas")
+
+    asyncio.run(save())
+    user_data, conversations = asyncio.run(load())
+
+    assert user_data == {1: {"goal": "Learn Python"}}
+    assert isinstance(user_data[1], Session)
+    assert conversations == {(10, 1): BotState.PERSONA}
+
+
+def test_ended_conversations_and_dropped_users_are_deleted(tmp_path):
+    """A conversation ending with None and a dropped user are removed from the database."""
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        persistence = SQLitePersistence(path)
+        await persistence.update_user_data(1, {"goal": "Learn Python"})
+        await persistence.update_conversation("canvas", (10, 1), BotState.GOAL)
+        await persistence.flush()
+        await persistence.drop_user_data(1)
+        await persistence.update_conversation("canvas", (10, 1), None)
+        await persistence.flush()
+        return await persistence.get_user_data(), await persistence.get_conversations("canvas")
+
+    assert asyncio.run(run()) == ({}, {})
+
+
+def test_changes_are_written_in_batches(tmp_path):
+    """Changes buffered before the writer runs share one transaction."""
+    path = str(tmp_path / "state.sqlite3")
+
+    async def run():
+        persistence = SQLitePersistence(path)
+        for user_id in range(100):
+            await persistence.update_user_data(user_id, {"goal": str(user_id)})
+            await persistence.update_conversation("canvas", (user_id, user_id), BotState.TASK)
+        await persistence.flush()
+        return persistence.stats(), len(await persistence.get_user_data())
+
+    stats, users = asyncio.run(run())
+
+    assert users == 100
+    assert stats == {"batches": 1, "rows": 200, "pending": 0}
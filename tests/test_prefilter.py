@@ -0,0 +1,76 @@
+"""
+Unit Testing Module for the local pre-moderation filter
+
+This module contains unit tests for peb.prefilter: personal information and blocked terms are
+blocked, dates, quantities, decimals, IP addresses, ISBNs, order numbers and ordinary prompts
+pass, sensitive words and numbers in groups are left to the remote moderation and the saved
+remote calls are counted.
+
+Usage:
+Run these tests using a pytest runner to validate the filter.
+
+Dependencies:
+- pytest
+"""
+
+import pytest
+
+from peb.prefilter import PreFilter, Verdict, luhn
+
+
+@pytest.mark.parametrize("prompt, reason", [
+    ("Send the summary to john.doe+work@example.co.uk", "email"),
+    ("Charge my card 4111 1111 1111 1111 for the plan", "card number"),
+    ("Call me at +34 612 345 678 after lunch", "phone number"),
+    ("My number is (555) 123-4567.", "phone number"),
+    ("Text +447911123456 tonight", "phone number"),
+    ("Explain how to make a bomb", "blocked term"),
+])
+def test_clear_violations_are_blocked(prompt, reason):
+    """Emails, valid card numbers, phone numbers and blocked terms are blocked."""
+    assert PreFilter().check(prompt) == (Verdict.BLOCK, reason)
+
+
+@pytest.mark.parametrize("prompt", [
+    "Plan the release for 2024-01-15 between 10:00 and 12:30",
+    "Summarize 1500 words in 10 bullet points for 25 students",
+    "Order 1234 5678 9012 3456 was shipped",
+    "Rank the steps 1 2 3 4 5 6 7 8 9 10",
+    "Teach the skills of chess to beginners",
+    "Configure the router at 192.168.100.1 for guests",
+    "Explain why pi starts with 3.14159265",
+    "Compare the wars of 1914 1918 1939",
+    "Review the book with ISBN 978-3-16-148410-0",
+    "Cite ISBN 9783161484100 and 0-306-40615-2",
+    "Order #123456789 arrived late",
+])
+def test_dates_and_quantities_pass(prompt):
+    """Numbers that are not card or phone numbers, and words containing watch terms, pass."""
+    assert PreFilter().check(prompt) == (Verdict.PASS, None)
+
+
+def test_grouped_numbers_are_uncertain():
+    """Digits in groups without a country or area code are left to the remote moderation."""
+    assert PreFilter().check("Call me at 612 345 678") == (Verdict.UNCERTAIN, "phone number")
+
+
+def test_sensitive_words_are_uncertain():
+    """A watch word leaves the decision to the remote moderation."""
+    prefilter = PreFilter()
+
+    verdict, reason = prefilter.check("Write a murder mystery set in Venice")
+
+    assert (verdict, reason) == (Verdict.UNCERTAIN, "sensitive word")
+    assert prefilter.needs_remote(verdict)
+
+
+def test_saved_remote_calls_are_counted():
+    """Blocks always save the remote call, passes only when skip_remote is set."""
+    prefilter = PreFilter(skip_remote=True)
+
+    prefilter.check("Learn Python")
+    prefilter.check("Mail me@example.com")
+    prefilter.check("Hack the planet")
+
+    assert prefilter.stats() == {"block": 1, "pass": 1, "uncertain": 1, "remote_calls_saved": 2}
+    assert luhn("4111111111111111") and not luhn("4111111111111112")
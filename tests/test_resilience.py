@@ -0,0 +1,96 @@
+"""
+Unit Testing Module for the resilience layer
+
+This module contains unit tests for the Resilience class: retries of transient errors, the
+Retry-After header and the circuit breaker.
+
+Usage:
+Run these tests using a pytest runner to validate the retry policy.
+
+Dependencies:
+- pytest
+- httpx
+- openai
+"""
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import httpx
+import openai
+import pytest
+
+from peb import metrics
+from peb.resilience import CircuitOpenError, Resilience, retry_after
+
+
+def rate_limit_error(headers=None) -> openai.RateLimitError:
+    """Build the error raised by the OpenAI client for a 429 response."""
+    request = httpx.Request("POST", "https://api.openai.com/v1/moderations")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_transient_errors_are_retried():
+    """A call that fails with 429 and then succeeds returns the result."""
+    resilience = Resilience("test-retries", max_retries=2, base_delay=0)
+    func = AsyncMock(side_effect=[rate_limit_error(), rate_limit_error(), "ok"])
+
+    assert asyncio.run(resilience.call(func)) == "ok"
+    assert resilience.stats()["retries"] == 2
+    assert metrics.resilience_retries.value("test-retries", "RateLimitError") == 2
+
+
+def test_retry_after_header():
+    """The delay requested by the server is used when present."""
+    assert retry_after(rate_limit_error({"retry-after": "2"})) == 2
+    assert retry_after(rate_limit_error({"retry-after-ms": "250"})) == 0.25
+    assert retry_after(rate_limit_error()) is None
+
+
+def test_breaker_fails_fast_and_recovers():
+    """Consecutive failures open the breaker; a successful trial call closes it."""
+    resilience = Resilience("test-breaker", max_retries=0, failure_threshold=2,
+                            reset_timeout=0.05)
+    func = AsyncMock(side_effect=rate_limit_error())
+
+    for _ in range(2):
+        with pytest.raises(openai.RateLimitError):
+            asyncio.run(resilience.call(func))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilience.call(func))
+
+    asyncio.run(asyncio.sleep(0.05))
+    func.side_effect = None
+    func.return_value = "ok"
+    assert asyncio.run(resilience.call(func)) == "ok"
+    assert resilience.stats()["breaker_trips"] == 1
+    assert resilience.stats()["short_circuits"] == 1
+    assert metrics.breaker_trips.value("test-breaker") == 1
+    assert metrics.breaker_short_circuits.value("test-breaker") == 1
+    assert not resilience.is_open()
+
+
+def test_trial_cancelled_during_backoff_releases_the_breaker():
+    """A half-open trial cancelled while it waits to retry lets the next call through."""
+    resilience = Resilience("test-cancelled-trial", max_retries=1, failure_threshold=1,
+                            reset_timeout=0.01)
+    now, later = rate_limit_error({"retry-after": "0"}), rate_limit_error({"retry-after": "10"})
+    func = AsyncMock(side_effect=[now, now, later])
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(resilience.call(func))
+
+    async def cancel_trial():
+        await asyncio.sleep(0.01)
+        task = asyncio.create_task(resilience.call(func))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert func.await_count == 3
+    func.side_effect = None
+    func.return_value = "ok"
+    assert asyncio.run(resilience.call(func)) == "ok"
+    assert not resilience.is_open()
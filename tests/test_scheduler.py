@@ -0,0 +1,58 @@
+"""
+Unit Testing Module for the admission scheduler
+
+This module contains unit tests for the TokenBucket and AdmissionScheduler classes: the rate
+at which requests are admitted and the round-robin service of the users.
+
+Usage:
+Run these tests using a pytest runner to validate the scheduler's behaviour.
+
+Dependencies:
+- pytest
+"""
+
+import asyncio
+
+from peb import metrics
+from peb.scheduler import AdmissionScheduler, TokenBucket
+
+
+def test_bucket_delay():
+    """An empty bucket asks to wait for the missing tokens at its rate."""
+    bucket = TokenBucket(rate_per_minute=600, burst_seconds=1)
+    bucket.consume(10)
+
+    assert 0.09 < bucket.delay(1) <= 0.1
+    assert TokenBucket(rate_per_minute=0).delay(10 ** 6) == 0
+
+
+def test_users_are_served_in_turn():
+    """Queued requests are released round-robin across users."""
+    scheduler = AdmissionScheduler("test-turns", requests_per_minute=1200, burst_seconds=0.05)
+    admitted = []
+
+    async def request(user, number):
+        await scheduler.acquire(user)
+        admitted.append(f"{user}{number}")
+
+    async def scenario():
+        await asyncio.gather(
+            request("a", 1), request("a", 2), request("a", 3), request("b", 1)
+        )
+
+    asyncio.run(scenario())
+
+    assert admitted == ["a1", "a2", "b1", "a3"]
+    assert scheduler.stats()["queued"] == 3
+    assert scheduler.stats()["queue_depth"] == 0
+    assert metrics.scheduler_wait_seconds.count("test-turns") == 4
+    assert "peb_scheduler_queue_depth{scheduler=\"test-turns\"} 0" in metrics.registry.render()
+
+
+def test_disabled_scheduler_never_waits():
+    """Without quotas the requests are not held."""
+    scheduler = AdmissionScheduler()
+
+    asyncio.run(scheduler.acquire("a", tokens=10 ** 6))
+
+    assert scheduler.stats()["queued"] == 0
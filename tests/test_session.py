@@ -0,0 +1,52 @@
+"""
+Unit Testing Module for the compact sessions
+
+This module contains unit tests for peb.session: a Session behaves like the dict it replaces,
+survives a persistence round trip, and the idle sessions and the least recently seen beyond the
+cap are selected for eviction.
+
+Usage:
+Run these tests using a pytest runner to validate the sessions.
+
+Dependencies:
+- pytest
+"""
+
+import copy
+import json
+
+import pytest
+
+from peb.session import MODERATION_KEY, Session, expired_sessions
+
+
+def test_session_is_a_mapping():
+    """A session stores the answers of the canvas like a dict, and nothing else."""
+    session = Session({"goal": "Learn Python", "start": "dropped"})
+    session["task"] = "Teach basics"
+    session.setdefault(MODERATION_KEY, {})["goal"] = ["digest", False]
+
+    assert session == {"goal": "Learn Python", "task": "Teach basics",
+                       MODERATION_KEY: {"goal": ["digest", False]}}
+    assert list(session) == ["goal", "task", MODERATION_KEY]
+    assert session.get("persona") is None and "persona" not in session
+    assert copy.deepcopy(session) == Session(json.loads(json.dumps(dict(session))))
+    with pytest.raises(KeyError):
+        session["user_id"] = 1
+    assert not hasattr(session, "__dict__")
+
+    session.clear()
+
+    assert not session and len(session) == 0
+
+
+def test_idle_and_least_recently_seen_sessions_expire():
+    """Idle sessions expire first, then the least recently seen beyond the cap."""
+    sessions = {user_id: Session() for user_id in range(5)}
+    for user_id, session in sessions.items():
+        session.touch(now=user_id * 100.0)
+
+    assert expired_sessions(sessions, idle_timeout=250, max_sessions=2, now=400.0) == [
+        (0, "idle"), (1, "idle"), (2, "capacity")
+    ]
+    assert expired_sessions(sessions, idle_timeout=0, max_sessions=0, now=400.0) == []
@@ -0,0 +1,125 @@
+"""
+Unit Testing Module for the near-duplicate prompt index
+
+This module contains unit tests for peb.similarity: near-duplicate canvases match and
+different ones do not, the words of the template are left out, namespaces are kept apart, full
+buckets and equal signatures keep the newest entries, the oldest entries are evicted and the
+index is reloaded from its SQLite database.
+
+Usage:
+Run these tests using a pytest runner to validate the index.
+
+Dependencies:
+- pytest
+"""
+
+from peb.data import final_message
+from peb.similarity import SimilarityIndex, similarity, simhash
+
+CANVAS = (
+    "My goal is: Learn Python\nAssume you are: Python expert\n"
+    "Your task is to: Teach the basics of Python\nThe audience is: beginners\n"
+)
+
+
+def test_near_duplicates_match():
+    """A canvas with one more word matches; another topic or another namespace does not."""
+    index = SimilarityIndex(threshold=0.9)
+    index.add(CANVAS, "python", "refine")
+
+    value, score = index.lookup(CANVAS.replace("Learn Python", "Learn python basics"), "refine")
+
+    assert value == "python"
+    assert 0.9 <= score < 1
+    assert index.lookup(CANVAS.replace("Python", "Rust"), "refine") is None
+    assert index.lookup(CANVAS, "other instruction") is None
+    assert index.stats()["hits"] == 1
+
+
+def test_closest_signature_within_the_distance_is_found():
+    """Any signature within max_distance bits is found, the closest first."""
+    index = SimilarityIndex(threshold=0.9)
+    signature = simhash(CANVAS)
+    index.insert(signature ^ 0b111, "three bits")
+    index.insert(signature ^ (1 << 127) ^ (1 << 64), "two bits")
+
+    assert index.search(signature) == ("two bits", similarity(signature, signature ^ 0b11))
+    assert index.search(signature ^ ((1 << 20) - 1) << 64) is None
+
+
+def test_template_words_are_left_out():
+    """Canvases sharing only their labels match, unless the labels are the template."""
+    def canvas(answers):
+        return "".join(f"{label} {answer}\n" for label, answer in
+                       zip(final_message.values(), answers.split()))
+
+    python = canvas("Python teacher lesson examples students markdown short slides clear")
+    rust = canvas("Rust engineer review checklist managers table formal linter precise")
+    plain = SimilarityIndex(threshold=0.85)
+    templated = SimilarityIndex(threshold=0.85, template=final_message.values())
+    plain.add(python, "python")
+    templated.add(python, "python")
+
+    assert plain.lookup(rust)[0] == "python"
+    assert templated.lookup(rust) is None
+    assert templated.lookup(python) == ("python", 1.0)
+
+
+def test_full_buckets_and_equal_signatures_keep_the_newest():
+    """
+    A signature dropped from a full bucket is found through its other bands, and an equal
+    signature replaces the entry.
+    """
+    index = SimilarityIndex(threshold=0.9, max_bucket=1)
+    signature = simhash(CANVAS)
+    # The second signature only differs in the first band: it takes all the other buckets.
+    index.insert(signature, "first")
+    index.insert(signature ^ 0b11, "second")
+    index.insert(signature ^ 0b11, "third")
+
+    assert index.search(signature ^ (1 << 40)) == ("first", similarity(0, 1))
+    assert index.search(signature ^ 0b11 ^ (1 << 40)) == ("third", similarity(0, 1))
+    assert index.stats()["entries"] == 2
+    assert index.stats()["evictions"] == 1
+
+
+def test_oldest_entries_are_evicted():
+    """Beyond max_entries the oldest entries are dropped."""
+    index = SimilarityIndex(threshold=0.95, max_entries=2)
+    for number, signature in enumerate((0, (1 << 64) - 1, (1 << 128) - 1)):
+        index.insert(signature, str(number))
+
+    assert index.search(0) is None
+    assert index.search((1 << 128) - 1) == ("2", 1.0)
+    assert index.stats()["evictions"] == 1
+
+
+def test_index_is_reloaded_from_disk(tmp_path):
+    """The entries written to the SQLite database are found after a restart."""
+    path = str(tmp_path / "cache.sqlite3")
+    index = SimilarityIndex(path=path)
+    index.add(CANVAS, "python")
+    index.close()
+
+    reloaded = SimilarityIndex(path=path)
+
+    assert reloaded.lookup(CANVAS)[0] == "python"
+    assert reloaded.stats()["entries"] == 1
+
+
+def test_processes_sharing_the_database_do_not_collide(tmp_path):
+    """Two indexes writing to the same file, like two workers, keep every entry."""
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = SimilarityIndex(path=path), SimilarityIndex(path=path)
+    first.lookup(CANVAS)
+    second.lookup(CANVAS)
+
+    first.add(CANVAS, "python")
+    second.add(CANVAS.replace("Python", "Rust"), "rust")
+    first.close()
+    second.close()
+    reloaded = SimilarityIndex(path=path)
+
+    assert reloaded.lookup(CANVAS)[0] == "python"
+    assert reloaded.lookup(CANVAS.replace("Python", "Rust"))[0] == "rust"
+    assert reloaded.stats()["entries"] == 2
@@ -0,0 +1,94 @@
+"""
+Unit Testing Module for the single-flight layer
+
+This module contains unit tests for peb.singleflight.SingleFlight: concurrent calls with the
+same key share one call and its error, a cancelled caller leaves the others waiting, and the
+call is cancelled once all its callers are gone.
+
+Usage:
+Run these tests using a pytest runner to validate the single-flight layer.
+
+Dependencies:
+- pytest
+"""
+
+import asyncio
+
+import pytest
+
+from peb import metrics
+from peb.singleflight import SingleFlight
+
+
+class Request:
+    """Record the calls and answer each key with its upper case after a delay."""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.cancelled = False
+        self.error = error
+
+    async def __call__(self, key):
+        self.calls.append(key)
+        try:
+            await asyncio.sleep(0.02)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return key.upper()
+
+
+def test_identical_calls_share_one_call():
+    """Concurrent calls of a key share one call; other keys and later calls make their own."""
+    request = Request()
+    flight = SingleFlight("test-shared")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run(key, request, key) for key in "aab"))
+        return results, await flight.run("a", request, "a")
+
+    assert asyncio.run(scenario()) == (["A", "A", "B"], "A")
+    assert request.calls == ["a", "b", "a"]
+    assert flight.collapsed == 1
+    assert metrics.collapsed_requests.value("test-shared") == 1
+    assert flight.in_flight() == 0
+
+
+def test_error_reaches_every_caller():
+    """A failed call raises its error in all its callers."""
+    flight = SingleFlight("test-error")
+    request = Request(error=ValueError("down"))
+
+    async def scenario():
+        return await asyncio.gather(flight.run("a", request, "a"), flight.run("a", request, "a"),
+                                    return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(scenario())] == ["down", "down"]
+    assert request.calls == ["a"]
+
+
+def test_call_is_cancelled_with_its_last_caller():
+    """A cancelled caller leaves the call to the others; without callers it is cancelled."""
+    flight = SingleFlight("test-cancel")
+    request = Request()
+
+    async def scenario():
+        first = asyncio.create_task(flight.run("a", request, "a"))
+        second = asyncio.create_task(flight.run("a", request, "a"))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = await second
+        third = asyncio.create_task(flight.run("b", request, "b"))
+        await asyncio.sleep(0)
+        third.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0)
+        return result, first.cancelled()
+
+    assert asyncio.run(scenario()) == ("A", True)
+    assert request.calls == ["a", "b"]
+    assert request.cancelled
+    assert flight.in_flight() == 0
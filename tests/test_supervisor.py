@@ -0,0 +1,187 @@
+"""
+Unit Testing Module for the supervisor
+
+This module contains unit tests for the supervisor mode: the consistent-hash ring only moves
+the keys of the node that is added or removed, updates are sharded by chat, and the supervisor
+forwards each update to the worker of its chat.
+
+Usage:
+Run these tests using a pytest runner to validate the supervisor's behaviour.
+
+Dependencies:
+- pytest
+- httpx
+"""
+
+import asyncio
+import json
+
+import httpx
+from telegram import Update
+
+from peb.http_server import HttpServer, Response
+from peb.supervisor import HashRing, Supervisor, chat_id
+
+
+def test_ring_moves_only_the_keys_of_a_new_node():
+    """Adding a fourth node moves about a quarter of the keys, all of them to the new node."""
+    ring = HashRing(["worker-0", "worker-1", "worker-2"])
+    before = {key: ring.get(key) for key in range(10000)}
+    ring.add("worker-3")
+    moved = [key for key in before if ring.get(key) != before[key]]
+
+    assert all(ring.get(key) == "worker-3" for key in moved)
+    assert 0.15 < len(moved) / len(before) < 0.35
+
+    ring.remove("worker-3")
+    assert {key: ring.get(key) for key in before} == before
+
+
+def test_chat_id_of_messages_and_callback_queries():
+    """Messages and button presses of a chat share the sharding key."""
+    chat = {"id": 42, "type": "private"}
+    user = {"id": 7, "is_bot": False, "first_name": "user"}
+    message = {"update_id": 1, "message": {"message_id": 1, "chat": chat, "from": user}}
+    callback = {"update_id": 2, "callback_query": {"id": "1", "from": user, "data": "how",
+                                                   "message": {"message_id": 2, "chat": chat}}}
+    inline = {"update_id": 3, "inline_query": {"id": "1", "from": user, "query": ""}}
+
+    assert chat_id(message) == chat_id(callback) == 42
+    assert chat_id(inline) == 7
+
+
+def test_updates_are_forwarded_to_the_worker_of_their_chat():
+    """Every update of a chat reaches the same worker, with the supervisor's secret token."""
+    received: dict[str, list] = {"worker-0": [], "worker-1": []}
+    tokens = set()
+
+    def worker(name):
+        async def handle(request):
+            tokens.add(request.headers.get("x-telegram-bot-api-secret-token"))
+            received[name].append(json.loads(request.body)["message"]["chat"]["id"])
+            return Response(200)
+        return handle
+
+    async def run():
+        supervisor = Supervisor(worker=None)
+        servers = []
+        for name in received:
+            server = HttpServer({"/update": worker(name)})
+            await server.start()
+            servers.append(server)
+            supervisor._urls[name] = f"http://127.0.0.1:{server.port}/update"
+            supervisor.ring.add(name)
+        supervisor.public_secret = "secret"
+        webhook = HttpServer({"/telegram": supervisor.handle}, methods=("POST",))
+        await webhook.start()
+        async with httpx.AsyncClient() as client:
+            for update_id, chat in enumerate([1, 2, 3, 1, 2, 3, 4, 5]):
+                update = {"update_id": update_id,
+                          "message": {"message_id": 1, "chat": {"id": chat}}}
+                response = await client.post(
+                    f"http://127.0.0.1:{webhook.port}/telegram", json=update,
+                    headers={"X-Telegram-Bot-Api-Secret-Token": "secret"},
+                )
+                assert response.status_code == 200
+            forbidden = await client.post(f"http://127.0.0.1:{webhook.port}/telegram", json={})
+        await supervisor.client.aclose()
+        for server in [webhook, *servers]:
+            await server.stop()
+        return supervisor, forbidden.status_code
+
+    supervisor, forbidden = asyncio.run(run())
+
+    assert forbidden == 403
+    assert tokens == {supervisor.secret_token}
+    assert sum(supervisor.forwarded.values()) == 8
+    for name, chats in received.items():
+        assert all(supervisor.ring.get(chat) == name for chat in chats)
+
+
+def test_polling_fetches_again_the_updates_a_worker_refused():
+    """A refused update is fetched again, without forwarding twice the updates after it."""
+    received: dict[str, list] = {"worker-0": [], "worker-1": []}
+    offsets = []
+    refused = set()
+
+    def worker(name):
+        async def handle(request):
+            update_id = json.loads(request.body)["update_id"]
+            if update_id == 2 and update_id not in refused:
+                refused.add(update_id)
+                return Response(503)
+            received[name].append(update_id)
+            return Response(200)
+        return handle
+
+    class FakeBot:
+        async def delete_webhook(self):
+            return True
+
+        async def get_updates(self, offset, **kwargs):
+            offsets.append(offset)
+            if len(offsets) == 3:
+                stop.set()
+            return [Update.de_json({"update_id": update_id, "message": {
+                "message_id": update_id, "date": 0, "chat": {"id": chat, "type": "private"},
+            }}, None) for update_id, chat in ((1, 1), (2, 2), (3, 1), (4, 2))
+                if update_id >= (offset or 0)]
+
+    async def run():
+        supervisor = Supervisor(worker=None)
+        servers = []
+        for name in received:
+            server = HttpServer({"/update": worker(name)})
+            await server.start()
+            servers.append(server)
+            supervisor._urls[name] = f"http://127.0.0.1:{server.port}/update"
+            supervisor.ring.add(name)
+        await supervisor.poll(FakeBot(), stop)
+        await supervisor.client.aclose()
+        for server in servers:
+            await server.stop()
+        return supervisor
+
+    stop = asyncio.Event()
+    supervisor = asyncio.run(run())
+
+    assert offsets == [None, 2, 5]
+    assert sorted(received["worker-0"] + received["worker-1"]) == [1, 2, 3, 4]
+    assert all(updates == sorted(updates) for updates in received.values())
+    assert supervisor.failed == 1
+
+
+def test_forwarding_waits_for_the_hand_over_of_the_chats():
+    """While the ring changes, updates wait until every worker flushed, then loaded its chats."""
+    steps = []
+
+    def worker(name):
+        async def handle(request):
+            steps.append((name, json.loads(request.body)["step"]))
+            return Response(200)
+
+        async def update(_request):
+            steps.append((name, "update"))
+            return Response(200)
+        return {"/handover": handle, "/update": update}
+
+    async def run():
+        supervisor = Supervisor(worker=None)
+        server = HttpServer(worker("worker-0"))
+        await server.start()
+        supervisor._urls["worker-0"] = f"http://127.0.0.1:{server.port}/update"
+        supervisor.ring.add("worker-0")
+        await supervisor._hold()
+        forward = asyncio.create_task(supervisor.forward({"update_id": 1}))
+        await asyncio.sleep(0.1)
+        held = not forward.done()
+        await supervisor._release()
+        accepted = await forward
+        await supervisor.client.aclose()
+        await server.stop()
+        return held, accepted
+
+    held, accepted = asyncio.run(run())
+
+    assert held and accepted
+    assert steps == [("worker-0", "flush"), ("worker-0", "load"), ("worker-0", "update")]
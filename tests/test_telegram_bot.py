@@ -24,14 +24,34 @@ Dependencies:
 - python-telegram-bot
 """
 
+import asyncio
 from unittest.mock import Mock
 
 import pytest
 from telegram import Chat, Message, Update
+from telegram.error import NetworkError
 from telegram.ext import CallbackContext
 
-from peb.data import BotState
-from peb.telegram_bot import process_dict
+from peb import metrics
+from peb.cache import make_key
+from peb.data import MESSAGE, BotState, steps
+from peb.persistence import SQLitePersistence
+from peb.telegram_bot import (
+    BANNED_MESSAGE,
+    MODERATION_KEY,
+    PLACEHOLDER,
+    STILL_WORKING,
+    build_application,
+    build_keyboard,
+    button,
+    flush_chats,
+    load_chats,
+    process_dict,
+    speculations,
+    stream_reply,
+    sweep_sessions,
+    take_speculation,
+)
 
 
 # Sample test for the 'start' function
@@ -82,7 +102,7 @@ def test_state_function(state, expected_next_state, mocker):
     update.message.text = "/start"
 
     # Mocking the reply_text method
-    update.message.reply_text = mocker.Mock()
+    update.message.reply_text = mocker.AsyncMock()
     update.message.reply_text.return_value = None
 
     update_message_callback_mock = mocker.patch("peb.telegram_bot.update_message_callback")
@@ -92,7 +112,362 @@ def test_state_function(state, expected_next_state, mocker):
     assemble_prompt_mock.return_value = "Welcome to the bot!", "What's your goal?"
 
     # Call the start function
-    result = process_dict[state](update, context)
+    result = asyncio.run(process_dict[state](update, context))
 
     # Assert that the function returns the correct next state
     assert result == expected_next_state
+
+
+class SlowOpenAI:
+    """OpenAI stub whose completion takes longer than its moderation."""
+
+    prompt_enhancement_instruction = "Refine"
+
+    def __init__(self, flagged=False):
+        self.flagged = flagged
+        self.completion_cancelled = False
+
+    async def moderate(self, prompt, user=None):  # pylint: disable=unused-argument
+        """Return the configured verdict after a short delay."""
+        await asyncio.sleep(0.01)
+        return True, None, self.flagged
+
+    async def create(self, **kwargs):  # pylint: disable=unused-argument
+        """Return a completion after a longer delay."""
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.completion_cancelled = True
+            raise
+        return True, None, Mock(choices=[Mock(message=Mock(content="Enhanced"))])
+
+
+@pytest.mark.parametrize("flagged, expected_text", [
+    (False, "Enhanced"),
+    (True, "Your prompt contains banned content and it cannot be processed."),
+])
+def test_open_ai_speculative(flagged, expected_text, mocker):
+    """
+    The enhancement runs alongside the moderation and is only shown if the prompt passes;
+    a flagged prompt cancels the completion.
+    """
+    openai_obj = SlowOpenAI(flagged)
+    mocker.patch("peb.telegram_bot.OpenAI", return_value=openai_obj)
+    mocker.patch("peb.telegram_bot.SPECULATIVE_MODERATION", True)
+    mocker.patch("peb.telegram_bot.INCREMENTAL_MODERATION", False)
+    mocker.patch("peb.telegram_bot.STREAM", False)
+    mocker.patch("peb.telegram_bot.assemble_prompt", return_value=("My goal is: x", ""))
+    send_mock = mocker.patch("peb.telegram_bot.update_message_callback")
+    context = Mock(spec=CallbackContext)
+    context.user_data = {}
+
+    asyncio.run(process_dict["openai"](Mock(spec=Update), context))
+
+    assert send_mock.await_args_list[-1].args[1] == expected_text
+    assert openai_obj.completion_cancelled == flagged
+
+
+class CountingOpenAI(SlowOpenAI):
+    """OpenAI stub recording the moderated texts and flagging those containing "bomb"."""
+
+    def __init__(self):
+        super().__init__()
+        self.moderated = []
+
+    async def moderate(self, prompt, user=None):
+        self.moderated.append(prompt)
+        await asyncio.sleep(0.01)
+        return True, None, "bomb" in prompt
+
+
+@pytest.mark.parametrize("task, expected_text, requested", [
+    ("Teach basics", "Enhanced", []),
+    ("Make a bomb", BANNED_MESSAGE, ["Make a bomb"]),
+])
+def test_answers_are_moderated_in_the_background(task, expected_text, requested, mocker):
+    """
+    Each answer is moderated while the user reads the next step; the final step reuses the
+    verdicts and only moderates the answers that changed since.
+    """
+    openai_obj = CountingOpenAI()
+    mocker.patch("peb.telegram_bot.OpenAI", return_value=openai_obj)
+    mocker.patch("peb.telegram_bot.INCREMENTAL_MODERATION", True)
+    mocker.patch("peb.telegram_bot.STREAM", False)
+    send_mock = mocker.patch("peb.telegram_bot.update_message_callback")
+    context = Mock(spec=CallbackContext)
+    context.user_data = {}
+
+    def answer(text):
+        update = Mock(spec=Update)
+        update.effective_user.id = 42
+        update.message = Mock(spec=Message, text=text, reply_text=mocker.AsyncMock())
+        return update
+
+    async def scenario():
+        await process_dict["goal"](answer("Learn Python"), context)
+        await process_dict["task"](answer("Teach basics"), context)
+        await asyncio.sleep(0.05)
+        context.user_data["task"] = task
+        await process_dict["openai"](answer(""), context)
+
+    asyncio.run(scenario())
+
+    assert send_mock.await_args_list[-1].args[1] == expected_text
+    assert openai_obj.moderated == ["Learn Python", "Teach basics", *requested]
+    assert context.user_data[MODERATION_KEY]["goal"][1] is False
+
+
+def test_draft_is_enhanced_while_the_user_reviews_it(mocker):
+    """
+    The enhancement requested when the draft is shown is handed over to "Perfect my prompt";
+    a speculation for a draft that changed is cancelled and its tokens counted as wasted.
+    """
+    openai_obj = SlowOpenAI()
+    openai_obj.create = mocker.AsyncMock(wraps=openai_obj.create)
+    mocker.patch("peb.telegram_bot.OpenAI", return_value=openai_obj)
+    mocker.patch("peb.telegram_bot.SPECULATIVE_ENHANCEMENT", True)
+    mocker.patch("peb.telegram_bot.INCREMENTAL_MODERATION", False)
+    mocker.patch("peb.telegram_bot.STREAM", True)
+    send_mock = mocker.patch("peb.telegram_bot.update_message_callback")
+    mocker.patch("peb.telegram_bot.send_step")
+    update = Mock(spec=Update)
+    update.effective_user.id = 7
+    update.message = Mock(spec=Message, text="Make it testable")
+    context = Mock(spec=CallbackContext)
+    context.user_data = {"goal": "Learn Python", "task": "Teach basics"}
+    hits = metrics.speculations.value("hit")
+    misses = metrics.speculations.value("miss")
+    wasted = metrics.speculation_wasted_tokens.value()
+
+    async def scenario():
+        await process_dict["quality"](update, context)
+        context.user_data["goal"] = "Learn Rust"
+        await process_dict["quality"](update, context)
+        await asyncio.sleep(0.1)
+        await process_dict["openai"](update, context)
+
+    asyncio.run(scenario())
+
+    assert send_mock.await_args_list[-1].args[1] == "Enhanced"
+    assert openai_obj.create.call_count == 2
+    assert "Learn Rust" in openai_obj.create.call_args.kwargs["prompt"]
+    assert metrics.speculations.value("hit") == hits + 1
+    assert metrics.speculations.value("miss") == misses + 1
+    assert metrics.speculation_wasted_tokens.value() > wasted
+
+
+def test_failed_and_cancelled_speculations_are_not_handed_over():
+    """A speculation that failed or was cancelled is dropped and counted as failed."""
+    async def fail():
+        raise ValueError("down")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        failed = loop.create_task(fail())
+        cancelled = loop.create_task(asyncio.sleep(60))
+        cancelled.cancel()
+        await asyncio.gather(failed, cancelled, return_exceptions=True)
+        taken = []
+        for user, task in ((11, failed), (12, cancelled)):
+            speculations[user] = (make_key("draft", ""), task, "draft")
+            taken.append(take_speculation(user, "draft", ""))
+        return taken
+
+    failures = metrics.speculations.value("failed")
+
+    assert asyncio.run(scenario()) == [None, None]
+    assert 11 not in speculations and 12 not in speculations
+    assert metrics.speculations.value("failed") == failures + 2
+
+
+def test_repeated_taps_share_one_enhancement(mocker):
+    """
+    "Perfect my prompt" pressed again while the draft is being enhanced is only acknowledged;
+    once the enhancement is sent, a new press requests it again.
+    """
+    openai_obj = SlowOpenAI()
+    openai_obj.create = mocker.AsyncMock(wraps=openai_obj.create)
+    mocker.patch("peb.telegram_bot.OpenAI", return_value=openai_obj)
+    mocker.patch("peb.telegram_bot.INCREMENTAL_MODERATION", False)
+    mocker.patch("peb.telegram_bot.STREAM", False)
+    mocker.patch("peb.telegram_bot.assemble_prompt", return_value=("My goal is: x", ""))
+    send_mock = mocker.patch("peb.telegram_bot.update_message_callback")
+    update = Mock(spec=Update)
+    update.effective_user.id = 9
+    context = Mock(spec=CallbackContext)
+    context.user_data = {}
+    collapsed = metrics.collapsed_requests.value("openai")
+
+    async def scenario():
+        await asyncio.gather(*(process_dict["openai"](update, context) for _ in range(3)))
+        await process_dict["openai"](update, context)
+
+    asyncio.run(scenario())
+
+    texts = [call.args[1] for call in send_mock.await_args_list]
+    assert texts.count(STILL_WORKING) == 2
+    assert texts.count("Enhanced") == 2
+    assert openai_obj.create.call_count == 2
+    assert metrics.collapsed_requests.value("openai") == collapsed + 2
+
+
+@pytest.mark.parametrize("single_message, state, expected_calls", [
+    (True, "start", 1),
+    (True, "goal", 1),
+    (True, "quality", 1),
+    (False, "start", 4),
+    (False, "goal", 3),
+    (False, "quality", 3),
+])
+def test_messages_per_step(single_message, state, expected_calls, mocker):
+    """
+    A step is rendered as one message with its keyboard, instead of one message per part
+    followed by the keyboard.
+    """
+    mocker.patch("peb.telegram_bot.SINGLE_MESSAGE", single_message)
+    update = Mock(spec=Update)
+    update.message = Mock(spec=Message)
+    update.message.text = "Learn Python"
+    update.message.reply_text = mocker.AsyncMock()
+    context = Mock(spec=CallbackContext)
+    context.user_data = {"goal": "Learn Python"}
+
+    asyncio.run(process_dict[state](update, context))
+
+    assert update.message.reply_text.await_count == expected_calls
+    assert update.message.reply_text.await_args.kwargs["reply_markup"] is not None
+
+
+def test_stream_reply_coalesces_edits(mocker):
+    """
+    The placeholder is edited at once with the first delta, then at most once per interval,
+    and ends with the whole text.
+    """
+    mocker.patch("peb.telegram_bot.STREAM_EDIT_INTERVAL", 0.05)
+    placeholder = Mock(spec=Message)
+    placeholder.edit_text = mocker.AsyncMock()
+    update = Mock(spec=Update)
+    update.message = Mock(spec=Message)
+    update.message.reply_text = mocker.AsyncMock(return_value=placeholder)
+
+    async def deltas():
+        for word in ["Act ", "as ", "a ", "Python ", "teacher."] * 10:
+            await asyncio.sleep(0.005)
+            yield word
+
+    text = asyncio.run(stream_reply(update, deltas()))
+
+    assert text == "Act as a Python teacher." * 10
+    update.message.reply_text.assert_awaited_once_with(PLACEHOLDER)
+    edits = [call.args[0] for call in placeholder.edit_text.await_args_list]
+    assert edits[0] == "Act "
+    assert edits[-1] == text
+    assert 2 <= len(edits) <= 8
+
+
+def test_stream_is_closed_when_telegram_fails(mocker):
+    """A stream whose placeholder cannot be sent is closed before the error is raised."""
+    response = Mock()
+    response.close = mocker.AsyncMock()
+    openai_obj = SlowOpenAI()
+    openai_obj.stream = mocker.AsyncMock(return_value=(True, None, response))
+    mocker.patch("peb.telegram_bot.OpenAI", return_value=openai_obj)
+    mocker.patch("peb.telegram_bot.INCREMENTAL_MODERATION", False)
+    mocker.patch("peb.telegram_bot.SPECULATIVE_ENHANCEMENT", False)
+    mocker.patch("peb.telegram_bot.STREAM", True)
+    mocker.patch("peb.telegram_bot.assemble_prompt", return_value=("My goal is: x", ""))
+    mocker.patch("peb.telegram_bot.update_message_callback")
+    update = Mock(spec=Update)
+    update.effective_user.id = 13
+    update.message = Mock(spec=Message)
+    update.message.reply_text = mocker.AsyncMock(side_effect=NetworkError("Bad Gateway"))
+    context = Mock(spec=CallbackContext)
+    context.user_data = {}
+
+    with pytest.raises(NetworkError):
+        asyncio.run(process_dict["openai"](update, context))
+
+    response.close.assert_awaited()
+
+
+def test_canvas_is_compiled_once():
+    """Each step knows the state that follows it and reuses one keyboard for every update."""
+    assert [steps[name].next_state for name in ("goal", "whom", "quality")] == [
+        BotState.PERSONA, BotState.HOW, BotState.OPENAI]
+    assert steps["openai"].next_state is None
+    assert build_keyboard("format") is build_keyboard("format")
+    assert [[button.callback_data for button in row]
+            for row in build_keyboard("format").inline_keyboard] == [["start"], ["format"]]
+    assert steps["goal"].reply.endswith(MESSAGE)
+
+
+@pytest.mark.parametrize("data, expected_state", [
+    ("format", BotState.CONSTRAINTS),
+    ("quality", BotState.OPENAI),
+    ("start", BotState.GOAL),
+])
+def test_button_moves_the_conversation(data, expected_state, mocker):
+    """A button returns the state of the step it leads to, so the conversation follows it."""
+    mocker.patch("peb.telegram_bot.send_step")
+    update = Mock(spec=Update)
+    update.message = None
+    update.callback_query = Mock()
+    update.callback_query.data = data
+    update.callback_query.answer = mocker.AsyncMock()
+    update.callback_query.message.text = steps[data].reply
+    context = Mock(spec=CallbackContext)
+    context.user_data = {"goal": "Learn Python"}
+
+    assert asyncio.run(button(update, context)) == expected_state
+
+
+def test_idle_sessions_are_evicted_with_their_conversation():
+    """The sweep drops the idle sessions and their conversation state, and keeps the others."""
+    # pylint: disable=protected-access
+
+    async def sweep():
+        application = build_application("123:ABC", metrics_port=0)
+        conversations = application.handlers[0][0]._conversations
+        for user_id, last_seen in ((1, 0.0), (2, 100_000.0)):
+            application._user_data[user_id]["goal"] = "Learn Python"
+            application._user_data[user_id].touch(now=last_seen)
+            conversations[(user_id, user_id)] = BotState.TASK
+        return sweep_sessions(application, now=100_000.0), application, conversations
+
+    evicted = metrics.sessions_evicted.value("idle")
+    count, application, conversations = asyncio.run(sweep())
+
+    assert count == 1
+    assert list(application.user_data) == [2]
+    assert list(conversations) == [(2, 2)]
+    assert metrics.sessions_evicted.value("idle") == evicted + 1
+
+
+def test_moved_chats_resume_from_the_state_of_their_previous_worker(tmp_path, mocker):
+    """After the hand-over, the new worker of a chat continues where the old one stopped."""
+    # pylint: disable=protected-access
+    mocker.patch("telegram.ext.ExtBot.initialize", mocker.AsyncMock())
+    path = str(tmp_path / "state.sqlite3")
+
+    async def move():
+        old, new = (build_application("123:ABC", persistence=SQLitePersistence(path, 3600),
+                                      metrics_port=0) for _ in range(2))
+        await old.initialize()
+        await new.initialize()
+        old._user_data[1]["goal"] = "Learn Python"
+        old.mark_data_for_update_persistence(user_ids=1)
+        old.handlers[0][0]._conversations[(1, 1)] = BotState.PERSONA
+        await flush_chats(old)
+        await load_chats(old, lambda user_id: False)
+        await load_chats(new, lambda user_id: True)
+        moved = (dict(old.user_data), dict(new.user_data),
+                 dict(new.handlers[0][0]._conversations))
+        await old.shutdown()
+        await new.shutdown()
+        return moved
+
+    old_data, new_data, conversations = asyncio.run(move())
+
+    assert old_data == {}
+    assert new_data == {1: {"goal": "Learn Python"}}
+    assert conversations == {(1, 1): BotState.PERSONA}
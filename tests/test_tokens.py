@@ -0,0 +1,63 @@
+"""
+Unit Testing Module for the token budgets
+
+This module contains unit tests for peb.tokens: the local token estimate, the compaction of the
+answers, the truncation to a budget and the sharing of the total budget among the fields.
+
+Usage:
+Run these tests using a pytest runner to validate the token budgets.
+
+Dependencies:
+- pytest
+"""
+
+from peb.tokens import compact, count_tokens, fit_fields, max_tokens_for, truncate
+
+INBOX = " ".join(
+    f"Email {number}: the meeting moved to Tuesday at 10am, please confirm attendance."
+    for number in range(200)
+)
+
+
+def test_count_tokens_of_common_text():
+    """Short words are one token each, with their leading space; long words cost more."""
+    assert count_tokens("") == 0
+    assert count_tokens("Hello world") == 2
+    assert count_tokens("Learn the basics of Python.") == 6
+    assert count_tokens("internationalization") > count_tokens("international")
+
+
+def test_compact_collapses_whitespace_and_repetitions():
+    """Runs of spaces, blank lines and repeated sentences are removed."""
+    text = "Summarize my inbox.  Summarize my inbox.\n\n\n  From:   me\nFrom: me\n"
+
+    assert compact(text) == "Summarize my inbox.\nFrom: me"
+
+
+def test_truncate_keeps_the_beginning_and_the_end():
+    """A long text is cut to the budget around an ellipsis, on sentence boundaries."""
+    shortened = truncate(INBOX, 100)
+
+    assert count_tokens(shortened) <= 100
+    assert shortened.startswith("Email 0: ")
+    assert shortened.endswith("Email 199: the meeting moved to Tuesday at 10am, please confirm "
+                              "attendance.")
+    assert " [...] " in shortened
+    assert truncate("Learn Python", 100) == "Learn Python"
+
+
+def test_fit_fields_truncates_the_longest_fields_first():
+    """The short answers are kept whole; the long ones share what is left of the budget."""
+    fields = fit_fields({"goal": "Learn Python", "task": INBOX, "how": INBOX[:2000]},
+                        total=400, per_field=300)
+
+    assert fields["goal"] == "Learn Python"
+    assert sum(count_tokens(text) for text in fields.values()) <= 400
+    assert count_tokens(fields["task"]) <= 300
+    assert list(fields) == ["goal", "task", "how"]
+
+
+def test_max_tokens_leaves_room_in_the_context():
+    """The output budget shrinks when the prompt fills the context window."""
+    assert max_tokens_for(300, max_tokens=700, context=4096) == 700
+    assert max_tokens_for(3800, max_tokens=700, context=4096) == 296
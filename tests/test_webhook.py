@@ -0,0 +1,68 @@
+"""
+Unit Testing Module for the webhook
+
+This module contains unit tests for the WebhookServer class: updates posted with the right
+secret token are acknowledged and queued for the handlers, the others are rejected.
+
+Usage:
+Run these tests using a pytest runner to validate the webhook's behaviour.
+
+Dependencies:
+- pytest
+- httpx
+- python-telegram-bot
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from peb.webhook import WebhookServer, run_webhook
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1, "date": 0, "text": "Learn Python",
+        "chat": {"id": 42, "type": "private"},
+    },
+}
+
+
+@pytest.mark.parametrize("headers, body, status, queued", [
+    ({"X-Telegram-Bot-Api-Secret-Token": "s3cret"}, UPDATE, 200, 1),
+    ({"X-Telegram-Bot-Api-Secret-Token": "wrong"}, UPDATE, 403, 0),
+    ({}, UPDATE, 403, 0),
+    ({"X-Telegram-Bot-Api-Secret-Token": "s3cret"}, ["not", "an", "update"], 400, 0),
+])
+def test_webhook_queues_updates(headers, body, status, queued):
+    """Only updates carrying the secret token reach the update queue."""
+    application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+
+    async def post():
+        server = WebhookServer(application, "/telegram", "s3cret", "127.0.0.1", 0)
+        await server.start()
+        try:
+            async with httpx.AsyncClient() as client:
+                return await client.post(
+                    f"http://127.0.0.1:{server.server.port}/telegram", json=body,
+                    headers=headers,
+                )
+        finally:
+            await server.stop()
+
+    response = asyncio.run(post())
+
+    assert response.status_code == status
+    assert application.update_queue.qsize() == queued
+    if queued:
+        assert application.update_queue.get_nowait().message.chat.id == 42
+
+
+def test_webhook_requires_a_secret_token():
+    """A webhook registered with Telegram does not start without a secret token."""
+    application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_webhook(application, "https://example.com/telegram", secret_token=None))